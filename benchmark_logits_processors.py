@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark incremental vs stock repetition logits processors
+
+Replays a decode loop of N generated tokens (after a 128-token prompt) over a
+Gemma-sized vocabulary and times the per-step cost of
+no_repeat_ngram_size=3 + repetition_penalty=1.5, as used by
+TransformersMultimodalBackend. No model is needed: scores are random and the
+next token is the argmax of the processed scores, so both implementations
+must pick the same tokens.
+
+Usage:
+    python benchmark_logits_processors.py
+    python benchmark_logits_processors.py --lengths 512 1024 2048 --vocab 262144
+"""
+
+import sys
+import argparse
+import time
+
+sys.path.insert(0, 'examples')
+sys.path.insert(0, 'examples/backends')
+
+
+def run_decode(processors, prompt, scores, steps):
+    """Feed `steps` tokens through processors; returns (per-step times, tokens)"""
+    import torch
+
+    input_ids = prompt
+    times = []
+    tokens = []
+    for step in range(steps):
+        start = time.perf_counter()
+        processed = processors(input_ids, scores[step % len(scores)].unsqueeze(0))
+        times.append(time.perf_counter() - start)
+        token = int(processed.argmax())
+        tokens.append(token)
+        input_ids = torch.cat([input_ids, torch.tensor([[token]])], dim=1)
+    return times, tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[512, 1024, 2048])
+    parser.add_argument("--vocab", type=int, default=262144, help="Vocabulary size (Gemma 3: 262144)")
+    parser.add_argument("--prompt", type=int, default=128, help="Prompt tokens")
+    args = parser.parse_args()
+
+    import torch
+    from transformers import LogitsProcessorList, NoRepeatNGramLogitsProcessor, RepetitionPenaltyLogitsProcessor
+    from logits_processors import repetition_processors
+
+    torch.manual_seed(0)
+    # Small token range so that n-grams actually repeat and get banned
+    prompt = torch.randint(0, 2000, (1, args.prompt))
+    scores = torch.randn(64, args.vocab)
+    scores[:, :2000] += 4.0
+
+    configs = [
+        ("no_repeat_ngram_size=3", lambda: [NoRepeatNGramLogitsProcessor(3)],
+         lambda: repetition_processors(no_repeat_ngram_size=3)),
+        ("repetition_penalty=1.5", lambda: [RepetitionPenaltyLogitsProcessor(penalty=1.5)],
+         lambda: repetition_processors(repetition_penalty=1.5)),
+        ("both", lambda: [RepetitionPenaltyLogitsProcessor(penalty=1.5), NoRepeatNGramLogitsProcessor(3)],
+         lambda: repetition_processors(repetition_penalty=1.5, no_repeat_ngram_size=3)),
+    ]
+
+    for name, make_stock, make_incremental in configs:
+        print("=" * 80)
+        print(f"{name}, vocab={args.vocab}, prompt={args.prompt} tokens")
+        print("=" * 80)
+        print(f"{'tokens':>8} {'stock ms/step':>14} {'incr ms/step':>13} {'stock last':>11} {'incr last':>10} {'speedup':>8} same")
+
+        for length in args.lengths:
+            stock_times, stock_tokens = run_decode(LogitsProcessorList(make_stock()), prompt, scores, length)
+            incr_times, incr_tokens = run_decode(make_incremental(), prompt, scores, length)
+
+            # Mean over all steps, and over the last 10% (where the stock cost peaks)
+            tail = max(1, length // 10)
+            stock_ms = 1000 * sum(stock_times) / length
+            incr_ms = 1000 * sum(incr_times) / length
+            stock_tail = 1000 * sum(stock_times[-tail:]) / tail
+            incr_tail = 1000 * sum(incr_times[-tail:]) / tail
+            print(f"{length:>8} {stock_ms:>14.3f} {incr_ms:>13.3f} {stock_tail:>11.3f} {incr_tail:>10.3f} "
+                  f"{stock_ms / incr_ms:>7.1f}x {stock_tokens == incr_tokens}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -57,7 +57,9 @@ gcloud services enable \
 
 # Build container image
 echo "Building container image..."
-docker build -t ${IMAGE_NAME} .
+# The build context is the repository root: the image also copies shared modules from examples/backends
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+docker build -t ${IMAGE_NAME} -f "${SCRIPT_DIR}/Dockerfile" "${SCRIPT_DIR}/.."
 
 # Push to Google Container Registry
 echo "Pushing image to GCR..."
@@ -0,0 +1,398 @@
+"""
+Continuous batching engine for the TranslateGemma Cloud Run service
+
+The engine owns the model in a background thread and batches requests at the
+level of single decode steps: new requests join the running batch before each
+step, and finished sequences leave it right after the step that finished them.
+A long translation no longer holds up the short ones queued behind it.
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+from dataclasses import dataclass
+from typing import List, Optional
+
+import torch
+
+# Shared with the example backends (copied next to this file in the image)
+from prefix_cache import PrefixCache, cache_to_layers, layers_to_cache
+from speculative import NgramProposer
+from stopping import RepetitionDetector
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class GenerationResult:
+    """Output of one engine request"""
+    token_ids: List[int]
+    draft_tokens: int = 0
+    accepted_draft_tokens: int = 0
+    repetition_stopped: bool = False
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted_draft_tokens / self.draft_tokens if self.draft_tokens > 0 else 0.0
+
+
+class _Sequence:
+    """State of one request inside the engine"""
+
+    def __init__(self, input_ids: List[int], max_new_tokens: int,
+                 future: asyncio.Future, loop: asyncio.AbstractEventLoop,
+                 prefix_ids: Optional[List[int]] = None, prompt_lookup: bool = False):
+        self.input_ids = input_ids
+        self.max_new_tokens = max_new_tokens
+        self.prefix_ids = prefix_ids
+        self.future = future
+        self.loop = loop
+        self.generated: List[int] = []
+        # Number of real (non-padding) tokens in the KV cache for this sequence
+        self.position = 0
+        # Prompt lookup over prompt + generated tokens (None = plain greedy)
+        self.lookup = NgramProposer(input_ids) if prompt_lookup else None
+        self.repetition = RepetitionDetector()
+        self.draft_tokens = 0
+        self.accepted_draft_tokens = 0
+
+    def append(self, tokens: List[int]):
+        self.generated.extend(tokens)
+        self.repetition.extend(tokens)
+        if self.lookup is not None:
+            self.lookup.add(tokens)
+
+    def result(self) -> GenerationResult:
+        # Keep a single copy of a repeated unit; tokens after the detection point go too
+        return GenerationResult(
+            self.generated[:len(self.repetition.tokens) - self.repetition.excess_tokens],
+            self.draft_tokens,
+            self.accepted_draft_tokens,
+            self.repetition.detected is not None
+        )
+
+
+def _left_pad(tensor: torch.Tensor, length: int, dim: int) -> torch.Tensor:
+    """Left-pad a tensor with zeros along dim up to length"""
+    missing = length - tensor.shape[dim]
+    if missing <= 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[dim] = missing
+    return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+
+def _resolve(future: asyncio.Future, result=None, error: Optional[BaseException] = None):
+    """Complete a future from the event loop thread (ignores abandoned futures)"""
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class ContinuousBatchingEngine:
+    """Iteration-level (continuous) batching over a causal LM
+
+    Greedy decoding only, matching the service's do_sample=False. Requests
+    can opt into prompt lookup: each step also verifies draft tokens copied
+    from the request's own prompt, so several tokens may be accepted per step.
+
+    Usage:
+        engine = ContinuousBatchingEngine(model, tokenizer, max_batch_size=8)
+        engine.start()
+        token_ids = await engine.submit(input_ids, max_new_tokens=256)
+        engine.stop()
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size: int = 8,
+                 prefix_cache_bytes: int = 256 * 1024 * 1024):
+        """
+        Args:
+            model: Loaded causal LM (only ever called from the engine thread)
+            tokenizer: Matching tokenizer (used for EOS ids)
+            max_batch_size: Maximum number of sequences decoded together
+            prefix_cache_bytes: Memory cap for cached prompt-prefix KV tensors
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.prefix_cache = PrefixCache(prefix_cache_bytes)
+        self.eos_token_ids = self._collect_eos_ids()
+
+        self._pending: "queue.Queue[_Sequence]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+        # Running batch: sequences plus their left-padded KV cache and mask
+        self._active: List[_Sequence] = []
+        self._layers: List[tuple] = []
+        self._mask: Optional[torch.Tensor] = None
+
+        # Counters for /health and logs
+        self.steps = 0
+        self.completed = 0
+        self.cancelled = 0
+
+    def _collect_eos_ids(self) -> set:
+        eos_ids = set()
+        config_eos = getattr(self.model.generation_config, "eos_token_id", None)
+        if isinstance(config_eos, int):
+            eos_ids.add(config_eos)
+        elif config_eos:
+            eos_ids.update(config_eos)
+        if self.tokenizer.eos_token_id is not None:
+            eos_ids.add(self.tokenizer.eos_token_id)
+        return eos_ids
+
+    @property
+    def active_sequences(self) -> int:
+        return len(self._active)
+
+    @property
+    def queued_sequences(self) -> int:
+        return self._pending.qsize()
+
+    def start(self):
+        """Start the background decode loop"""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="batching-engine", daemon=True)
+        self._thread.start()
+        logger.info(f"Continuous batching engine started (max_batch_size={self.max_batch_size})")
+
+    def stop(self):
+        """Stop the decode loop; in-flight requests fail with RuntimeError"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._fail_all(RuntimeError("Engine stopped"))
+
+    async def submit(self, input_ids: List[int], max_new_tokens: int,
+                     prefix_ids: Optional[List[int]] = None,
+                     prompt_lookup: bool = False) -> GenerationResult:
+        """Queue a prompt and wait for its generated token ids
+
+        Args:
+            input_ids: Prompt token ids
+            max_new_tokens: Generation budget for this request
+            prefix_ids: Shared template prefix of input_ids; its KV cache is
+                computed once and reused by every prompt that starts with it
+            prompt_lookup: Speculate with n-gram drafts copied from the prompt
+
+        Returns:
+            GenerationResult with generated token ids (prompt excluded, EOS
+            included if reached) and draft acceptance counts
+
+        Cancelling the awaiting task cancels the request: the engine drops it
+        from the queue or from the running batch before its next step.
+        """
+        if self._thread is None:
+            raise RuntimeError("Engine not started")
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.put(_Sequence(
+            list(input_ids), max_new_tokens, future, loop, prefix_ids, prompt_lookup
+        ))
+        return await future
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                with torch.no_grad():
+                    self._admit()
+                    if self._active:
+                        self._step()
+            except Exception as e:
+                logger.error(f"Batching engine step failed: {e}")
+                self._fail_all(e)
+
+    def _admit(self):
+        """Prefill queued requests and merge them into the running batch"""
+        while len(self._active) < self.max_batch_size:
+            try:
+                if self._active:
+                    # Busy: only take what is already waiting
+                    seq = self._pending.get_nowait()
+                else:
+                    # Idle: wait briefly so stop() is still noticed
+                    seq = self._pending.get(timeout=0.1)
+            except queue.Empty:
+                return
+
+            if seq.future.done():
+                # Cancelled while queued
+                self.cancelled += 1
+                continue
+
+            # Only prefill what follows the cached prefix
+            cached, layers = self._prefix_layers(seq)
+            input_ids = torch.tensor([seq.input_ids[cached:]], device=self.model.device)
+            outputs = self.model(
+                input_ids=input_ids,
+                past_key_values=layers_to_cache(layers, self.model.config),
+                use_cache=True
+            )
+            token = int(outputs.logits[0, -1].argmax())
+            seq.append([token])
+            seq.position = len(seq.input_ids)
+
+            if self._is_finished(seq):
+                self._finish(seq)
+                continue
+
+            self._merge(seq, cache_to_layers(outputs.past_key_values))
+
+    def _prefix_layers(self, seq: _Sequence):
+        """Return (cached token count, prefix KV layers) for a sequence"""
+        prefix_ids = seq.prefix_ids
+        if not prefix_ids or len(seq.input_ids) <= len(prefix_ids) \
+                or seq.input_ids[:len(prefix_ids)] != list(prefix_ids):
+            return 0, None
+
+        entry = self.prefix_cache.get(tuple(prefix_ids))
+        if entry is None:
+            outputs = self.model(
+                input_ids=torch.tensor([list(prefix_ids)], device=self.model.device),
+                past_key_values=layers_to_cache(config=self.model.config),
+                use_cache=True
+            )
+            layers = cache_to_layers(outputs.past_key_values)
+            self.prefix_cache.put(tuple(prefix_ids), prefix_ids, layers)
+            return len(prefix_ids), layers
+
+        return len(prefix_ids), entry.layers
+
+    def _merge(self, seq: _Sequence, layers: List[tuple]):
+        """Add one prefilled sequence to the batch, left-padding to a common length"""
+        seq_mask = torch.ones((1, seq.position), dtype=torch.long, device=self.model.device)
+
+        if not self._active:
+            self._active = [seq]
+            self._layers = layers
+            self._mask = seq_mask
+            return
+
+        length = max(self._mask.shape[1], seq_mask.shape[1])
+        self._layers = [
+            (
+                torch.cat([_left_pad(k, length, 2), _left_pad(new_k, length, 2)], dim=0),
+                torch.cat([_left_pad(v, length, 2), _left_pad(new_v, length, 2)], dim=0)
+            )
+            for (k, v), (new_k, new_v) in zip(self._layers, layers)
+        ]
+        self._mask = torch.cat([_left_pad(self._mask, length, 1), _left_pad(seq_mask, length, 1)], dim=0)
+        self._active.append(seq)
+
+    def _step(self):
+        """Run one decode step for every active sequence
+
+        Each row feeds its last generated token plus its draft tokens (if it
+        uses prompt lookup). Drafts are right-padded to a common width; padded
+        and rejected draft positions are masked out of the cache afterwards.
+        """
+        device = self.model.device
+        drafts = [
+            seq.lookup.propose(seq.lookup.corpus)[:seq.max_new_tokens - len(seq.generated) - 1]
+            if seq.lookup is not None else []
+            for seq in self._active
+        ]
+        width = 1 + max(len(draft) for draft in drafts)
+
+        rows, positions, new_mask = [], [], []
+        for seq, draft in zip(self._active, drafts):
+            fill = width - 1 - len(draft)
+            rows.append([seq.generated[-1]] + draft + [0] * fill)
+            positions.append([seq.position + j for j in range(width)])
+            new_mask.append([1] * (1 + len(draft)) + [0] * fill)
+
+        new_mask = torch.tensor(new_mask, dtype=self._mask.dtype, device=device)
+        mask = torch.cat([self._mask, new_mask], dim=1)
+
+        outputs = self.model(
+            input_ids=torch.tensor(rows, device=device),
+            attention_mask=mask,
+            position_ids=torch.tensor(positions, device=device),
+            past_key_values=layers_to_cache(self._layers, self.model.config),
+            use_cache=True
+        )
+        self._layers = cache_to_layers(outputs.past_key_values)
+        self.steps += 1
+
+        predicted = outputs.logits.argmax(dim=-1).tolist()
+        keep = []
+        for i, (seq, draft) in enumerate(zip(self._active, drafts)):
+            # Accept the draft up to the first token greedy decoding disagrees with
+            accepted = 0
+            while accepted < len(draft) and draft[accepted] == predicted[i][accepted]:
+                accepted += 1
+                if draft[accepted - 1] in self.eos_token_ids:
+                    break
+            new_tokens = draft[:accepted]
+            if not new_tokens or new_tokens[-1] not in self.eos_token_ids:
+                new_tokens.append(predicted[i][accepted])
+
+            seq.draft_tokens += len(draft)
+            seq.accepted_draft_tokens += accepted
+            # Rejected draft positions stay in the cache but are masked out
+            new_mask[i, 1 + accepted:] = 0
+            seq.position += 1 + accepted
+            seq.append(new_tokens)
+
+            if seq.future.done():
+                # Cancelled by the caller; free its row without resolving
+                self.cancelled += 1
+            elif self._is_finished(seq):
+                self._finish(seq)
+            else:
+                keep.append(i)
+
+        self._mask = torch.cat([self._mask, new_mask], dim=1)
+        self._retire(keep)
+
+    def _retire(self, keep: List[int]):
+        """Drop finished rows and cache columns no remaining row attends to"""
+        if not keep:
+            self._active, self._layers, self._mask = [], [], None
+            return
+
+        if len(keep) < len(self._active):
+            index = torch.tensor(keep, device=self.model.device)
+            self._active = [self._active[i] for i in keep]
+            self._mask = self._mask.index_select(0, index)
+            self._layers = [(k.index_select(0, index), v.index_select(0, index)) for k, v in self._layers]
+
+        # Padding shared by every row: leading pad after retirement, rejected drafts
+        used = self._mask.any(dim=0)
+        if not bool(used.all()):
+            columns = used.nonzero().squeeze(1)
+            self._mask = self._mask.index_select(1, columns)
+            self._layers = [(k.index_select(2, columns), v.index_select(2, columns)) for k, v in self._layers]
+
+    def _is_finished(self, seq: _Sequence) -> bool:
+        return (
+            seq.generated[-1] in self.eos_token_ids
+            or len(seq.generated) >= seq.max_new_tokens
+            or seq.repetition.detected is not None
+        )
+
+    def _finish(self, seq: _Sequence):
+        self.completed += 1
+        seq.loop.call_soon_threadsafe(_resolve, seq.future, seq.result())
+
+    def _fail_all(self, error: BaseException):
+        """Fail every active and queued request and reset the batch"""
+        sequences = self._active
+        self._active, self._layers, self._mask = [], [], None
+        while True:
+            try:
+                sequences.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+        for seq in sequences:
+            seq.loop.call_soon_threadsafe(_resolve, seq.future, None, error)
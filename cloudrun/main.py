@@ -4,13 +4,25 @@ TranslateGemma FastAPI Application for Cloud Run
 This module provides a REST API for TranslateGemma translation service.
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from pydantic import BaseModel, Field
 from transformers import AutoModelForCausalLM, AutoTokenizer
 import torch
-from typing import Optional
+from typing import Any, Awaitable, Dict, Optional
+import asyncio
 import logging
 import os
+import sys
+from pathlib import Path
+
+# Modules shared with the example backends: copied next to this file in the
+# image, imported from examples/backends when running from a checkout
+_BACKENDS_DIR = Path(__file__).resolve().parent.parent / "examples" / "backends"
+if _BACKENDS_DIR.is_dir():
+    sys.path.append(str(_BACKENDS_DIR))
+
+from engine import ContinuousBatchingEngine
+from length_budget import LengthBudget
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -22,9 +34,16 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Global variables for model and tokenizer
+# Global variables for model, tokenizer and batching engine
 model = None
 tokenizer = None
+engine = None
+
+# max_new_tokens for requests without max_tokens, learned from finished requests
+length_budget = LengthBudget(namespace="cloudrun")
+
+# Token ids of the chat-template prefix per (source, target) language pair
+prompt_prefixes = {}
 
 # Language code mapping (ISO 639-1 standard)
 LANGUAGE_CODES = {
@@ -91,6 +110,44 @@ def get_lang_code(lang_name: str) -> str:
         )
     return code
 
+def get_prompt_prefix_ids(source_code: str, target_code: str) -> list:
+    """
+    Get the token ids of the chat-template text that precedes the user text.
+
+    The prefix is the same for every request with this language pair, so the
+    engine can reuse its KV cache instead of prefilling it each time.
+
+    Args:
+        source_code: Source language code
+        target_code: Target language code
+
+    Returns:
+        Prefix token ids (empty if the template cannot be split)
+    """
+    key = (source_code, target_code)
+    if key not in prompt_prefixes:
+        sentinel = "\u0000TEXT\u0000"
+        rendered = tokenizer.apply_chat_template(
+            [{
+                "role": "user",
+                "content": [{
+                    "type": "text",
+                    "text": sentinel,
+                    "source_lang_code": source_code,
+                    "target_lang_code": target_code
+                }]
+            }],
+            tokenize=False,
+            add_generation_prompt=True
+        )
+        prefix_ids = []
+        if sentinel in rendered:
+            prefix = rendered.split(sentinel, 1)[0]
+            # Drop the last token: it can merge with the start of the user text
+            prefix_ids = tokenizer(prefix, add_special_tokens=False).input_ids[:-1]
+        prompt_prefixes[key] = prefix_ids
+    return prompt_prefixes[key]
+
 class TranslationRequest(BaseModel):
     """Translation request model"""
     text: str = Field(..., description="Text to translate", min_length=1)
@@ -102,11 +159,15 @@ class TranslationRequest(BaseModel):
         default="Traditional Chinese (Taiwan)",
         description="Target language (e.g., 'Traditional Chinese (Taiwan)', 'Japanese')"
     )
-    max_tokens: int = Field(
-        default=256,
-        description="Maximum number of tokens to generate",
+    max_tokens: Optional[int] = Field(
+        default=None,
+        description="Maximum number of tokens to generate (default: sized from the text length)",
         ge=1,
-        le=512
+        le=2048
+    )
+    prompt_lookup: bool = Field(
+        default=os.getenv("PROMPT_LOOKUP", "0") == "1",
+        description="Speculative decoding with drafts copied from the source text (same output, fewer decode steps)"
     )
 
 class TranslationResponse(BaseModel):
@@ -115,17 +176,20 @@ class TranslationResponse(BaseModel):
     translated: str
     target_lang: str
     model_version: str = "translategemma-4b-it"
+    metadata: Dict[str, Any] = Field(default_factory=dict)
 
 class HealthResponse(BaseModel):
     """Health check response"""
     status: str
     model_loaded: bool
     gpu_available: bool
+    # Batching engine counters; None before the engine is started
+    engine: Optional[Dict[str, int]] = None
 
 @app.on_event("startup")
 async def load_model():
     """Load the TranslateGemma model on startup"""
-    global model, tokenizer
+    global model, tokenizer, engine
 
     try:
         logger.info("Loading TranslateGemma model...")
@@ -154,10 +218,28 @@ async def load_model():
         logger.info(f"Model loaded successfully on device: {model.device}")
         logger.info(f"CUDA available: {torch.cuda.is_available()}")
 
+        # Start continuous batching: concurrent requests share decode steps
+        max_batch_size = int(os.getenv("ENGINE_MAX_BATCH_SIZE", "8"))
+        prefix_cache_mb = int(os.getenv("PREFIX_CACHE_MB", "256"))
+        engine = ContinuousBatchingEngine(
+            model,
+            tokenizer,
+            max_batch_size=max_batch_size,
+            prefix_cache_bytes=prefix_cache_mb * 1024 * 1024
+        )
+        engine.start()
+
     except Exception as e:
         logger.error(f"Failed to load model: {e}")
         raise
 
+@app.on_event("shutdown")
+async def stop_engine():
+    """Stop the batching engine and save the learned length budget on shutdown"""
+    if engine is not None:
+        engine.stop()
+    length_budget.save()
+
 @app.get("/", response_model=dict)
 async def root():
     """Root endpoint with API information"""
@@ -177,21 +259,48 @@ async def health_check():
     return HealthResponse(
         status="healthy" if model is not None else "unhealthy",
         model_loaded=model is not None,
-        gpu_available=torch.cuda.is_available()
+        gpu_available=torch.cuda.is_available(),
+        engine={
+            "steps": engine.steps,
+            "completed": engine.completed,
+            "cancelled": engine.cancelled,
+            "active_sequences": engine.active_sequences,
+            "queued_sequences": engine.queued_sequences
+        } if engine is not None else None
     )
 
+class ClientDisconnected(Exception):
+    """The HTTP client went away before its translation finished"""
+
+async def cancel_on_disconnect(http_request: Request, awaitable: Awaitable, poll_interval: float = 0.5):
+    """
+    Await a coroutine, cancelling it if the HTTP client disconnects
+
+    Starlette does not cancel a running endpoint when the client goes away,
+    so the connection is polled while the work is in flight.
+    """
+    task = asyncio.ensure_future(awaitable)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=poll_interval)
+        if done:
+            return task.result()
+        if await http_request.is_disconnected():
+            task.cancel()
+            raise ClientDisconnected()
+
 @app.post("/translate", response_model=TranslationResponse)
-async def translate(request: TranslationRequest):
+async def translate(request: TranslationRequest, http_request: Request):
     """
     Translate text to target language
 
     Args:
         request: TranslationRequest containing text and target language
+        http_request: Raw request, watched for client disconnects
 
     Returns:
         TranslationResponse with original and translated text
     """
-    if model is None or tokenizer is None:
+    if model is None or tokenizer is None or engine is None:
         raise HTTPException(
             status_code=503,
             detail="Model not loaded. Please try again later."
@@ -217,23 +326,50 @@ async def translate(request: TranslationRequest):
         }]
 
         # Apply chat template
-        inputs = tokenizer.apply_chat_template(
+        input_ids = tokenizer.apply_chat_template(
             messages,
-            return_tensors="pt",
+            tokenize=True,
             add_generation_prompt=True
-        ).to(model.device)
-
-        # Generate translation
-        with torch.no_grad():
-            outputs = model.generate(
-                inputs,
-                max_new_tokens=request.max_tokens,
-                do_sample=False,  # Use greedy decoding for consistency
-                pad_token_id=tokenizer.eos_token_id
-            )
-
-        # Decode the result
-        result = tokenizer.decode(outputs[0], skip_special_tokens=True)
+        )
+        if not isinstance(input_ids, list):
+            # Newer transformers return a BatchEncoding here
+            input_ids = input_ids["input_ids"]
+
+        source_tokens = len(tokenizer(request.text, add_special_tokens=False).input_ids)
+        max_new_tokens = request.max_tokens
+        if max_new_tokens is None:
+            max_new_tokens = length_budget.budget(source_tokens, source_code, target_code)
+
+        # Generate translation (greedy) in the shared running batch; an
+        # abandoned request leaves the batch instead of running to completion
+        generation = await cancel_on_disconnect(http_request, engine.submit(
+            input_ids,
+            max_new_tokens=max_new_tokens,
+            prefix_ids=get_prompt_prefix_ids(source_code, target_code),
+            prompt_lookup=request.prompt_lookup
+        ))
+
+        # Decode the result (generated tokens only)
+        result = tokenizer.decode(generation.token_ids, skip_special_tokens=True)
+
+        if not generation.repetition_stopped:
+            length_budget.record(source_tokens, len(generation.token_ids), source_code, target_code)
+
+        metadata = {
+            "input_tokens": len(input_ids),
+            "output_tokens": len(generation.token_ids),
+            "repetition_stopped": generation.repetition_stopped,
+            "source_tokens": source_tokens,
+            "max_new_tokens": max_new_tokens,
+            "budget_exhausted": len(generation.token_ids) >= max_new_tokens
+        }
+        if request.prompt_lookup:
+            metadata.update({
+                "decoding": "prompt_lookup",
+                "draft_tokens": generation.draft_tokens,
+                "accepted_draft_tokens": generation.accepted_draft_tokens,
+                "acceptance_rate": generation.acceptance_rate
+            })
 
         # Extract only the translation (remove prompt)
         if "Translate this to" in result:
@@ -245,9 +381,15 @@ async def translate(request: TranslationRequest):
         return TranslationResponse(
             original=request.text,
             translated=result,
-            target_lang=request.target_lang
+            target_lang=request.target_lang,
+            metadata=metadata
         )
 
+    except ClientDisconnected:
+        logger.info("Client disconnected, translation cancelled")
+        # Nginx-style "client closed request"; nobody reads this response
+        raise HTTPException(status_code=499, detail="Client closed request")
+
     except Exception as e:
         logger.error(f"Translation failed: {e}")
         raise HTTPException(
@@ -1,16 +1,31 @@
 # Translation backends for TranslateGemma
+import importlib
+import sys
+
 try:
     from .base import TranslationBackend
-    from .transformers_backend import TransformersBackend
-    from .transformers_multimodal_backend import TransformersMultimodalBackend
+    from .cancellation import CancellationToken, TranslationCancelled
+    from .length_budget import LengthBudget
+    from .batch_scheduler import LengthBucketScheduler, ScheduledBatch
+    from .prefix_cache import PrefixCache
+    from .translation_cache import CachedBackend, TranslationCache
+    from .translation_store import TranslationStore
+    from .translation_memory import TranslationMemory
+    from .segment_dedup import plan_dedup, translate_pages, merge_segment_results
     from .ollama_backend import OllamaBackend
     from .mlx_backend import MLXBackend
     HAS_MLX = True
 except ImportError:
     # Fallback for direct module import (e.g., in Colab)
     from base import TranslationBackend
-    from transformers_backend import TransformersBackend
-    from transformers_multimodal_backend import TransformersMultimodalBackend
+    from cancellation import CancellationToken, TranslationCancelled
+    from length_budget import LengthBudget
+    from batch_scheduler import LengthBucketScheduler, ScheduledBatch
+    from prefix_cache import PrefixCache
+    from translation_cache import CachedBackend, TranslationCache
+    from translation_store import TranslationStore
+    from translation_memory import TranslationMemory
+    from segment_dedup import plan_dedup, translate_pages, merge_segment_results
     from ollama_backend import OllamaBackend
     try:
         from mlx_backend import MLXBackend
@@ -21,6 +36,22 @@ except ImportError:
 
 __all__ = [
     'TranslationBackend',
+    'CancellationToken',
+    'TranslationCancelled',
+    'LengthBudget',
+    'LengthBucketScheduler',
+    'ScheduledBatch',
+    'PrefixCache',
+    'CachedBackend',
+    'TranslationCache',
+    'TranslationStore',
+    'TranslationMemory',
+    'plan_dedup',
+    'translate_pages',
+    'merge_segment_results',
+    'RepetitionDetector',
+    'RepetitionStoppingCriteria',
+    'CancellationStoppingCriteria',
     'TransformersBackend',
     'TransformersMultimodalBackend',
     'OllamaBackend',
@@ -29,18 +60,41 @@ __all__ = [
     'get_backend'
 ]
 
+# Modules that import torch and transformers are loaded on first use, so that
+# e.g. OllamaBackend works without paying for them
+_LAZY_ATTRIBUTES = {
+    'TransformersBackend': 'transformers_backend',
+    'TransformersMultimodalBackend': 'transformers_multimodal_backend',
+    'RepetitionDetector': 'stopping',
+    'RepetitionStoppingCriteria': 'stopping',
+    'CancellationStoppingCriteria': 'stopping',
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if __package__:
+        module = importlib.import_module(f".{_LAZY_ATTRIBUTES[name]}", __package__)
+    else:
+        module = importlib.import_module(_LAZY_ATTRIBUTES[name])
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
 def get_backend(name='transformers'):
     """Factory function to get translation backend"""
     backends = {
-        'transformers': TransformersBackend,
-        'ollama': OllamaBackend,
+        'transformers': 'TransformersBackend',
+        'ollama': 'OllamaBackend',
     }
 
     if HAS_MLX:
-        backends['mlx'] = MLXBackend
+        backends['mlx'] = 'MLXBackend'
 
     if name not in backends:
         available = ', '.join(backends.keys())
         raise ValueError(f"Unknown backend: {name}. Available: {available}")
 
-    return backends[name]()
+    return getattr(sys.modules[__name__], backends[name])()
@@ -1,6 +1,18 @@
 """Base class for translation backends"""
+import asyncio
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Dict, Any
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional
+
+try:
+    from .cancellation import CancellationToken
+    from .chunking import TextChunk, chunk_separator, join_translations, split_text
+    from .length_budget import estimate_tokens
+except ImportError:
+    from cancellation import CancellationToken
+    from chunking import TextChunk, chunk_separator, join_translations, split_text
+    from length_budget import estimate_tokens
 
 
 class TranslationBackend(ABC):
@@ -10,6 +22,12 @@ class TranslationBackend(ABC):
         self.model = None
         self.tokenizer = None
         self.model_id = "google/translategemma-4b-it"
+        # Longest source text translated in one call, in count_tokens() units.
+        # translate() splits longer texts with translate_chunked(); None disables.
+        self.max_chunk_tokens = 1024
+        # True if translate() accepts reference=, a prior translation of a
+        # similar source used as a decoding draft (see CachedBackend)
+        self.accepts_reference_draft = False
 
     @abstractmethod
     def load_model(self, **kwargs) -> Dict[str, Any]:
@@ -25,7 +43,8 @@ class TranslationBackend(ABC):
         self,
         text: str,
         source_lang: str = "en",
-        target_lang: str = "zh-TW"
+        target_lang: str = "zh-TW",
+        cancel_token: Optional[CancellationToken] = None
     ) -> Dict[str, Any]:
         """Translate text from source to target language
 
@@ -33,12 +52,240 @@ class TranslationBackend(ABC):
             text: Text to translate
             source_lang: Source language code (ISO 639-1)
             target_lang: Target language code (ISO 639-1)
+            cancel_token: Optional token; once cancelled, generation stops at
+                the next check and TranslationCancelled is raised
 
         Returns:
             Dict with keys: translation (str), time (float), tokens (int), metadata (dict)
         """
         pass
 
+    def translate_batch(
+        self,
+        texts: List[str],
+        source_lang: str = "en",
+        target_lang: str = "zh-TW",
+        cancel_token: Optional[CancellationToken] = None
+    ) -> List[Dict[str, Any]]:
+        """Translate several texts from source to target language
+
+        Backends that can run multiple inputs through the model at once should
+        override this. The default falls back to calling translate() per text.
+
+        Args:
+            texts: Texts to translate
+            source_lang: Source language code (ISO 639-1)
+            target_lang: Target language code (ISO 639-1)
+            cancel_token: Optional token checked by every translate() call
+
+        Returns:
+            List of translate() result dicts, in the same order as texts
+        """
+        return [self.translate(text, source_lang, target_lang, cancel_token) for text in texts]
+
+    def count_tokens(self, text: str) -> int:
+        """Source token count used for chunking; backends with a tokenizer override this"""
+        return estimate_tokens(text)
+
+    def generation_params(self) -> Dict[str, Any]:
+        """Settings that change what translate() returns for a given input
+
+        Part of translation cache keys; backends add their model and
+        decoding options.
+        """
+        return {"model_id": self.model_id, "max_chunk_tokens": self.max_chunk_tokens}
+
+    def needs_chunking(self, text: str) -> bool:
+        return self.max_chunk_tokens is not None and self.count_tokens(text) > self.max_chunk_tokens
+
+    def translate_chunked(
+        self,
+        text: str,
+        source_lang: str = "en",
+        target_lang: str = "zh-TW",
+        cancel_token: Optional[CancellationToken] = None
+    ) -> Dict[str, Any]:
+        """Translate a long text in chunks of at most max_chunk_tokens tokens
+
+        The text is split on paragraph, sentence, line and word boundaries (in
+        that order of preference), the chunks go through translate_batch(), and
+        the translations are joined in source order.
+
+        Returns:
+            translate() result dict; metadata has the number of chunks, their
+            token counts and each chunk's own metadata
+        """
+        chunks = split_text(text, self.max_chunk_tokens, self.count_tokens)
+        results = self.translate_batch([chunk.text for chunk in chunks], source_lang, target_lang, cancel_token)
+        return self._merge_chunk_results(chunks, results, target_lang)
+
+    def _merge_chunk_results(self, chunks: List[TextChunk], results: List[Dict[str, Any]],
+                             target_lang: str) -> Dict[str, Any]:
+        """Combine per-chunk translate() results into one result dict"""
+        duration = sum(result["time"] for result in results)
+        total_tokens = sum(result["tokens"] for result in results)
+        chunk_metadata = [result.get("metadata", {}) for result in results]
+        metadata = {
+            "chunks": len(chunks),
+            "chunk_tokens": [chunk.tokens for chunk in chunks],
+            "max_chunk_tokens": self.max_chunk_tokens,
+            "tokens_per_second": total_tokens / duration if duration > 0 else 0,
+            "chunk_metadata": chunk_metadata
+        }
+        extractions = {meta["extraction"] for meta in chunk_metadata if "extraction" in meta}
+        if extractions:
+            metadata["extraction"] = "heuristic" if "heuristic" in extractions else extractions.pop()
+        errors = [meta["error"] for meta in chunk_metadata if "error" in meta]
+        if errors:
+            metadata["error"] = errors[0]
+
+        return {
+            "translation": join_translations([result["translation"] for result in results], chunks, target_lang),
+            "time": duration,
+            "tokens": total_tokens,
+            "metadata": metadata
+        }
+
+    async def atranslate(
+        self,
+        text: str,
+        source_lang: str = "en",
+        target_lang: str = "zh-TW",
+        cancel_token: Optional[CancellationToken] = None
+    ) -> Dict[str, Any]:
+        """Async variant of translate(), same result dict
+
+        Backends with a native async client override this. The default runs
+        translate() in a worker thread; cancelling the awaiting task cancels
+        the translation.
+        """
+        token = cancel_token if cancel_token is not None else CancellationToken()
+        try:
+            return await asyncio.to_thread(self.translate, text, source_lang, target_lang, token)
+        except asyncio.CancelledError:
+            token.cancel()
+            raise
+
+    def translate_stream(
+        self,
+        text: str,
+        source_lang: str = "en",
+        target_lang: str = "zh-TW",
+        cancel_token: Optional[CancellationToken] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Translate, yielding the translation as it is generated
+
+        Streamed pieces are the raw model output (after script conversion);
+        the final result holds the extracted, post-processed translation and
+        may differ slightly, e.g. when a repetition loop was trimmed.
+
+        Yields:
+            {"text": str} for each new piece of text, then a single
+            {"done": True, "result": translate() result dict}. The result
+            metadata includes time_to_first_token (seconds, None if no text).
+        """
+        start_time = time.time()
+        first_token_time = None
+
+        def pieces(events):
+            nonlocal first_token_time
+            for event in events:
+                if event.get("text") and first_token_time is None:
+                    first_token_time = time.time()
+                yield event
+
+        if self.needs_chunking(text):
+            # Chunks are streamed one after the other, in source order
+            chunks = split_text(text, self.max_chunk_tokens, self.count_tokens)
+            results = []
+            for chunk in chunks:
+                for event in pieces(self._stream_text(chunk.text, source_lang, target_lang, cancel_token)):
+                    if event.get("done"):
+                        results.append(event["result"])
+                    else:
+                        yield event
+                if chunk is not chunks[-1]:
+                    yield {"text": chunk_separator(chunk, target_lang)}
+            result = self._merge_chunk_results(chunks, results, target_lang)
+        else:
+            result = None
+            for event in pieces(self._stream_text(text, source_lang, target_lang, cancel_token)):
+                if event.get("done"):
+                    result = event["result"]
+                else:
+                    yield event
+
+        result["metadata"]["time_to_first_token"] = (
+            first_token_time - start_time if first_token_time is not None else None
+        )
+        yield {"done": True, "result": result}
+
+    def _stream_text(
+        self,
+        text: str,
+        source_lang: str,
+        target_lang: str,
+        cancel_token: Optional[CancellationToken] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Stream one text within the chunk budget (see translate_stream)
+
+        Backends that can stream natively override this. The default yields the
+        whole translation as one piece once translate() returns.
+        """
+        result = self.translate(text, source_lang, target_lang, cancel_token)
+        yield {"text": result["translation"]}
+        yield {"done": True, "result": result}
+
+    async def atranslate_stream(
+        self,
+        text: str,
+        source_lang: str = "en",
+        target_lang: str = "zh-TW",
+        cancel_token: Optional[CancellationToken] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Async variant of translate_stream(), same events
+
+        Generation runs in a worker thread. If the consumer stops early (break,
+        task cancellation), the translation is cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        token = cancel_token if cancel_token is not None else CancellationToken()
+        finished = False
+
+        def put(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # The consumer's event loop is gone; the token is cancelled
+                pass
+
+        def worker():
+            try:
+                for event in self.translate_stream(text, source_lang, target_lang, token):
+                    put(("event", event))
+            except BaseException as e:
+                put(("error", e))
+            finally:
+                put(("end", None))
+
+        threading.Thread(target=worker, daemon=True).start()
+        try:
+            while True:
+                kind, value = await queue.get()
+                if kind == "end":
+                    finished = True
+                    break
+                if kind == "error":
+                    finished = True
+                    raise value
+                # Nothing left to cancel once the result is out
+                finished = finished or bool(value.get("done"))
+                yield value
+        finally:
+            if not finished:
+                token.cancel()
+
     @abstractmethod
     def get_backend_info(self) -> Dict[str, str]:
         """Get backend information
@@ -0,0 +1,183 @@
+"""Length-bucketed batch scheduling for batched translation
+
+Padding every row of a batch up to its longest prompt wastes compute when a
+short heading shares a batch with a full PDF page. The scheduler groups inputs
+of similar token length into buckets and splits each bucket into batches that
+stay under a padded-token budget.
+"""
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+
+# Upper bounds (in prompt tokens) of the length buckets. Inputs longer than
+# the last boundary go into one overflow bucket.
+DEFAULT_BUCKET_BOUNDARIES = (64, 128, 256, 512, 1024, 2048)
+
+
+@dataclass
+class ScheduledBatch:
+    """One batch produced by the scheduler"""
+    indices: List[int] = field(default_factory=list)  # Positions in the original input
+    lengths: List[int] = field(default_factory=list)  # Prompt token count per row
+    bucket: int = 0  # Upper bound of the length bucket
+    new_tokens: List[int] = field(default_factory=list)  # Generation budget per row
+
+    @property
+    def size(self) -> int:
+        return len(self.indices)
+
+    @property
+    def padded_length(self) -> int:
+        return max(self.lengths) if self.lengths else 0
+
+    @property
+    def max_new_tokens(self) -> int:
+        """Generation budget of the batch: one generate call runs to its longest row's budget"""
+        return max(self.new_tokens) if self.new_tokens else 0
+
+    @property
+    def reserved_tokens(self) -> int:
+        """KV cache positions the batch can reach: rows * (padded prompt + generation)"""
+        return self.size * (self.padded_length + self.max_new_tokens)
+
+    @property
+    def real_tokens(self) -> int:
+        return sum(self.lengths)
+
+    @property
+    def padded_tokens(self) -> int:
+        return self.size * self.padded_length
+
+    @property
+    def padding_efficiency(self) -> float:
+        """Share of the padded batch that is real prompt tokens (1.0 = no padding)"""
+        return self.real_tokens / self.padded_tokens if self.padded_tokens > 0 else 1.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "bucket": self.bucket,
+            "batch_size": self.size,
+            "padded_length": self.padded_length,
+            "real_tokens": self.real_tokens,
+            "padded_tokens": self.padded_tokens,
+            "max_new_tokens": self.max_new_tokens,
+            "reserved_tokens": self.reserved_tokens,
+            "padding_efficiency": self.padding_efficiency
+        }
+
+
+class LengthBucketScheduler:
+    """Group inputs into length buckets and batches under a token budget
+
+    The budget covers the KV cache a batch can grow to: every row holds its
+    padded prompt plus the batch's generation budget, so plan() needs each
+    row's max_new_tokens (or new_tokens_per_row as a fixed reservation).
+
+    Example:
+        scheduler = LengthBucketScheduler(max_batch_tokens=8192)
+        batches = scheduler.plan([40, 1900, 35, 512], new_tokens=[80, 2048, 80, 700])
+        for batch in batches:
+            print(batch.indices, batch.padding_efficiency)
+    """
+
+    def __init__(
+        self,
+        max_batch_tokens: int = 8192,
+        bucket_boundaries: Sequence[int] = DEFAULT_BUCKET_BOUNDARIES,
+        max_batch_size: int = 32,
+        new_tokens_per_row: int = 0
+    ):
+        """
+        Args:
+            max_batch_tokens: Budget for batch_size * (padded_length + max_new_tokens)
+            bucket_boundaries: Ascending upper bounds of the length buckets
+            max_batch_size: Hard cap on rows per batch
+            new_tokens_per_row: Generated tokens reserved per row when plan()
+                gets no per-row new_tokens (0 = budget prompt tokens only)
+        """
+        if max_batch_tokens < 1:
+            raise ValueError("max_batch_tokens must be >= 1")
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+
+        self.max_batch_tokens = max_batch_tokens
+        self.bucket_boundaries = tuple(sorted(bucket_boundaries))
+        self.max_batch_size = max_batch_size
+        self.new_tokens_per_row = new_tokens_per_row
+
+    def bucket_for(self, length: int) -> int:
+        """Return the upper bound of the bucket holding a prompt of this length"""
+        for boundary in self.bucket_boundaries:
+            if length <= boundary:
+                return boundary
+        # Overflow bucket: everything longer than the last boundary
+        return -1
+
+    def plan(self, lengths: Sequence[int], new_tokens: Optional[Sequence[int]] = None) -> List[ScheduledBatch]:
+        """Split inputs into batches
+
+        Args:
+            lengths: Prompt token count of each input, in input order
+            new_tokens: max_new_tokens of each input (default:
+                new_tokens_per_row for every input)
+
+        Returns:
+            Batches in execution order. The longest batch runs first, so peak
+            memory is reached at the start and later batches never need more.
+        """
+        if new_tokens is None:
+            new_tokens = [self.new_tokens_per_row] * len(lengths)
+        buckets: Dict[int, List[Tuple[int, int, int]]] = {}
+        for index, (length, budget) in enumerate(zip(lengths, new_tokens)):
+            buckets.setdefault(self.bucket_for(length), []).append((index, length, budget))
+
+        batches = []
+        for bucket, items in buckets.items():
+            # Longest first inside a bucket, so each batch's first row sets its padded length
+            items.sort(key=lambda item: item[1], reverse=True)
+
+            batch = ScheduledBatch(bucket=bucket)
+            for index, length, budget in items:
+                if batch.size and not self._fits(batch, length, budget):
+                    batches.append(batch)
+                    batch = ScheduledBatch(bucket=bucket)
+                # A single row over budget still gets its own batch
+                batch.indices.append(index)
+                batch.lengths.append(length)
+                batch.new_tokens.append(budget)
+            if batch.size:
+                batches.append(batch)
+
+        batches.sort(key=lambda b: b.padded_length, reverse=True)
+        return batches
+
+    def _fits(self, batch: ScheduledBatch, length: int, new_tokens: int) -> bool:
+        if batch.size >= self.max_batch_size:
+            return False
+        padded_length = max(batch.padded_length, length)
+        cost = (batch.size + 1) * (padded_length + max(batch.max_new_tokens, new_tokens))
+        return cost <= self.max_batch_tokens
+
+    @staticmethod
+    def restore_order(batches: List[ScheduledBatch], batch_results: List[List[Any]]) -> List[Any]:
+        """Map per-batch results back to the original input order"""
+        total = sum(batch.size for batch in batches)
+        ordered: List[Any] = [None] * total
+        for batch, results in zip(batches, batch_results):
+            for index, result in zip(batch.indices, results):
+                ordered[index] = result
+        return ordered
+
+    @staticmethod
+    def summary(batches: List[ScheduledBatch]) -> Dict[str, Any]:
+        """Aggregate padding statistics over a plan"""
+        real_tokens = sum(batch.real_tokens for batch in batches)
+        padded_tokens = sum(batch.padded_tokens for batch in batches)
+        return {
+            "batches": len(batches),
+            "items": sum(batch.size for batch in batches),
+            "real_tokens": real_tokens,
+            "padded_tokens": padded_tokens,
+            "padding_efficiency": real_tokens / padded_tokens if padded_tokens > 0 else 1.0,
+            "per_batch": [batch.stats() for batch in batches]
+        }
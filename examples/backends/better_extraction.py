@@ -5,6 +5,74 @@ This module provides robust extraction strategies to handle various output forma
 """
 
 import re
+from typing import Callable, Optional, Tuple
+
+
+# Text that only appears in output when the model echoes the prompt
+PROMPT_ECHO_MARKERS = (
+    'You are a professional',
+    'Translate the following text',
+    'Please translate the following',
+)
+
+
+def looks_like_prompt_echo(text: str) -> bool:
+    """Check if generated text repeats the instruction prompt"""
+    return any(marker in text for marker in PROMPT_ECHO_MARKERS)
+
+
+def select_translation(generated_text: str, fallback: Callable[[], str]) -> Tuple[str, str]:
+    """
+    Pick the translation from text decoded from generated tokens only
+
+    Args:
+        generated_text: Decoded generated tokens (prompt excluded)
+        fallback: Called when the generated text cannot be used as-is
+
+    Returns:
+        (translation, method) where method is "token_slice" or "heuristic"
+    """
+    translation = generated_text.strip()
+    if translation and not looks_like_prompt_echo(translation):
+        return translation, "token_slice"
+    return fallback(), "heuristic"
+
+
+def extract_translation_from_ids(
+    tokenizer,
+    output_ids,
+    input_length: int,
+    source_lang: str,
+    target_lang: str,
+    fallback: Optional[Callable[[str], str]] = None
+) -> Tuple[str, str]:
+    """
+    Extract the translation by decoding only the generated token ids
+
+    The prompt is never detokenized unless the generated part is unusable;
+    then the full output goes through a heuristic extractor.
+
+    Args:
+        tokenizer: Tokenizer (or processor) with a decode() method
+        output_ids: Output token ids for one sequence (prompt + generated)
+        input_length: Number of prompt tokens at the start of output_ids
+        source_lang: Source language code
+        target_lang: Target language code
+        fallback: Extractor for the full decoded output
+            (default: extract_translation_v2)
+
+    Returns:
+        (translation, method) where method is "token_slice" or "heuristic"
+    """
+    generated_text = tokenizer.decode(output_ids[input_length:], skip_special_tokens=True)
+
+    def heuristic() -> str:
+        full_output = tokenizer.decode(output_ids, skip_special_tokens=True)
+        if fallback is not None:
+            return fallback(full_output)
+        return extract_translation_v2(full_output, source_lang, target_lang)
+
+    return select_translation(generated_text, heuristic)
 
 
 def extract_translation_v2(full_output: str, source_lang: str, target_lang: str) -> str:
@@ -0,0 +1,39 @@
+"""Cooperative cancellation of in-flight translations
+
+A CancellationToken is created by the caller (a Ctrl-C handler, a request
+handler) and passed to translate(). Backends check it at safe points: every
+decode step for transformers, every streamed chunk for Ollama. Once the
+backend notices the cancellation it stops generating and raises
+TranslationCancelled.
+"""
+import threading
+from typing import Optional
+
+
+class TranslationCancelled(Exception):
+    """Raised by translate() when its cancellation token was cancelled"""
+
+
+class CancellationToken:
+    """Thread-safe flag shared between the caller and a running translation"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        """Request cancellation; safe to call from any thread, more than once"""
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise TranslationCancelled("Translation cancelled")
+
+
+def raise_if_cancelled(cancel_token: Optional[CancellationToken]):
+    """Shorthand for backends whose cancel_token argument may be None"""
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
@@ -0,0 +1,116 @@
+"""Token-budgeted chunking of long texts (e.g. full PDF pages)
+
+A dense page can exceed what a backend handles well in one call: the
+transformers backend truncates prompts at 2048 tokens, and attention cost
+grows quadratically with the prompt. split_text() cuts a text into chunks
+under a token budget, on the coarsest boundary that works: paragraphs, then
+sentences, then lines, then words. Chunks are packed greedily, so short
+paragraphs share a chunk. join_translations() stitches the translated chunks
+back together with the kind of break that separated them in the source.
+"""
+import re
+from dataclasses import dataclass
+from typing import Callable, List
+
+# Boundaries from coarsest to finest; each match stays attached to the text before it
+SPLIT_PATTERNS = (
+    re.compile(r"\n[ \t]*\n\s*"),           # paragraphs
+    re.compile(r"(?<=[.!?。！？])\s+|(?<=[。！？])"),  # sentences
+    re.compile(r"\n"),                       # lines (PDF text breaks mid-sentence)
+    re.compile(r"\s+"),                      # words
+)
+
+# Target languages written without spaces between sentences
+NO_SPACE_LANGS = ("zh", "ja")
+
+
+@dataclass
+class TextChunk:
+    """One chunk of the source text"""
+    text: str
+    # Whitespace that followed the chunk in the source ("" for the last one)
+    separator: str
+    tokens: int
+
+
+def _split_keep(text: str, pattern) -> List[str]:
+    """Split text after every match of pattern, keeping the match on the left piece"""
+    pieces = []
+    start = 0
+    for match in pattern.finditer(text):
+        if match.end() > start:
+            pieces.append(text[start:match.end()])
+            start = match.end()
+    if start < len(text):
+        pieces.append(text[start:])
+    return pieces
+
+
+def split_text(text: str, max_tokens: int, count_tokens: Callable[[str], int]) -> List[TextChunk]:
+    """Split text into chunks of at most max_tokens tokens
+
+    Args:
+        text: Text to split
+        max_tokens: Token budget per chunk
+        count_tokens: Token counter of the backend that translates the chunks
+
+    Returns:
+        Chunks in source order; a text within budget comes back as one chunk
+    """
+    chunks: List[TextChunk] = []
+    # Character pieces this short are kept even if they count over budget
+    char_step = max(1, max_tokens // 4)
+    current = []
+    current_tokens = 0
+
+    def flush():
+        nonlocal current, current_tokens
+        raw = "".join(current)
+        content = raw.rstrip()
+        if content.strip():
+            chunks.append(TextChunk(content.strip(), raw[len(content):], current_tokens))
+        elif chunks:
+            chunks[-1].separator += raw
+        current, current_tokens = [], 0
+
+    def pack(pieces: List[str], level: int):
+        nonlocal current_tokens
+        for piece in pieces:
+            tokens = count_tokens(piece)
+            if tokens > max_tokens and len(piece) > char_step:
+                flush()
+                if level < len(SPLIT_PATTERNS):
+                    pack(_split_keep(piece, SPLIT_PATTERNS[level]), level + 1)
+                else:
+                    # A single "word" over budget (tables, base64, ...): cut by characters
+                    pack([piece[i:i + char_step] for i in range(0, len(piece), char_step)], level)
+                continue
+            if current and current_tokens + tokens > max_tokens:
+                flush()
+            current.append(piece)
+            current_tokens += tokens
+
+    pack([text], 0)
+    flush()
+    if chunks:
+        chunks[-1].separator = ""
+    return chunks
+
+
+def chunk_separator(chunk: TextChunk, target_lang: str) -> str:
+    """Text to put after a chunk's translation: a paragraph or line break, a space or nothing"""
+    if "\n\n" in chunk.separator.replace(" ", "").replace("\t", ""):
+        return "\n\n"
+    if "\n" in chunk.separator:
+        return "\n"
+    if chunk.separator and target_lang.split("-")[0] not in NO_SPACE_LANGS:
+        return " "
+    return ""
+
+
+def join_translations(translations: List[str], chunks: List[TextChunk], target_lang: str) -> str:
+    """Stitch chunk translations in order, keeping paragraph and line breaks"""
+    return "".join(
+        translation.strip() + chunk_separator(chunk, target_lang)
+        for translation, chunk in zip(translations, chunks)
+    ).strip()
@@ -0,0 +1,170 @@
+"""Compiled greedy generation with a static KV cache
+
+torch.compile needs fixed tensor shapes to reuse a compiled graph. A
+DynamicCache grows by one position per step, so the compiled decode step
+would be traced again and again. A StaticCache is allocated once at its
+maximum length and updated in place. generate() only auto-compiles on GPUs,
+so CompiledGenerator compiles the model's forward itself and runs the
+single-token decode steps on a StaticCache through it; the prefill pass and
+every other caller stay eager.
+
+Prompts are left-padded to a few length buckets and caches are allocated
+at a few bucketed lengths, so a long-running process only compiles once
+per bucket, the first time the bucket is used. warmup() pays those compiles
+at load time for the buckets expected to be used.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+# Prompt lengths are padded up to one of these
+PROMPT_BUCKETS = (64, 128, 256, 512, 1024, 2048)
+# Static caches hold padded prompt + max_new_tokens, rounded up to one of these
+CACHE_BUCKETS = (256, 512, 1024, 2048, 4096)
+
+
+def bucket_length(length: int, buckets: Tuple[int, ...]) -> int:
+    """Smallest bucket >= length; a multiple of the largest bucket beyond it"""
+    for bucket in buckets:
+        if length <= bucket:
+            return bucket
+    largest = buckets[-1]
+    return -(-length // largest) * largest
+
+
+class CompiledGenerator:
+    """Greedy generate() over a compiled decode step and reused static caches
+
+    Example:
+        generator = CompiledGenerator(model, pad_token_id)
+        compile_times = generator.warmup(prompt_ids, cache_lengths=(512,))
+        input_ids, attention_mask, padding = generator.pad(input_ids)
+        outputs = generator.generate(input_ids, attention_mask, max_new_tokens=256)
+    """
+
+    def __init__(self, model, pad_token_id: int, max_caches: int = 4):
+        """
+        Args:
+            model: Causal LM
+            pad_token_id: Token used for left padding
+            max_caches: Static caches kept for reuse, one per (batch size,
+                cache length); least recently used ones are freed
+        """
+        import torch
+        from transformers.generation import CompileConfig
+
+        self.model = model
+        self.pad_token_id = pad_token_id
+        self.max_caches = max_caches
+        # dynamic=None lets dynamo generalize the sliding-window position
+        # counter after one recompile instead of specializing on every step
+        self.compile_config = CompileConfig(dynamic=None)
+        self._caches: "OrderedDict[Tuple[int, int], Any]" = OrderedDict()
+        self.compile_times: Dict[int, float] = {}
+
+        eager_forward = model.forward
+        compiled_forward = torch.compile(eager_forward, **self.compile_config.to_dict())
+
+        def forward(*args, **kwargs):
+            input_ids = kwargs.get("input_ids")
+            cache = kwargs.get("past_key_values")
+            if input_ids is not None and input_ids.shape[1] == 1 and getattr(cache, "is_compileable", False):
+                return compiled_forward(*args, **kwargs)
+            return eager_forward(*args, **kwargs)
+
+        model.forward = forward
+
+    def pad(self, input_ids, attention_mask=None):
+        """Left-pad a batch of prompts to its length bucket
+
+        Returns:
+            (input_ids, attention_mask, number of padding columns added)
+        """
+        import torch
+
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        padding = bucket_length(input_ids.shape[1], PROMPT_BUCKETS) - input_ids.shape[1]
+        if padding:
+            input_ids = torch.nn.functional.pad(input_ids, (padding, 0), value=self.pad_token_id)
+            attention_mask = torch.nn.functional.pad(attention_mask, (padding, 0), value=0)
+        return input_ids, attention_mask, padding
+
+    def static_cache(self, batch_size: int, cache_length: int):
+        """Empty static cache for batch_size rows, reused across calls"""
+        from transformers import StaticCache
+
+        key = (batch_size, cache_length)
+        cache = self._caches.pop(key, None)
+        if cache is None:
+            cache = StaticCache(config=self.model.config, max_cache_len=cache_length)
+        else:
+            # In-place reset keeps the tensor addresses the compiled graph was built for
+            cache.reset()
+        self._caches[key] = cache
+        while len(self._caches) > self.max_caches:
+            self._caches.popitem(last=False)
+        return cache
+
+    def generate(self, input_ids, attention_mask, max_new_tokens: int,
+                 cache_length: Optional[int] = None, **generate_kwargs):
+        """Greedy generate() on already padded prompts
+
+        Args:
+            input_ids: Left-padded prompt ids (see pad())
+            attention_mask: Mask with zeros over the padding
+            max_new_tokens: Generation budget
+            cache_length: Static cache length (default: padded prompt plus
+                max_new_tokens, rounded up to a cache bucket)
+            **generate_kwargs: Passed to model.generate (stopping criteria etc.)
+
+        Returns:
+            generate() output with sequences and past_key_values
+        """
+        import torch
+
+        if cache_length is None:
+            cache_length = bucket_length(input_ids.shape[1] + max_new_tokens, CACHE_BUCKETS)
+
+        start_time = time.time()
+        with torch.no_grad():
+            outputs = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                pad_token_id=self.pad_token_id,
+                past_key_values=self.static_cache(input_ids.shape[0], cache_length),
+                return_dict_in_generate=True,
+                **generate_kwargs
+            )
+        # The first call per cache length compiles its decode step
+        self.compile_times.setdefault(cache_length, time.time() - start_time)
+        return outputs
+
+    def warmup(self, input_ids, cache_lengths: Iterable[int], steps: int = 8) -> Dict[int, float]:
+        """Compile the decode step for some cache lengths before serving
+
+        Buckets not warmed up compile on their first generate() call.
+
+        Args:
+            input_ids: A representative single prompt, shape [1, length]
+            cache_lengths: Cache buckets to compile, from CACHE_BUCKETS
+            steps: Decode steps per bucket; a few are needed because dynamo
+                recompiles once to generalize the position counter
+
+        Returns:
+            Seconds spent per cache length (mostly compilation)
+        """
+        input_ids, attention_mask, _ = self.pad(input_ids)
+        for cache_length in cache_lengths:
+            if cache_length < input_ids.shape[1] + steps or cache_length in self.compile_times:
+                continue
+            # min_new_tokens keeps an early EOS from skipping the compile
+            self.generate(input_ids, attention_mask, steps, cache_length=cache_length, min_new_tokens=steps)
+        return dict(self.compile_times)
+
+    def clear(self):
+        """Free the caches and put the model's eager forward back"""
+        self._caches.clear()
+        self.model.__dict__.pop("forward", None)
@@ -0,0 +1,144 @@
+"""Quantized KV cache for long-page generation
+
+A 2048-token page plus 2048 generated tokens keeps about 4k positions of
+keys and values per layer, per batch row. Storing them in 8 or 4 bits cuts
+that memory 2-4x (bfloat16) or 4-8x (float32).
+
+The cache follows transformers' QuantizedLayer (KIVI-style): the newest
+residual_length positions stay in full precision, and older positions are
+quantized in bulk whenever the residual part fills up. Quantization is
+asymmetric, per position, over groups of the head dimension, in plain torch,
+so neither quanto nor hqq is needed.
+
+Only full-attention layers are quantized by default. Sliding-window layers
+(five of every six in Gemma 3) already stay bounded by their window and keep
+their usual full-precision layer.
+"""
+from typing import Any, List, Optional, Tuple
+
+try:
+    from transformers.cache_utils import (
+        DYNAMIC_LAYER_TYPE_MAPPING, Cache, QuantizedLayer, get_layer_types_and_kwargs
+    )
+except ImportError:
+    # transformers < 4.56 has no cache layer classes
+    Cache = QuantizedLayer = None
+
+KV_CACHE_BITS = (8, 4)
+
+
+def _nbytes(tensor) -> int:
+    return tensor.numel() * tensor.element_size() if tensor is not None else 0
+
+
+class TorchQuantizedLayer(QuantizedLayer if QuantizedLayer is not None else object):
+    """Cache layer storing old positions as 8- or 4-bit integers"""
+
+    def _quantize(self, tensor, axis):
+        import torch
+
+        shape = tensor.shape
+        head_dim = shape[-1]
+        group_size = min(self.q_group_size, head_dim)
+        while head_dim % group_size:
+            group_size //= 2
+
+        levels = 2 ** self.nbits - 1
+        groups = tensor.float().reshape(*shape[:-1], head_dim // group_size, group_size)
+        g_min = groups.amin(dim=-1, keepdim=True)
+        g_max = groups.amax(dim=-1, keepdim=True)
+        scale = ((g_max - g_min) / levels).clamp(min=1e-8)
+        q = ((groups - g_min) / scale).round().clamp(0, levels).to(torch.uint8)
+        if self.nbits == 4:
+            # Two values per byte; group_size is even for any real head_dim
+            q = q[..., 0::2] | (q[..., 1::2] << 4)
+        return q, scale.to(tensor.dtype), g_min.to(tensor.dtype), shape
+
+    def _dequantize(self, q_tensor):
+        import torch
+
+        q, scale, offset, shape = q_tensor
+        if self.nbits == 4:
+            q = torch.stack([q & 0x0F, q >> 4], dim=-1).flatten(-2)
+        return (q.to(scale.dtype) * scale + offset).reshape(shape)
+
+    def nbytes(self) -> int:
+        """Bytes currently stored: quantized part plus full-precision residual"""
+        if not self.is_initialized:
+            return 0
+        quantized = sum(
+            _nbytes(part) for q_tensor in (self._quantized_keys, self._quantized_values)
+            if q_tensor is not None for part in q_tensor[:3]
+        )
+        return quantized + _nbytes(self.keys) + _nbytes(self.values)
+
+
+class QuantizedKVCache(Cache if Cache is not None else object):
+    """Cache with quantized full-attention layers that tracks its peak memory"""
+
+    def __init__(self, config, nbits: int = 4, q_group_size: int = 64, residual_length: int = 128,
+                 quantize_sliding_layers: bool = False):
+        """
+        Args:
+            config: Model config (layer types and sliding window)
+            nbits: 8 or 4
+            q_group_size: Head-dimension elements sharing one scale and offset
+            residual_length: Newest positions kept in full precision
+            quantize_sliding_layers: Also quantize sliding-window layers; they
+                then keep their full history like full-attention layers (the
+                attention mask still limits them to the window)
+        """
+        if Cache is None:
+            raise RuntimeError("Quantized KV cache needs transformers >= 4.56")
+        if nbits not in KV_CACHE_BITS:
+            raise ValueError(f"KV cache bits must be one of {KV_CACHE_BITS}, got {nbits}")
+
+        config = config.get_text_config(decoder=True)
+        layer_types, per_layer_kwargs = get_layer_types_and_kwargs(config)
+        layers = []
+        for layer_type, layer_kwargs in zip(layer_types, per_layer_kwargs):
+            if layer_type == "full_attention" or quantize_sliding_layers:
+                layers.append(TorchQuantizedLayer(nbits, 0, 0, q_group_size, residual_length))
+            else:
+                layers.append(DYNAMIC_LAYER_TYPE_MAPPING[layer_type](**layer_kwargs))
+        super().__init__(layers=layers)
+        self.nbits = nbits
+        self.peak_bytes = 0
+
+    def update(self, key_states, value_states, layer_idx: int, *args, **kwargs):
+        outputs = super().update(key_states, value_states, layer_idx, *args, **kwargs)
+        # After the last layer every layer holds the same positions
+        if layer_idx == len(self.layers) - 1:
+            self.peak_bytes = max(self.peak_bytes, self.nbytes())
+        return outputs
+
+    def nbytes(self) -> int:
+        return sum(_layer_nbytes(layer) for layer in self.layers)
+
+
+def _layer_nbytes(layer) -> int:
+    if isinstance(layer, TorchQuantizedLayer):
+        return layer.nbytes()
+    return _nbytes(getattr(layer, "keys", None)) + _nbytes(getattr(layer, "values", None))
+
+
+def build_quantized_cache(model, nbits: int, prefix_layers: Optional[List[Tuple[Any, Any]]] = None,
+                          **kwargs) -> QuantizedKVCache:
+    """Empty quantized cache for model, optionally pre-filled with a prompt prefix
+
+    Args:
+        model: Model the cache is used with
+        nbits: 8 or 4
+        prefix_layers: Per-layer (key, value) tensors, e.g. from the prefix
+            cache; they are quantized into the new cache and left unchanged
+        **kwargs: Passed to QuantizedKVCache
+    """
+    cache = QuantizedKVCache(model.config, nbits, **kwargs)
+    for layer_idx, (keys, values) in enumerate(prefix_layers or []):
+        cache.update(keys, values, layer_idx)
+    return cache
+
+
+def cache_nbytes(cache) -> int:
+    """Bytes stored in any transformers cache (quantized or not)"""
+    return sum(_layer_nbytes(layer) for layer in getattr(cache, "layers", None) or [])
@@ -0,0 +1,209 @@
+"""Adaptive max_new_tokens budget from source length and language pair
+
+A fixed budget of 2048 new tokens lets a looping generation run for minutes
+on a one-line input, while a small fixed budget truncates long pages. The
+translation length is roughly proportional to the source length, with a
+ratio that depends on the language pair (English -> Chinese is shorter in
+tokens than English -> German). LengthBudget learns that ratio from finished
+translations and sizes each budget as a high bound of it.
+
+Learned ratios are kept per backend namespace and language pair in a JSON
+file, so they survive restarts. The file is rewritten every save_every
+records or save_interval seconds, by save(), and at interpreter exit.
+"""
+import atexit
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+DEFAULT_BUDGET_PATH = Path.home() / ".cache" / "trans-gemma" / "length_budget.json"
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for backends without a local tokenizer
+
+    CJK characters are about one token each; other scripts about four
+    characters per token.
+    """
+    cjk = sum(1 for c in text if '\u3040' <= c <= '\u9fff' or '\uac00' <= c <= '\ud7af')
+    return max(1, cjk + math.ceil((len(text) - cjk) / 4))
+
+
+class _PairStats:
+    """Running mean and variance (Welford) of output/input token ratios"""
+
+    def __init__(self, count: int = 0, mean: float = 0.0, m2: float = 0.0, max_ratio: float = 0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.max_ratio = max_ratio
+
+    def add(self, ratio: float):
+        self.count += 1
+        delta = ratio - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (ratio - self.mean)
+        self.max_ratio = max(self.max_ratio, ratio)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def to_dict(self) -> Dict[str, float]:
+        return {"count": self.count, "mean": self.mean, "m2": self.m2, "max_ratio": self.max_ratio}
+
+
+class LengthBudget:
+    """Predict max_new_tokens from input tokens and language pair
+
+    budget = ceil(input_tokens * ratio_bound) + slack, clamped to
+    [min_tokens, max_tokens]. ratio_bound is mean + z * std of the learned
+    ratios, and default_ratio until min_samples translations were recorded.
+
+    Example:
+        budget = LengthBudget(namespace="transformers")
+        max_new_tokens = budget.budget(input_tokens, "en", "zh-TW")
+        ...
+        budget.record(input_tokens, output_tokens, "en", "zh-TW")
+    """
+
+    def __init__(
+        self,
+        namespace: str = "default",
+        path: Optional[str] = None,
+        default_ratio: float = 3.0,
+        z: float = 3.0,
+        slack: int = 32,
+        min_samples: int = 5,
+        min_tokens: int = 32,
+        max_tokens: int = 2048,
+        save_every: int = 16,
+        save_interval: float = 60.0
+    ):
+        """
+        Args:
+            namespace: Key separating backends whose token counts differ
+            path: JSON file for learned ratios (default: LENGTH_BUDGET_PATH env
+                or ~/.cache/trans-gemma/length_budget.json); "" disables saving
+            default_ratio: Ratio bound used before enough samples exist
+            z: Standard deviations above the mean ratio
+            slack: Extra tokens for short inputs, end-of-turn tokens and the like
+            min_samples: Recorded translations needed before learning kicks in
+            min_tokens: Lower clamp of the budget
+            max_tokens: Upper clamp of the budget (the old fixed budget)
+            save_every: Records between two writes of the file
+            save_interval: Seconds after which a record writes the file anyway
+        """
+        if path is None:
+            path = os.getenv("LENGTH_BUDGET_PATH", str(DEFAULT_BUDGET_PATH))
+        self.namespace = namespace
+        self.path = Path(path) if path else None
+        self.default_ratio = default_ratio
+        self.z = z
+        self.slack = slack
+        self.min_samples = min_samples
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.save_every = save_every
+        self.save_interval = save_interval
+        self._stats: Dict[str, _PairStats] = {}
+        self._unsaved = 0
+        self._last_save = time.monotonic()
+        self._lock = threading.Lock()
+        self._load()
+        if self.path is not None:
+            atexit.register(self.save)
+
+    @staticmethod
+    def _key(source_lang: str, target_lang: str) -> str:
+        return f"{source_lang}->{target_lang}"
+
+    def ratio_bound(self, source_lang: str, target_lang: str) -> float:
+        stats = self._stats.get(self._key(source_lang, target_lang))
+        if stats is None or stats.count < self.min_samples:
+            return self.default_ratio
+        return stats.mean + self.z * stats.std
+
+    def budget(self, input_tokens: int, source_lang: str, target_lang: str) -> int:
+        """max_new_tokens for a source text of input_tokens tokens"""
+        tokens = math.ceil(input_tokens * self.ratio_bound(source_lang, target_lang)) + self.slack
+        return max(self.min_tokens, min(self.max_tokens, tokens))
+
+    def record(self, input_tokens: int, output_tokens: int, source_lang: str, target_lang: str):
+        """Learn from a finished translation
+
+        Runs cut short by the budget are recorded too: their ratio is a lower
+        bound, and recording it lets a too-tight budget grow. Runs stopped as
+        repetition loops should not be recorded.
+
+        Args:
+            input_tokens: Source text tokens (same unit as passed to budget())
+            output_tokens: Generated tokens
+        """
+        if input_tokens <= 0 or output_tokens <= 0:
+            return
+        with self._lock:
+            key = self._key(source_lang, target_lang)
+            self._stats.setdefault(key, _PairStats()).add(output_tokens / input_tokens)
+            self._unsaved += 1
+            if self._unsaved >= self.save_every or time.monotonic() - self._last_save >= self.save_interval:
+                self._save()
+
+    def save(self):
+        """Write records not yet in the file"""
+        with self._lock:
+            if self._unsaved:
+                self._save()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            key: {
+                "count": stats.count,
+                "mean_ratio": stats.mean,
+                "std_ratio": stats.std,
+                "max_ratio": stats.max_ratio
+            }
+            for key, stats in self._stats.items()
+        }
+
+    def _read_file(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _load(self):
+        if self.path is None:
+            return
+        pairs = self._read_file().get(self.namespace, {})
+        self._stats = {key: _PairStats(**values) for key, values in pairs.items()}
+
+    def _save(self):
+        self._unsaved = 0
+        self._last_save = time.monotonic()
+        if self.path is None:
+            return
+        # Other namespaces in the same file are kept as they are
+        data = self._read_file()
+        data[self.namespace] = {key: stats.to_dict() for key, stats in self._stats.items()}
+        tmp_path = None
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # A unique temporary file per write: concurrent processes never share one
+            with tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", dir=self.path.parent, prefix=self.path.name + ".",
+                suffix=".tmp", delete=False
+            ) as f:
+                tmp_path = f.name
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # Read-only home or similar: keep learning in memory only
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
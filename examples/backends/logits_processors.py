@@ -0,0 +1,132 @@
+"""Incremental replacements for transformers' repetition logits processors
+
+The stock NoRepeatNGramLogitsProcessor rebuilds the n-gram table of every
+sequence from scratch in Python at each decode step, so a step costs O(length)
+and a 2048-token generation O(length^2) in total. The processors below keep
+their state between calls and only look at the tokens added since the last
+step:
+
+- IncrementalNoRepeatNGramLogitsProcessor: per-row n-gram index
+  (prefix -> next tokens), extended with the newest n-grams
+- IncrementalRepetitionPenaltyLogitsProcessor: per-row token-presence mask,
+  updated with a scatter of the new tokens, and the distinct present tokens
+  as a gather/scatter index (the stock processor gathers every position)
+
+Both give the same scores as the stock processors (prompt tokens included)
+and can be passed to generate() through logits_processor instead of
+no_repeat_ngram_size / repetition_penalty. A fresh instance is needed per
+generate() call. They assume rows keep their order between steps (greedy or
+sampling, not beam search) and start over when the input no longer extends
+what they have seen.
+"""
+from typing import Dict, List, Optional, Set, Tuple
+
+try:
+    from transformers import LogitsProcessor
+except ImportError:
+    LogitsProcessor = object
+
+
+class IncrementalNoRepeatNGramLogitsProcessor(LogitsProcessor):
+    """Ban tokens that would repeat an n-gram already in the sequence"""
+
+    def __init__(self, ngram_size: int):
+        if not isinstance(ngram_size, int) or ngram_size <= 0:
+            raise ValueError(f"`ngram_size` has to be a strictly positive integer, but is {ngram_size}")
+        self.ngram_size = ngram_size
+        # Per row: (n - 1)-token prefix -> tokens that followed it
+        self._index: List[Dict[Tuple[int, ...], Set[int]]] = []
+        self._seen = 0
+
+    def __call__(self, input_ids, scores):
+        batch_size, length = input_ids.shape
+        n = self.ngram_size
+        if length + 1 < n:
+            return scores
+
+        if len(self._index) != batch_size or length < self._seen:
+            self._index = [{} for _ in range(batch_size)]
+            self._seen = 0
+
+        # The n - 1 tokens before the new ones start the first new n-gram
+        start = max(0, self._seen - (n - 1))
+        for index, tokens in zip(self._index, input_ids[:, start:].tolist()):
+            for i in range(len(tokens) - n + 1):
+                index.setdefault(tuple(tokens[i:i + n - 1]), set()).add(tokens[i + n - 1])
+        self._seen = length
+
+        scores_processed = scores
+        prefixes = input_ids[:, length - n + 1:].tolist() if n > 1 else [[]] * batch_size
+        for row, (index, prefix) in enumerate(zip(self._index, prefixes)):
+            banned = index.get(tuple(prefix))
+            if banned:
+                if scores_processed is scores:
+                    scores_processed = scores.clone()
+                scores_processed[row, list(banned)] = -float("inf")
+        return scores_processed
+
+
+class IncrementalRepetitionPenaltyLogitsProcessor(LogitsProcessor):
+    """Penalize every token already present in the sequence (CTRL-style)"""
+
+    def __init__(self, penalty: float):
+        if not isinstance(penalty, float) or not (penalty > 0):
+            raise ValueError(f"`penalty` has to be a strictly positive float, but is {penalty}")
+        self.penalty = penalty
+        # [batch, vocab] bool mask of tokens seen so far
+        self._presence = None
+        # Per row: the distinct tokens of the mask, in order of appearance
+        self._present_ids: List[List[int]] = []
+        # _present_ids as a [batch, distinct] tensor; rows padded by repeating a token
+        self._index = None
+        self._seen = 0
+
+    def __call__(self, input_ids, scores):
+        import torch
+
+        if (self._presence is None or self._presence.shape != scores.shape
+                or self._presence.device != scores.device or input_ids.shape[1] < self._seen):
+            self._presence = torch.zeros(scores.shape, dtype=torch.bool, device=scores.device)
+            self._present_ids = [[] for _ in range(scores.shape[0])]
+            self._index = None
+            self._seen = 0
+
+        new_tokens = input_ids[:, self._seen:].to(scores.device)
+        self._seen = input_ids.shape[1]
+        # Only tokens not yet in the mask grow the index
+        already = self._presence.gather(1, new_tokens).tolist()
+        self._presence.scatter_(1, new_tokens, True)
+        grown = False
+        for ids, tokens, present in zip(self._present_ids, new_tokens.tolist(), already):
+            added = set()
+            for token, seen in zip(tokens, present):
+                if not seen and token not in added:
+                    added.add(token)
+                    ids.append(token)
+            grown = grown or bool(added)
+
+        if grown:
+            width = max(len(ids) for ids in self._present_ids)
+            self._index = torch.tensor(
+                [ids + ids[:1] * (width - len(ids)) for ids in self._present_ids],
+                device=scores.device
+            )
+        if self._index is None or self._index.shape[1] == 0:
+            return scores
+
+        score = torch.gather(scores, 1, self._index)
+        score = torch.where(score < 0, score * self.penalty, score / self.penalty)
+        return scores.scatter(1, self._index, score)
+
+
+def repetition_processors(repetition_penalty: Optional[float] = None, no_repeat_ngram_size: Optional[int] = None):
+    """LogitsProcessorList equivalent to generate()'s repetition_penalty and
+    no_repeat_ngram_size arguments, in the order generate() applies them"""
+    from transformers import LogitsProcessorList
+
+    processors = LogitsProcessorList()
+    if repetition_penalty is not None and repetition_penalty != 1.0:
+        processors.append(IncrementalRepetitionPenaltyLogitsProcessor(repetition_penalty))
+    if no_repeat_ngram_size:
+        processors.append(IncrementalNoRepeatNGramLogitsProcessor(no_repeat_ngram_size))
+    return processors
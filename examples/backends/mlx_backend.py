@@ -1,11 +1,15 @@
 """MLX backend for TranslateGemma (Apple Silicon optimized)"""
 import time
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 try:
     from .base import TranslationBackend
+    from .cancellation import CancellationToken, raise_if_cancelled
+    from .length_budget import LengthBudget, estimate_tokens
 except ImportError:
     from base import TranslationBackend
+    from cancellation import CancellationToken, raise_if_cancelled
+    from length_budget import LengthBudget, estimate_tokens
 
 
 class MLXBackend(TranslationBackend):
@@ -26,6 +30,8 @@ class MLXBackend(TranslationBackend):
         super().__init__()
         # Use 4-bit quantized version for better performance
         self.model_id = "mlx-community/translategemma-4b-it-4bit"
+        # max_tokens from learned output/input ratios; None = fixed 256
+        self.length_budget = LengthBudget(namespace="mlx")
 
     def load_model(self, **kwargs) -> Dict[str, Any]:
         """Load model using MLX"""
@@ -65,11 +71,17 @@ class MLXBackend(TranslationBackend):
         self,
         text: str,
         source_lang: str = "en",
-        target_lang: str = "zh-TW"
+        target_lang: str = "zh-TW",
+        cancel_token: Optional[CancellationToken] = None
     ) -> Dict[str, Any]:
         """Translate using MLX"""
         from mlx_lm import generate
 
+        raise_if_cancelled(cancel_token)
+
+        if self.needs_chunking(text):
+            return self.translate_chunked(text, source_lang, target_lang, cancel_token)
+
         start_time = time.time()
 
         # Try structured chat template format first (TranslateGemma's preferred format)
@@ -114,17 +126,40 @@ class MLXBackend(TranslationBackend):
             prompt = f"Translate this to {target_name}: {text}"
 
         # Generate translation with limited tokens to avoid loops
-        response = generate(
-            self.model,
-            self.tokenizer,
-            prompt=prompt,
-            max_tokens=256,  # Increased for better translation
-            verbose=False
-        )
+        source_tokens = self.count_tokens(text)
+        max_tokens = 256
+        if self.length_budget is not None:
+            max_tokens = self.length_budget.budget(source_tokens, source_lang, target_lang)
+
+        if cancel_token is None:
+            response = generate(
+                self.model,
+                self.tokenizer,
+                prompt=prompt,
+                max_tokens=max_tokens,
+                verbose=False
+            )
+        else:
+            # Stream so the token can be checked between generated tokens
+            from mlx_lm import stream_generate
+
+            pieces = []
+            for chunk in stream_generate(self.model, self.tokenizer, prompt=prompt, max_tokens=max_tokens):
+                if cancel_token.cancelled:
+                    break
+                # Newer mlx_lm yields response objects, older versions plain strings
+                pieces.append(getattr(chunk, "text", chunk))
+            raise_if_cancelled(cancel_token)
+            response = "".join(pieces)
 
         end_time = time.time()
         duration = end_time - start_time
 
+        output_tokens = self.count_tokens(response)
+        # Runs cut off at max_tokens are recorded too, so a too-tight budget can grow
+        if self.length_budget is not None:
+            self.length_budget.record(source_tokens, output_tokens, source_lang, target_lang)
+
         # Clean up response - remove special tokens and extra whitespace
         translation = response.strip()
 
@@ -164,10 +199,20 @@ class MLXBackend(TranslationBackend):
             "tokens": tokens,
             "metadata": {
                 "tokens_per_second": tokens / duration if duration > 0 and tokens > 0 else 0,
+                "source_tokens": source_tokens,
+                "max_new_tokens": max_tokens,
+                "budget_exhausted": output_tokens >= max_tokens,
                 "raw_response": response[:200] if len(response) > 200 else response
             }
         }
 
+    def count_tokens(self, text: str) -> int:
+        """Token count with the MLX tokenizer, estimated if it cannot encode"""
+        try:
+            return len(self.tokenizer.encode(text))
+        except Exception:
+            return estimate_tokens(text)
+
     def get_backend_info(self) -> Dict[str, str]:
         """Get MLX backend info"""
         try:
@@ -1,12 +1,47 @@
 """Ollama backend for TranslateGemma"""
+import asyncio
+import concurrent.futures
 import time
 import os
-from typing import Dict, Any
+import json
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 
 try:
     from .base import TranslationBackend
+    from .cancellation import CancellationToken, TranslationCancelled, raise_if_cancelled
+    from .chunking import TextChunk, split_text
+    from .length_budget import LengthBudget, estimate_tokens
 except ImportError:
     from base import TranslationBackend
+    from cancellation import CancellationToken, TranslationCancelled, raise_if_cancelled
+    from chunking import TextChunk, split_text
+    from length_budget import LengthBudget, estimate_tokens
+
+
+def _keep_alive(value):
+    """keep_alive for the Ollama API: numbers (e.g. "-1") are sent as seconds,
+    anything else as a duration string such as "30m"
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _stream_object(line) -> Dict[str, Any]:
+    """One object of Ollama's NDJSON stream; an error reported mid-stream is raised"""
+    result = json.loads(line)
+    if "error" in result:
+        raise RuntimeError(f"Ollama error: {result['error']}")
+    return result
+
+
+async def _close_when_cancelled(client):
+    """Keep client open until this task is cancelled, then close it"""
+    try:
+        await asyncio.Future()
+    finally:
+        await client.aclose()
 
 
 class OllamaBackend(TranslationBackend):
@@ -16,16 +51,63 @@ class OllamaBackend(TranslationBackend):
         super().__init__()
         self.model_name = "translategemma:latest"
         self.base_url = "http://localhost:11434"
+        # num_predict from learned output/input ratios; None = fixed 2048.
+        # No local tokenizer: source length is estimated from characters.
+        self.length_budget = LengthBudget(namespace="ollama")
+        # Prompt processing slows down quadratically on long pages; keep chunks short
+        self.max_chunk_tokens = 512
+        # HTTP connection pool, shared by all requests of this backend
+        self.max_connections = 8
+        self.connect_timeout = 5.0
+        self.timeout = 180.0  # Per read; long translations stream slowly
+        self._session = None
+        self._async_client = None
+        self._async_client_loop = None
+        # Task on the client's loop that closes the client when cancelled
+        self._async_client_closer = None
+        # Requests kept in flight by translate_many(); match the server's OLLAMA_NUM_PARALLEL
+        self.max_parallel = 4
+        # Retries of a request that failed on the connection or with a 429/5xx
+        self.max_retries = 3
+        self.retry_backoff = 0.5  # Seconds before the first retry, doubled after each
+        # How long the server keeps the model in memory after each request
+        # (Ollama duration string, or seconds; -1 = until the server stops)
+        self.keep_alive = "30m"
 
     def load_model(self, **kwargs) -> Dict[str, Any]:
-        """Check if Ollama is running and model is available"""
-        import requests
+        """Check if Ollama is running and model is available
+
+        Args:
+            max_connections: HTTP connections kept open to the server
+                (env OLLAMA_MAX_CONNECTIONS, default 8)
+            timeout: Seconds to wait for each read from the server
+                (env OLLAMA_TIMEOUT, default 180)
+            connect_timeout: Seconds to wait for a connection (default 5)
+            max_parallel: Requests translate_many() keeps in flight
+                (env OLLAMA_NUM_PARALLEL, default 4)
+            max_retries: Retries of a failed request in translate_many() (default 3)
+            keep_alive: Sent with every request (env OLLAMA_KEEP_ALIVE, default "30m")
+            preload: Load the model into the server now and time a warm
+                one-token generation, instead of paying the load on the
+                first translation (default True)
+        """
+        self.max_connections = int(kwargs.get(
+            "max_connections", os.getenv("OLLAMA_MAX_CONNECTIONS", self.max_connections)
+        ))
+        self.timeout = float(kwargs.get("timeout", os.getenv("OLLAMA_TIMEOUT", self.timeout)))
+        self.connect_timeout = float(kwargs.get("connect_timeout", self.connect_timeout))
+        self.max_parallel = int(kwargs.get("max_parallel", os.getenv("OLLAMA_NUM_PARALLEL", self.max_parallel)))
+        self.max_retries = int(kwargs.get("max_retries", self.max_retries))
+        self.keep_alive = _keep_alive(kwargs.get("keep_alive", os.getenv("OLLAMA_KEEP_ALIVE", self.keep_alive)))
+        preload = kwargs.get("preload", True)
+        # Pools are sized on creation
+        self.cleanup()
 
         start_time = time.time()
 
         try:
             # Check Ollama server
-            response = requests.get(f"{self.base_url}/api/tags", timeout=5)
+            response = self.session().get(f"{self.base_url}/api/tags", timeout=self.connect_timeout)
             if response.status_code != 200:
                 raise RuntimeError("Ollama server not running")
 
@@ -38,6 +120,8 @@ class OllamaBackend(TranslationBackend):
                     "TranslateGemma not found. Run: ollama pull translategemma"
                 )
 
+            warm_start = self._warm_start() if preload else {}
+
             load_time = time.time() - start_time
 
             return {
@@ -45,44 +129,495 @@ class OllamaBackend(TranslationBackend):
                 "load_time": load_time,
                 "metadata": {
                     "backend": "ollama",
-                    "model": self.model_name
+                    "model": self.model_name,
+                    "max_connections": self.max_connections,
+                    "max_parallel": self.max_parallel,
+                    "keep_alive": self.keep_alive,
+                    **warm_start
                 }
             }
 
         except Exception as e:
             raise RuntimeError(f"Ollama error: {e}")
 
-    def translate(self, text: str, source_lang: str = "en", target_lang: str = "zh-TW") -> Dict[str, Any]:
-        """Translate using Ollama"""
+    def generation_params(self) -> Dict[str, Any]:
+        return {"model": self.model_name, "max_chunk_tokens": self.max_chunk_tokens}
+
+    def _warm_start(self) -> Dict[str, float]:
+        """Load the model into the server, then time a one-token translation
+
+        Returns:
+            cold_load_time: Seconds for the load request (about 0 if the
+                model was already in memory)
+            warm_first_token_time: Seconds to the first token once loaded
+        """
+        # A generate request without a prompt only loads the model
+        start_time = time.time()
+        response = self.session().post(
+            f"{self.base_url}/api/generate",
+            json={"model": self.model_name, "stream": False, "keep_alive": self.keep_alive},
+            timeout=(self.connect_timeout, self.timeout)
+        )
+        response.raise_for_status()
+        cold_load_time = time.time() - start_time
+
+        payload, _, _ = self._request("Hello", "en", "de")
+        payload["options"]["num_predict"] = 1
+        start_time = time.time()
+        first_token_time = None
+        with self.session().post(
+            f"{self.base_url}/api/generate",
+            json=payload,
+            stream=True,
+            timeout=(self.connect_timeout, self.timeout)
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line and first_token_time is None:
+                    first_token_time = time.time() - start_time
+
+        return {
+            "cold_load_time": cold_load_time,
+            "warm_first_token_time": first_token_time
+        }
+
+    def translate(
+        self,
+        text: str,
+        source_lang: str = "en",
+        target_lang: str = "zh-TW",
+        cancel_token: Optional[CancellationToken] = None
+    ) -> Dict[str, Any]:
+        """Translate using Ollama
+
+        The response is streamed so a cancelled translation can close the
+        connection, which makes Ollama abort generation on its side.
+        """
+        raise_if_cancelled(cancel_token)
+
+        if self.needs_chunking(text):
+            return self.translate_chunked(text, source_lang, target_lang, cancel_token)
+
+        for event in self._stream_text(text, source_lang, target_lang, cancel_token):
+            if event.get("done"):
+                return event["result"]
+
+    async def atranslate(
+        self,
+        text: str,
+        source_lang: str = "en",
+        target_lang: str = "zh-TW",
+        cancel_token: Optional[CancellationToken] = None
+    ) -> Dict[str, Any]:
+        """Translate using Ollama over the pooled async client
+
+        Many translations can be awaited concurrently from one event loop;
+        at most max_connections requests are open at a time. Chunks of a long
+        text are requested concurrently too. Cancelling the awaiting task (or
+        the token) closes the connection, which aborts generation in Ollama.
+        """
+        raise_if_cancelled(cancel_token)
+
+        if self.needs_chunking(text):
+            chunks = split_text(text, self.max_chunk_tokens, self.count_tokens)
+            results = await asyncio.gather(*(
+                self._atranslate_text(chunk.text, source_lang, target_lang, cancel_token) for chunk in chunks
+            ))
+            return self._merge_chunk_results(chunks, list(results), target_lang)
+
+        return await self._atranslate_text(text, source_lang, target_lang, cancel_token)
+
+    def translate_batch(
+        self,
+        texts: List[str],
+        source_lang: str = "en",
+        target_lang: str = "zh-TW",
+        cancel_token: Optional[CancellationToken] = None
+    ) -> List[Dict[str, Any]]:
+        """Translate several texts with concurrent requests (see translate_many)"""
+        return self.translate_many(texts, source_lang, target_lang, cancel_token)
+
+    def translate_many(
+        self,
+        texts: List[str],
+        source_lang: str = "en",
+        target_lang: str = "zh-TW",
+        cancel_token: Optional[CancellationToken] = None
+    ) -> List[Dict[str, Any]]:
+        """Blocking variant of atranslate_many(), same results
+
+        Runs atranslate_many() in its own event loop; when called from a
+        thread that already runs one (e.g. a notebook cell), the loop runs in
+        a worker thread. Without httpx, requests go through the requests
+        session from a pool of max_parallel threads instead.
+        """
+        try:
+            import httpx  # noqa: F401
+        except ImportError:
+            return self._translate_many_threaded(texts, source_lang, target_lang, cancel_token)
+
+        async def run():
+            try:
+                return await self.atranslate_many(texts, source_lang, target_lang, cancel_token)
+            finally:
+                await self.aclose()
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(run())
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+            return pool.submit(asyncio.run, run()).result()
+
+    def _translate_many_threaded(
+        self,
+        texts: List[str],
+        source_lang: str,
+        target_lang: str,
+        cancel_token: Optional[CancellationToken] = None
+    ) -> List[Dict[str, Any]]:
+        """translate_many() over the requests session, max_parallel threads"""
+        raise_if_cancelled(cancel_token)
+        start_time = time.time()
+        plans, request_texts = self._plan_requests(texts)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_parallel) as pool:
+            futures = [
+                pool.submit(self._translate_with_retries, text, source_lang, target_lang, cancel_token)
+                for text in request_texts
+            ]
+            try:
+                responses = [future.result() for future in futures]
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        return self._batch_results(plans, responses, len(texts), target_lang, start_time)
+
+    def _translate_with_retries(
+        self,
+        text: str,
+        source_lang: str,
+        target_lang: str,
+        cancel_token: Optional[CancellationToken] = None
+    ) -> Dict[str, Any]:
+        """Sync counterpart of _atranslate_with_retries()"""
         import requests
 
+        attempt = 0
+        while True:
+            try:
+                for event in self._stream_text(text, source_lang, target_lang, cancel_token):
+                    if event.get("done"):
+                        result = event["result"]
+                result["metadata"]["attempts"] = attempt + 1
+                return result
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                transient = (
+                    not isinstance(e, requests.HTTPError)
+                    or e.response.status_code == 429
+                    or e.response.status_code >= 500
+                )
+                if not transient or attempt >= self.max_retries:
+                    raise
+            time.sleep(self.retry_backoff * 2 ** attempt)
+            attempt += 1
+            raise_if_cancelled(cancel_token)
+
+    async def atranslate_many(
+        self,
+        texts: List[str],
+        source_lang: str = "en",
+        target_lang: str = "zh-TW",
+        cancel_token: Optional[CancellationToken] = None
+    ) -> List[Dict[str, Any]]:
+        """Translate several texts, keeping up to max_parallel requests in flight
+
+        Texts over the chunk budget are split first, so their chunks share the
+        same request slots. Requests that fail on the connection or with a
+        429/5xx status are retried with exponential backoff; once a request
+        runs out of retries, the others are cancelled and the error is raised.
+
+        Returns:
+            List of translate() result dicts, in the same order as texts. Each
+            metadata also has attempts (of a single request; max over chunks),
+            batch_size, batch_index, batch_time, batch_tokens_per_second
+            (aggregate throughput of the whole call) and max_parallel.
+        """
+        raise_if_cancelled(cancel_token)
+        semaphore = asyncio.Semaphore(self.max_parallel)
+        start_time = time.time()
+
+        async def request(text: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self._atranslate_with_retries(text, source_lang, target_lang, cancel_token)
+
+        plans, request_texts = self._plan_requests(texts)
+
+        tasks = [asyncio.ensure_future(request(text)) for text in request_texts]
+        try:
+            responses = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        return self._batch_results(plans, responses, len(texts), target_lang, start_time)
+
+    def _plan_requests(self, texts: List[str]) -> Tuple[List[Tuple[int, Optional[List[TextChunk]]]], List[str]]:
+        """One request per text, or per chunk of a long text
+
+        Returns:
+            ((first request index, chunks or None) per text, request texts)
+        """
+        plans = []
+        request_texts = []
+        for text in texts:
+            chunks = split_text(text, self.max_chunk_tokens, self.count_tokens) if self.needs_chunking(text) else None
+            plans.append((len(request_texts), chunks))
+            request_texts.extend([chunk.text for chunk in chunks] if chunks else [text])
+        return plans, request_texts
+
+    def _batch_results(
+        self,
+        plans: List[Tuple[int, Optional[List[TextChunk]]]],
+        responses: List[Dict[str, Any]],
+        batch_size: int,
+        target_lang: str,
+        start_time: float
+    ) -> List[Dict[str, Any]]:
+        """Per-text results of a translate_many() call, with batch metadata"""
+        results = []
+        for first, chunks in plans:
+            if chunks:
+                chunk_results = responses[first:first + len(chunks)]
+                result = self._merge_chunk_results(chunks, chunk_results, target_lang)
+                result["metadata"]["attempts"] = max(r["metadata"]["attempts"] for r in chunk_results)
+            else:
+                result = responses[first]
+            results.append(result)
+
+        duration = time.time() - start_time
+        batch_tokens = sum(result["tokens"] for result in results)
+        for index, result in enumerate(results):
+            result["metadata"].update({
+                "batch_size": batch_size,
+                "batch_index": index,
+                "batch_time": duration,
+                "batch_tokens_per_second": batch_tokens / duration if duration > 0 else 0,
+                "max_parallel": self.max_parallel
+            })
+        return results
+
+    async def _atranslate_with_retries(
+        self,
+        text: str,
+        source_lang: str,
+        target_lang: str,
+        cancel_token: Optional[CancellationToken] = None
+    ) -> Dict[str, Any]:
+        """_atranslate_text(), retried on transient failures"""
+        import httpx
+
+        attempt = 0
+        while True:
+            try:
+                result = await self._atranslate_text(text, source_lang, target_lang, cancel_token)
+                result["metadata"]["attempts"] = attempt + 1
+                return result
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                transient = (
+                    isinstance(e, httpx.TransportError)
+                    or e.response.status_code == 429
+                    or e.response.status_code >= 500
+                )
+                if not transient or attempt >= self.max_retries:
+                    raise
+            await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+            attempt += 1
+            raise_if_cancelled(cancel_token)
+
+    def session(self):
+        """requests session with a keep-alive pool of max_connections"""
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            self._session = requests.Session()
+            self._session.mount("http://", HTTPAdapter(pool_maxsize=self.max_connections))
+            self._session.mount("https://", HTTPAdapter(pool_maxsize=self.max_connections))
+        return self._session
+
+    def async_client(self):
+        """httpx.AsyncClient for the running event loop, limited to max_connections"""
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client_loop is not loop:
+            # Pooled connections belong to the loop that opened them
+            self._release_async_client()
+            self._async_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                ),
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout)
+            )
+            self._async_client_loop = loop
+            # asyncio.run() cancels leftover tasks before closing its loop, so
+            # the client is closed on its own loop even if aclose() is never called
+            self._async_client_closer = loop.create_task(_close_when_cancelled(self._async_client))
+        return self._async_client
+
+    def _release_async_client(self):
+        """Forget the async client and have its loop close it"""
+        closer, loop = self._async_client_closer, self._async_client_loop
+        self._async_client = None
+        self._async_client_loop = None
+        self._async_client_closer = None
+        if closer is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(closer.cancel)
+        return closer
+
+    async def aclose(self):
+        """Close the async client's connections (call from its event loop)"""
+        if self._async_client is not None and self._async_client_loop is asyncio.get_running_loop():
+            closer = self._release_async_client()
+            await asyncio.gather(closer, return_exceptions=True)
+
+    def _request(self, text: str, source_lang: str, target_lang: str) -> Tuple[Dict[str, Any], int, int]:
+        """/api/generate request body, estimated source tokens and num_predict"""
         # Optimize prompt for Traditional Chinese (Taiwan)
         if target_lang == "zh-TW":
             prompt = f"Translate the following text from {source_lang} to Traditional Chinese (Taiwan, 繁體中文):\n\n{text}"
         else:
             prompt = f"Translate from {source_lang} to {target_lang}:\n\n{text}"
 
+        source_tokens = estimate_tokens(text)
+        num_predict = 2048
+        if self.length_budget is not None:
+            num_predict = self.length_budget.budget(source_tokens, source_lang, target_lang)
+
+        payload = {
+            "model": self.model_name,
+            "prompt": prompt,
+            "stream": True,
+            "keep_alive": self.keep_alive,
+            "options": {
+                "temperature": 0,
+                "num_predict": num_predict
+            }
+        }
+        return payload, source_tokens, num_predict
+
+    def _result(
+        self,
+        chunks: List[str],
+        result: Dict[str, Any],
+        source_tokens: int,
+        num_predict: int,
+        source_lang: str,
+        target_lang: str,
+        start_time: float
+    ) -> Dict[str, Any]:
+        """translate() result dict from the streamed pieces and the final stats object"""
+        translation = self._convert_script("".join(chunks).strip(), target_lang)
+        duration = time.time() - start_time
+
+        output_tokens = result.get("eval_count", 0)
+        # Runs cut off at num_predict are recorded too, so a too-tight budget can grow
+        if self.length_budget is not None:
+            self.length_budget.record(source_tokens, output_tokens, source_lang, target_lang)
+
+        return {
+            "translation": translation,
+            "time": duration,
+            "tokens": result.get("eval_count", 0),
+            "metadata": {
+                "tokens_per_second": result.get("eval_count", 0) / duration if duration > 0 else 0,
+                "source_tokens": source_tokens,
+                "max_new_tokens": num_predict,
+                "budget_exhausted": output_tokens >= num_predict
+            }
+        }
+
+    def _stream_text(
+        self,
+        text: str,
+        source_lang: str,
+        target_lang: str,
+        cancel_token: Optional[CancellationToken] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Yield text from Ollama's NDJSON stream as it arrives"""
+        raise_if_cancelled(cancel_token)
+
+        payload, source_tokens, num_predict = self._request(text, source_lang, target_lang)
         start_time = time.time()
 
-        response = requests.post(
+        chunks = []
+        result = {}
+        with self.session().post(
             f"{self.base_url}/api/generate",
-            json={
-                "model": self.model_name,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0,
-                    "num_predict": 2048  # Increased from 512 to avoid truncation
-                }
-            },
-            timeout=180  # Increased timeout for longer translations
-        )
+            json=payload,
+            stream=True,
+            timeout=(self.connect_timeout, self.timeout)
+        ) as response:
+            # An error body (model not pulled, server error) is not a translation
+            response.raise_for_status()
+            # One JSON object per generated chunk; the last one carries the stats.
+            # Reading to the end of the stream returns the connection to the pool.
+            for line in response.iter_lines():
+                if cancel_token is not None and cancel_token.cancelled:
+                    # Leaving the with-block closes the connection
+                    raise TranslationCancelled("Translation cancelled")
+                if not line:
+                    continue
+                result = _stream_object(line)
+                piece = result.get("response", "")
+                if piece:
+                    # Leading whitespace is stripped from the final translation too
+                    if chunks or piece.strip():
+                        yield {"text": self._convert_script(piece if chunks else piece.lstrip(), target_lang)}
+                    chunks.append(piece)
 
-        result = response.json()
-        translation = result.get("response", "").strip()
-        duration = time.time() - start_time
+        yield {"done": True, "result": self._result(
+            chunks, result, source_tokens, num_predict, source_lang, target_lang, start_time
+        )}
+
+    async def _atranslate_text(
+        self,
+        text: str,
+        source_lang: str,
+        target_lang: str,
+        cancel_token: Optional[CancellationToken] = None
+    ) -> Dict[str, Any]:
+        """Translate one text within the chunk budget over the async client"""
+        raise_if_cancelled(cancel_token)
+
+        payload, source_tokens, num_predict = self._request(text, source_lang, target_lang)
+        start_time = time.time()
+
+        chunks = []
+        result = {}
+        async with self.async_client().stream(
+            "POST", f"{self.base_url}/api/generate", json=payload
+        ) as response:
+            response.raise_for_status()
+            # Same NDJSON stream as in _stream_text()
+            async for line in response.aiter_lines():
+                if cancel_token is not None and cancel_token.cancelled:
+                    raise TranslationCancelled("Translation cancelled")
+                if not line:
+                    continue
+                result = _stream_object(line)
+                chunks.append(result.get("response", ""))
+
+        return self._result(chunks, result, source_tokens, num_predict, source_lang, target_lang, start_time)
 
-        # Convert to Traditional Chinese with OpenCC (more robust than hanziconv)
+    def _convert_script(self, translation: str, target_lang: str) -> str:
+        """Convert to Traditional Chinese with OpenCC (more robust than hanziconv)"""
         if target_lang == "zh-TW":
             try:
                 from opencc import OpenCC
@@ -95,16 +630,16 @@ class OllamaBackend(TranslationBackend):
                     translation = HanziConv.toTraditional(translation)
                 except:
                     pass
-
-        return {
-            "translation": translation,
-            "time": duration,
-            "tokens": result.get("eval_count", 0),
-            "metadata": {"tokens_per_second": result.get("eval_count", 0) / duration if duration > 0 else 0}
-        }
+        return translation
 
     def get_backend_info(self) -> Dict[str, str]:
-        return {"name": "Ollama", "model": self.model_name}
+        return {"name": "Ollama", "model": self.model_name, "keep_alive": str(self.keep_alive)}
 
     def cleanup(self):
-        pass
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+        # Closed on its own loop by the closer task
+        self._release_async_client()
+        if self.length_budget is not None:
+            self.length_budget.save()
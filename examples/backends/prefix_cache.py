@@ -0,0 +1,139 @@
+"""Shared-prefix KV cache for the fixed translation prompt template
+
+Every prompt for a given language pair starts with the same instruction text.
+The cache keeps the key/value tensors computed for that prefix, so each call
+only has to prefill the user text that follows it.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+
+def cache_to_layers(cache) -> List[Tuple[Any, Any]]:
+    """Return per-layer (key, value) tensors from a transformers cache"""
+    if hasattr(cache, "layers"):
+        # transformers >= 4.56
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    if hasattr(cache, "key_cache"):
+        return list(zip(cache.key_cache, cache.value_cache))
+    # Legacy tuple-of-tuples cache
+    return [tuple(layer[:2]) for layer in cache]
+
+
+def layers_to_cache(layers: Optional[List[Tuple[Any, Any]]] = None, config=None):
+    """Build a DynamicCache, optionally pre-filled with (key, value) tensors
+
+    The stored tensors are not modified: appending to the cache concatenates
+    into new tensors.
+
+    Args:
+        layers: Per-layer (key, value) tensors, e.g. from cache_to_layers
+        config: Model config giving the layer types (e.g. Gemma3's sliding
+            window layers). Sliding layers still keep every position, so all
+            layers stay the same length; attention only reads the window.
+    """
+    from transformers import DynamicCache
+
+    if config is not None:
+        try:
+            cache = DynamicCache(config=config)
+        except TypeError:
+            # transformers < 4.56: no per-layer cache types
+            cache = None
+        cache_layers = getattr(cache, "layers", [])
+        if cache_layers and all(
+            hasattr(layer, "activate_past_recording") for layer in cache_layers if getattr(layer, "is_sliding", False)
+        ):
+            for index, layer in enumerate(cache_layers):
+                if getattr(layer, "is_sliding", False):
+                    layer.activate_past_recording()
+                if layers:
+                    layer.update(*layers[index][:2])
+            return cache
+
+    if not layers:
+        return DynamicCache()
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(tuple(layers))
+    return DynamicCache(ddp_cache_data=layers)
+
+
+@dataclass
+class PrefixEntry:
+    """Precomputed KV cache for one prompt prefix"""
+    token_ids: List[int]
+    layers: List[Tuple[Any, Any]]
+    nbytes: int
+
+    def matches(self, input_ids: List[int]) -> bool:
+        """True if input_ids starts with this prefix and has tokens after it"""
+        n = len(self.token_ids)
+        return len(input_ids) > n and list(input_ids[:n]) == self.token_ids
+
+
+class PrefixCache:
+    """Byte-bounded LRU of prompt-prefix KV caches
+
+    Keys are (model_id, template, source_lang, target_lang) tuples.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        """
+        Args:
+            max_bytes: Memory cap for all stored KV tensors; least recently
+                used prefixes are evicted first
+        """
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, PrefixEntry]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[PrefixEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: Hashable, token_ids: List[int], layers: List[Tuple[Any, Any]]) -> Optional[PrefixEntry]:
+        """Store a prefix; returns None if it alone exceeds max_bytes"""
+        nbytes = sum(
+            k.numel() * k.element_size() + v.numel() * v.element_size()
+            for k, v in layers
+        )
+        if nbytes > self.max_bytes:
+            return None
+
+        if key in self._entries:
+            self.total_bytes -= self._entries.pop(key).nbytes
+
+        while self._entries and self.total_bytes + nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= evicted.nbytes
+            self.evictions += 1
+
+        entry = PrefixEntry(token_ids=list(token_ids), layers=layers, nbytes=nbytes)
+        self._entries[key] = entry
+        self.total_bytes += nbytes
+        return entry
+
+    def clear(self):
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
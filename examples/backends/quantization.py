@@ -0,0 +1,234 @@
+"""Weight quantization presets for CPU inference
+
+On CPU the backend loads the model in float32, about 16 GB for the 4B
+model. The presets trade a little accuracy for memory and speed:
+
+- bf16: load in bfloat16 (half the memory, no other change)
+- int8: dynamic int8 quantization of the Linear layers; weights are stored
+  as int8 and activations are quantized on the fly (CPU only)
+- int4: weight-only int4 with per-group scales, activations stay in
+  bfloat16. On CPU, layers the packed int4 matmul kernel of torch
+  (aten._weight_int4pack_mm_for_cpu, the kernel torchao uses) can handle run
+  on it and decode faster than bf16. Other layers (other devices, older
+  torch, output features not a multiple of 16) dequantize their whole weight
+  on every call: they only save memory and are slower than bf16.
+
+The output projection (lm_head) is left alone in every preset: it is tied to
+the input embeddings, and quantizing it would add a second copy of the
+largest matrix in the model.
+"""
+from typing import Any, Dict, Optional
+
+try:
+    from torch.nn import Module
+except ImportError:
+    Module = object
+
+QUANTIZATION_PRESETS = ("none", "bf16", "int8", "int4")
+
+# Modules never quantized (tied to the embeddings)
+SKIP_MODULES = ("lm_head",)
+
+
+def preset_load_dtype(preset: str, default_dtype):
+    """dtype to load the checkpoint in before the preset is applied"""
+    import torch
+
+    if preset not in QUANTIZATION_PRESETS:
+        available = ", ".join(QUANTIZATION_PRESETS)
+        raise ValueError(f"Unknown quantization preset: {preset}. Available: {available}")
+    if preset in ("bf16", "int4"):
+        return torch.bfloat16
+    if preset == "int8":
+        # Dynamic quantization kernels take float32 weights and activations
+        return torch.float32
+    return default_dtype
+
+
+def quantize_model(model, preset: str, group_size: int = 128):
+    """Apply a quantization preset to a loaded model (in place where possible)
+
+    Returns:
+        The quantized model
+    """
+    if preset == "int8":
+        return _quantize_int8_dynamic(model)
+    if preset == "int4":
+        _quantize_int4_weight_only(model, group_size)
+    return model
+
+
+def _quantizable_linears(model) -> Dict[str, Any]:
+    import torch
+
+    return {
+        name: module for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and name.split(".")[-1] not in SKIP_MODULES
+    }
+
+
+def _quantize_int8_dynamic(model):
+    import torch
+
+    if model.device.type != "cpu":
+        raise ValueError("int8 dynamic quantization runs on CPU only; set FORCE_DEVICE=cpu")
+
+    from torch.ao.quantization import default_dynamic_qconfig, quantize_dynamic
+
+    qconfig_spec = {name: default_dynamic_qconfig for name in _quantizable_linears(model)}
+    return quantize_dynamic(model, qconfig_spec, dtype=torch.qint8, inplace=True)
+
+
+def _quantize_int4_weight_only(model, group_size: int):
+    for name, linear in _quantizable_linears(model).items():
+        parent_name, _, child_name = name.rpartition(".")
+        parent = model.get_submodule(parent_name) if parent_name else model
+        setattr(parent, child_name, Int4WeightOnlyLinear.from_linear(linear, group_size))
+
+
+# Group sizes the packed int4 CPU kernel supports
+_KERNEL_GROUP_SIZES = (32, 64, 128, 256)
+
+
+def _int4_kernel_supported(weight, group_size: int) -> bool:
+    """True if the packed int4 CPU matmul kernel can run a weight"""
+    import torch
+
+    out_features, in_features = weight.shape
+    return (
+        weight.device.type == "cpu"
+        and hasattr(torch.ops.aten, "_weight_int4pack_mm_for_cpu")
+        and out_features % 16 == 0
+        and group_size in _KERNEL_GROUP_SIZES
+        and in_features % group_size == 0
+    )
+
+
+class Int4WeightOnlyLinear(Module):
+    """Linear layer with 4-bit weights, asymmetric per-group quantization
+
+    Two weights are packed per uint8. Each group of group_size input
+    features has its own scale and zero point. With use_kernel the weight is
+    in the packed layout of the int4 CPU kernel and scales and zero points
+    are stored as its scale_and_zeros tensor.
+    """
+
+    def __init__(self, in_features: int, out_features: int, group_size: int,
+                 packed, scales, zeros, bias, dtype, use_kernel: bool = False):
+        import torch
+
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.group_size = group_size
+        self.dtype = dtype
+        self.use_kernel = use_kernel
+        self.register_buffer("packed_weight", packed)
+        if use_kernel:
+            # Kernel dequantization: (q - 8) * scale + zero, laid out [groups, out_features, 2]
+            scale_and_zeros = torch.stack([scales.t(), ((8 - zeros) * scales).t()], dim=-1).contiguous()
+            self.register_buffer("scale_and_zeros", scale_and_zeros)
+        else:
+            self.register_buffer("scales", scales)
+            self.register_buffer("zeros", zeros)
+        self.register_buffer("bias", bias)
+
+    @classmethod
+    def from_linear(cls, linear, group_size: int = 128) -> "Int4WeightOnlyLinear":
+        import torch
+
+        weight = linear.weight.detach()
+        out_features, in_features = weight.shape
+        # Groups must tile the input dimension
+        while in_features % group_size:
+            group_size //= 2
+
+        groups = weight.float().reshape(out_features, in_features // group_size, group_size)
+        w_min = groups.amin(dim=-1, keepdim=True)
+        w_max = groups.amax(dim=-1, keepdim=True)
+        scales = ((w_max - w_min) / 15).clamp(min=1e-8)
+        zeros = (-w_min / scales).round().clamp(0, 15)
+        q = (groups / scales + zeros).round().clamp(0, 15).to(torch.uint8)
+        q = q.reshape(out_features, in_features)
+        use_kernel = _int4_kernel_supported(weight, group_size)
+        if use_kernel:
+            packed = torch.ops.aten._convert_weight_to_int4pack_for_cpu(q.to(torch.int32), 1)
+        else:
+            if in_features % 2:
+                q = torch.nn.functional.pad(q, (0, 1))
+            packed = q[:, 0::2] | (q[:, 1::2] << 4)
+
+        bias = linear.bias.detach().clone() if linear.bias is not None else None
+        return cls(
+            in_features, out_features, group_size, packed,
+            scales.squeeze(-1).to(weight.dtype), zeros.squeeze(-1).to(weight.dtype),
+            bias, weight.dtype, use_kernel
+        )
+
+    def dequantize(self):
+        import torch
+
+        if self.use_kernel:
+            # The kernel applied to the identity matrix gives the transposed weight
+            identity = torch.eye(self.in_features, dtype=self.dtype, device=self.packed_weight.device)
+            return self._kernel_matmul(identity).t()
+
+        q = torch.stack([self.packed_weight & 0x0F, self.packed_weight >> 4], dim=-1)
+        q = q.reshape(self.out_features, -1)[:, :self.in_features]
+        groups = q.reshape(self.out_features, -1, self.group_size).to(self.dtype)
+        weight = (groups - self.zeros.unsqueeze(-1)) * self.scales.unsqueeze(-1)
+        return weight.reshape(self.out_features, self.in_features)
+
+    def _kernel_matmul(self, x):
+        import torch
+
+        return torch.ops.aten._weight_int4pack_mm_for_cpu(
+            x, self.packed_weight, self.group_size, self.scale_and_zeros
+        )
+
+    def forward(self, x):
+        import torch
+
+        x = x.to(self.dtype)
+        if not self.use_kernel:
+            return torch.nn.functional.linear(x, self.dequantize(), self.bias)
+
+        out = self._kernel_matmul(x.reshape(-1, self.in_features))
+        out = out.reshape(*x.shape[:-1], self.out_features)
+        return out + self.bias if self.bias is not None else out
+
+    def extra_repr(self) -> str:
+        return f"in_features={self.in_features}, out_features={self.out_features}, group_size={self.group_size}"
+
+
+def model_memory_bytes(model) -> int:
+    """Bytes held by a model's weights and buffers, quantized tensors included
+
+    Tied tensors are counted once.
+    """
+    seen = set()
+    total = 0
+
+    def add(value):
+        nonlocal total
+        if isinstance(value, (tuple, list)):
+            for item in value:
+                add(item)
+            return
+        if not hasattr(value, "element_size") or value.data_ptr() in seen:
+            return
+        seen.add(value.data_ptr())
+        total += value.numel() * value.element_size()
+
+    for value in model.state_dict(keep_vars=True).values():
+        add(value)
+    return total
+
+
+def process_memory_gb() -> Optional[float]:
+    """Resident memory of this process in GB (None without psutil)"""
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss / (1024**3)
@@ -0,0 +1,201 @@
+"""Deduplication of repeated segments within one translation job
+
+PDF pages repeat journal headers, footers, arXiv stamps and equation labels
+on every page. Translated page by page, each copy is paid for again inside
+every page prompt. Once the pages are split into segments (text blocks),
+plan_dedup() hashes every segment in its normalized form (see
+translation_cache.normalize_text) and translate_pages() sends each distinct
+segment to the backend once, in bounded translate_batch() groups in page
+order, then fans the result out to every occurrence.
+"""
+import copy
+import hashlib
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    from .base import TranslationBackend
+    from .cancellation import CancellationToken
+    from .translation_cache import normalize_text
+except ImportError:
+    from base import TranslationBackend
+    from cancellation import CancellationToken
+    from translation_cache import normalize_text
+
+
+def segment_digest(text: str) -> str:
+    """Hex digest of a segment's normalized text"""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class DedupPlan:
+    """Distinct segments of a job and where each segment's translation comes from"""
+    segments: List[str]
+    # First occurrence of every distinct non-empty segment, in job order
+    unique: List[str]
+    # Index into unique for every segment; None for empty segments
+    positions: List[Optional[int]]
+
+    @property
+    def dedup_ratio(self) -> float:
+        """Share of non-empty segments served by another occurrence"""
+        translated = sum(position is not None for position in self.positions)
+        return 1 - len(self.unique) / translated if translated else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        translated = sum(position is not None for position in self.positions)
+        return {
+            "segments": len(self.segments),
+            "unique_segments": len(self.unique),
+            "duplicate_segments": translated - len(self.unique),
+            "dedup_ratio": self.dedup_ratio
+        }
+
+
+def plan_dedup(segments: List[str]) -> DedupPlan:
+    """Group the segments of a job by normalized text"""
+    unique: List[str] = []
+    positions: List[Optional[int]] = []
+    seen: Dict[str, int] = {}
+    for segment in segments:
+        if not normalize_text(segment):
+            positions.append(None)
+            continue
+        digest = segment_digest(segment)
+        if digest not in seen:
+            seen[digest] = len(unique)
+            unique.append(segment)
+        positions.append(seen[digest])
+    return DedupPlan(segments, unique, positions)
+
+
+def translate_pages(
+    backend: TranslationBackend,
+    pages: List[List[str]],
+    source_lang: str = "en",
+    target_lang: str = "zh-TW",
+    plan: Optional[DedupPlan] = None,
+    max_group_segments: int = 16,
+    cancel_token: Optional[CancellationToken] = None
+) -> Iterator[List[Dict[str, Any]]]:
+    """Translate the segments of every page, each distinct segment once
+
+    Segments are deduplicated across all pages, but translated in page order:
+    the distinct segments first seen on the next pages are sent to
+    translate_batch() in groups of at most max_group_segments, and each page
+    is yielded as soon as all of its segments are translated.
+
+    The first occurrence of a segment gets the backend's result (metadata
+    segment_dedup "unique" and its number of occurrences); repeats get a copy
+    with segment_dedup "duplicate", time and tokens 0. Empty segments are not
+    sent to the backend and translate to "".
+
+    Args:
+        backend: Backend to translate the distinct segments with
+        pages: Segments of every page, e.g. from extract_segments_from_pdf
+        source_lang: Source language code (ISO 639-1)
+        target_lang: Target language code (ISO 639-1)
+        plan: plan_dedup() of all segments in page order, if already made
+        max_group_segments: Distinct segments per translate_batch() call
+        cancel_token: Optional token passed to translate_batch()
+
+    Yields:
+        translate() result dicts of each page's segments, page by page
+    """
+    if plan is None:
+        plan = plan_dedup([segment for page in pages for segment in page])
+    occurrences = [0] * len(plan.unique)
+    for position in plan.positions:
+        if position is not None:
+            occurrences[position] += 1
+
+    unique_results: Dict[int, Dict[str, Any]] = {}
+    served = set()
+    group: List[int] = []
+    # Pages waiting for the group to be translated: (first segment, end) in plan.positions
+    waiting: List[Tuple[int, int]] = []
+
+    def translate_group():
+        for start in range(0, len(group), max_group_segments):
+            positions = group[start:start + max_group_segments]
+            results = backend.translate_batch(
+                [plan.unique[position] for position in positions], source_lang, target_lang, cancel_token
+            )
+            unique_results.update(zip(positions, results))
+        group.clear()
+
+    def page_results(first: int, end: int) -> List[Dict[str, Any]]:
+        results = []
+        for position in plan.positions[first:end]:
+            if position is None:
+                results.append({"translation": "", "time": 0.0, "tokens": 0, "metadata": {"segment_dedup": "empty"}})
+            elif position not in served:
+                served.add(position)
+                result = unique_results[position]
+                result.setdefault("metadata", {}).update({
+                    "segment_dedup": "unique",
+                    "occurrences": occurrences[position]
+                })
+                results.append(result)
+            else:
+                result = copy.deepcopy(unique_results[position])
+                result["metadata"].pop("occurrences", None)
+                result["metadata"].update({
+                    "segment_dedup": "duplicate",
+                    "tokens_per_second": 0
+                })
+                result["time"] = 0.0
+                result["tokens"] = 0
+                results.append(result)
+        return results
+
+    first = 0
+    for page in pages:
+        end = first + len(page)
+        new = []
+        for position in plan.positions[first:end]:
+            if position is not None and position not in unique_results and position not in group \
+                    and position not in new:
+                new.append(position)
+        if group and len(group) + len(new) > max_group_segments:
+            translate_group()
+            for span in waiting:
+                yield page_results(*span)
+            waiting.clear()
+        group.extend(new)
+        waiting.append((first, end))
+        first = end
+
+    translate_group()
+    for span in waiting:
+        yield page_results(*span)
+
+
+def merge_segment_results(results: List[Dict[str, Any]], separator: str = "\n\n") -> Dict[str, Any]:
+    """Combine the segment results of one page into one translate() result dict"""
+    duration = sum(result["time"] for result in results)
+    total_tokens = sum(result["tokens"] for result in results)
+    segment_metadata = [result.get("metadata", {}) for result in results]
+    metadata = {
+        "segments": len(results),
+        "duplicate_segments": sum(meta.get("segment_dedup") == "duplicate" for meta in segment_metadata),
+        "chunks": sum(meta.get("chunks", 1) for meta in segment_metadata if meta.get("segment_dedup") != "empty"),
+        "tokens_per_second": total_tokens / duration if duration > 0 else 0,
+        "segment_metadata": segment_metadata
+    }
+    extractions = {meta["extraction"] for meta in segment_metadata if "extraction" in meta}
+    if extractions:
+        metadata["extraction"] = "heuristic" if "heuristic" in extractions else extractions.pop()
+    errors = [meta["error"] for meta in segment_metadata if "error" in meta]
+    if errors:
+        metadata["error"] = errors[0]
+
+    return {
+        "translation": separator.join(
+            result["translation"].strip() for result in results if result["translation"].strip()
+        ),
+        "time": duration,
+        "tokens": total_tokens,
+        "metadata": metadata
+    }
@@ -0,0 +1,249 @@
+"""Speculative decoding without a draft model
+
+Draft tokens are proposed by n-gram lookup (copy what followed the latest
+n tokens somewhere in a token corpus) and verified by the target model in a
+single forward pass. Verification is greedy, so the output is the same as
+plain greedy decoding; only the number of forward passes changes.
+
+Translations of technical text copy numbers, names, citations and LaTeX
+from the source, which makes the prompt itself a good draft corpus. An
+earlier translation of a near-identical source is an even better one:
+ReferenceProposer follows it token by token and drafts long runs of it.
+"""
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+try:
+    from .prefix_cache import layers_to_cache
+except ImportError:
+    from prefix_cache import layers_to_cache
+
+
+class NgramProposer:
+    """Propose draft tokens by n-gram matching against a token corpus"""
+
+    def __init__(
+        self,
+        corpus: Iterable[int] = (),
+        max_ngram_size: int = 3,
+        num_pred_tokens: int = 10,
+        track_generated: bool = True
+    ):
+        """
+        Args:
+            corpus: Initial tokens to copy from (e.g. the prompt)
+            max_ngram_size: Longest trailing n-gram to match
+            num_pred_tokens: Maximum draft length per step
+            track_generated: Also add generated tokens to the corpus
+        """
+        self.max_ngram_size = max_ngram_size
+        self.num_pred_tokens = num_pred_tokens
+        self.track_generated = track_generated
+        self.corpus: List[int] = []
+        # n-gram -> corpus position right after its first occurrence
+        self._index: Dict[Tuple[int, ...], int] = {}
+        self.add(corpus)
+
+    def add(self, tokens: Iterable[int]):
+        """Append tokens to the corpus and index the n-grams ending in them"""
+        for token in tokens:
+            self.corpus.append(token)
+            end = len(self.corpus)
+            for n in range(1, min(self.max_ngram_size, end) + 1):
+                self._index.setdefault(tuple(self.corpus[end - n:end]), end)
+
+    def propose(self, context: List[int]) -> List[int]:
+        """Return draft tokens continuing context (may be empty)"""
+        for n in range(min(self.max_ngram_size, len(context)), 0, -1):
+            start = self._index.get(tuple(context[-n:]))
+            if start is not None and start < len(self.corpus):
+                return self.corpus[start:start + self.num_pred_tokens]
+        return []
+
+
+class ReferenceProposer(NgramProposer):
+    """Propose draft tokens by following a reference output
+
+    The reference (e.g. the stored translation of a similar source) is
+    drafted from its start. While the generated tokens agree with it, the
+    draft continues where the last step ended; after a divergence the
+    position is recovered by n-gram lookup in the reference, then in the
+    rest of the corpus (e.g. the prompt).
+    """
+
+    def __init__(
+        self,
+        reference: Iterable[int],
+        prompt_length: int,
+        corpus: Iterable[int] = (),
+        max_ngram_size: int = 3,
+        num_pred_tokens: int = 32
+    ):
+        """
+        Args:
+            reference: Token ids of the reference output
+            prompt_length: Length of the context before the first generated token
+            corpus: Further tokens to copy from after a divergence (e.g. the prompt)
+            max_ngram_size: Longest trailing n-gram to match when re-aligning
+            num_pred_tokens: Maximum draft length per step
+        """
+        reference = list(reference)
+        super().__init__(reference + list(corpus), max_ngram_size, num_pred_tokens, track_generated=False)
+        self.reference_length = len(reference)
+        # Corpus position of the next expected token; None after a divergence
+        self._position = 0
+        self._seen = prompt_length
+
+    def propose(self, context: List[int]) -> List[int]:
+        # Advance along the corpus over the tokens generated since the last call
+        for token in context[self._seen:]:
+            if self._position is not None and self._position < len(self.corpus) \
+                    and self.corpus[self._position] == token:
+                self._position += 1
+            else:
+                self._position = None
+        self._seen = len(context)
+
+        if self._position is not None and self._position < self.reference_length:
+            return self.corpus[self._position:min(self._position + self.num_pred_tokens, self.reference_length)]
+
+        for n in range(min(self.max_ngram_size, len(context)), 0, -1):
+            start = self._index.get(tuple(context[-n:]))
+            if start is not None and start < len(self.corpus):
+                # Tentative; checked against the tokens generated next
+                self._position = start
+                end = self.reference_length if start < self.reference_length else len(self.corpus)
+                return self.corpus[start:min(start + self.num_pred_tokens, end)]
+        self._position = None
+        return []
+
+
+def eos_token_ids(model, tokenizer) -> Set[int]:
+    """Collect the EOS ids generate() would stop on"""
+    eos_ids = set()
+    config_eos = getattr(model.generation_config, "eos_token_id", None)
+    if isinstance(config_eos, int):
+        eos_ids.add(config_eos)
+    elif config_eos:
+        eos_ids.update(config_eos)
+    if tokenizer.eos_token_id is not None:
+        eos_ids.add(tokenizer.eos_token_id)
+    return eos_ids
+
+
+def speculative_generate(
+    model,
+    input_ids: List[int],
+    proposer: NgramProposer,
+    max_new_tokens: int,
+    eos_ids: Set[int],
+    past_key_values=None,
+    cached_tokens: int = 0,
+    stopping_criteria=None,
+    streamer=None
+) -> Tuple[List[int], Dict[str, Any]]:
+    """Greedy decoding with draft-and-verify steps
+
+    Args:
+        model: Causal LM
+        input_ids: Prompt token ids
+        proposer: Source of draft tokens
+        max_new_tokens: Generation budget
+        eos_ids: Token ids that end generation
+        past_key_values: Optional cache already holding the first cached_tokens
+            prompt tokens (e.g. from the prefix cache)
+        cached_tokens: Number of prompt tokens in past_key_values
+        stopping_criteria: Optional StoppingCriteriaList, checked after every
+            step against prompt + generated ids
+        streamer: Optional transformers streamer; gets the prompt, then the
+            accepted tokens of every step
+
+    Returns:
+        (generated token ids, stats dict)
+    """
+    import torch
+
+    device = model.device
+    if streamer is not None:
+        streamer.put(torch.tensor(input_ids))
+    cache = past_key_values if past_key_values is not None else layers_to_cache()
+    if past_key_values is None:
+        cached_tokens = 0
+
+    with torch.no_grad():
+        # Prefill the uncached part of the prompt
+        outputs = model(
+            input_ids=torch.tensor([input_ids[cached_tokens:]], device=device),
+            past_key_values=cache,
+            use_cache=True
+        )
+        cache = outputs.past_key_values
+
+        # Next token to feed; it is not in the cache yet
+        pending = int(outputs.logits[0, -1].argmax())
+        generated = [pending]
+        context = list(input_ids) + generated
+        if proposer.track_generated:
+            proposer.add(generated)
+        if streamer is not None:
+            streamer.put(torch.tensor(generated))
+
+        draft_tokens = 0
+        accepted_tokens = 0
+        steps = 0
+
+        def should_stop() -> bool:
+            if not stopping_criteria:
+                return False
+            return bool(torch.as_tensor(stopping_criteria(torch.tensor([context], device=device), None)).any())
+
+        while pending not in eos_ids and len(generated) < max_new_tokens and not should_stop():
+            draft = proposer.propose(context)[:max_new_tokens - len(generated) - 1]
+
+            outputs = model(
+                input_ids=torch.tensor([[pending] + draft], device=device),
+                past_key_values=cache,
+                use_cache=True
+            )
+            cache = outputs.past_key_values
+            predicted = outputs.logits[0].argmax(dim=-1).tolist()
+            steps += 1
+
+            # Keep the draft up to the first disagreement with the model
+            accepted = 0
+            while accepted < len(draft) and draft[accepted] == predicted[accepted]:
+                accepted += 1
+                if draft[accepted - 1] in eos_ids:
+                    break
+
+            new_tokens = draft[:accepted]
+            if not new_tokens or new_tokens[-1] not in eos_ids:
+                # The model's own prediction after the accepted run comes for free
+                new_tokens.append(predicted[accepted])
+
+            draft_tokens += len(draft)
+            accepted_tokens += accepted
+
+            # Drop rejected draft positions; the cache now ends before the new pending token
+            rejected = len(draft) - accepted
+            if rejected:
+                cache.crop(-rejected)
+
+            generated.extend(new_tokens)
+            context.extend(new_tokens)
+            if proposer.track_generated:
+                proposer.add(new_tokens)
+            if streamer is not None:
+                streamer.put(torch.tensor(new_tokens))
+            pending = new_tokens[-1]
+
+    if streamer is not None:
+        streamer.end()
+
+    stats = {
+        "draft_tokens": draft_tokens,
+        "accepted_draft_tokens": accepted_tokens,
+        "acceptance_rate": accepted_tokens / draft_tokens if draft_tokens > 0 else 0.0,
+        "verify_steps": steps,
+        "tokens_per_step": (len(generated) - 1) / steps if steps > 0 else 0.0
+    }
+    return generated, stats
@@ -0,0 +1,171 @@
+"""Generation stopping criteria shared by the transformers backends
+
+Degenerate outputs loop: the same span of tokens repeats until the token
+budget runs out. RepetitionStoppingCriteria detects such loops from the
+suffix of the generated tokens and stops generate() at the token where the
+loop is detected. CancellationStoppingCriteria stops every row once the
+caller cancels the translation.
+"""
+from typing import Iterable, List, Optional, Set, Tuple
+
+try:
+    from transformers import StoppingCriteria
+except ImportError:
+    StoppingCriteria = object
+
+
+class RepetitionDetector:
+    """Incremental suffix period detection for one token sequence
+
+    For every candidate period p it tracks how many trailing tokens satisfy
+    token[i] == token[i - p]. A run of r such tokens means the last r + p
+    tokens repeat with period p. Each added token costs O(max_period).
+    """
+
+    def __init__(self, max_period: int = 64, min_repeats: int = 4, min_span: int = 32):
+        """
+        Args:
+            max_period: Longest repeating unit to detect, in tokens
+            min_repeats: Minimum number of copies of the unit
+            min_span: Minimum number of tokens covered by the repetition
+        """
+        self.max_period = max_period
+        self.min_repeats = min_repeats
+        self.min_span = min_span
+        self.tokens: List[int] = []
+        self._runs = [0] * (max_period + 1)
+        # (period, span) once a loop is detected
+        self.detected: Optional[Tuple[int, int]] = None
+
+    def add(self, token: int) -> bool:
+        """Add one token; returns True once a loop has been detected"""
+        if self.detected is not None:
+            return True
+
+        self.tokens.append(token)
+        n = len(self.tokens)
+        for period in range(1, min(self.max_period, n - 1) + 1):
+            if token == self.tokens[n - 1 - period]:
+                self._runs[period] += 1
+            else:
+                self._runs[period] = 0
+
+            span = self._runs[period] + period
+            # Smallest period first, so the reported unit is the fundamental one
+            if span >= self.min_span and span // period >= self.min_repeats:
+                self.detected = (period, span)
+                return True
+        return False
+
+    def extend(self, tokens: Iterable[int]) -> bool:
+        for token in tokens:
+            if self.add(token):
+                return True
+        return False
+
+    @property
+    def excess_tokens(self) -> int:
+        """Tokens to drop so that only one copy of the repeated unit remains"""
+        if self.detected is None:
+            return 0
+        period, span = self.detected
+        return span - period
+
+
+class RepetitionStoppingCriteria(StoppingCriteria):
+    """Stop generate() rows whose generated tokens have started looping
+
+    Only tokens after prompt_length are inspected, so repetition in the
+    source text never triggers it.
+    """
+
+    def __init__(
+        self,
+        prompt_length: int,
+        ignore_token_ids: Optional[Set[int]] = None,
+        max_period: int = 64,
+        min_repeats: int = 4,
+        min_span: int = 32
+    ):
+        """
+        Args:
+            prompt_length: Number of prompt tokens per row (padded length for batches)
+            ignore_token_ids: Tokens to skip, e.g. padding after a row finished
+            max_period, min_repeats, min_span: See RepetitionDetector
+        """
+        self.prompt_length = prompt_length
+        self.ignore_token_ids = ignore_token_ids or set()
+        self.detector_kwargs = {
+            "max_period": max_period,
+            "min_repeats": min_repeats,
+            "min_span": min_span
+        }
+        self.detectors: List[RepetitionDetector] = []
+        self._seen = prompt_length
+
+    def __call__(self, input_ids, scores=None, **kwargs):
+        import torch
+
+        if not self.detectors:
+            self.detectors = [RepetitionDetector(**self.detector_kwargs) for _ in range(input_ids.shape[0])]
+
+        # Assisted and speculative decoding can add several tokens per call
+        new_tokens = input_ids[:, self._seen:].tolist()
+        self._seen = input_ids.shape[1]
+
+        for detector, tokens in zip(self.detectors, new_tokens):
+            detector.extend(t for t in tokens if t not in self.ignore_token_ids)
+
+        return torch.tensor(
+            [detector.detected is not None for detector in self.detectors],
+            dtype=torch.bool,
+            device=input_ids.device
+        )
+
+    def row_info(self, row: int = 0) -> dict:
+        """Metadata describing whether (and how) a row was stopped"""
+        if row >= len(self.detectors) or self.detectors[row].detected is None:
+            return {"repetition_stopped": False}
+        period, span = self.detectors[row].detected
+        return {
+            "repetition_stopped": True,
+            "repetition_period": period,
+            "repetition_span": span
+        }
+
+    def trim(self, token_ids: List[int], row: int = 0) -> List[int]:
+        """Drop the repeated copies from a row's generated tokens
+
+        Tokens in ignore_token_ids that follow the loop are dropped as well.
+        """
+        if row >= len(self.detectors) or self.detectors[row].detected is None:
+            return token_ids
+        detector = self.detectors[row]
+        kept = [t for t in token_ids if t not in self.ignore_token_ids]
+        # Tokens accepted after the detection point (speculative steps) go too
+        return kept[:len(detector.tokens) - detector.excess_tokens]
+
+
+class CancellationStoppingCriteria(StoppingCriteria):
+    """Stop generate() as soon as a CancellationToken is cancelled
+
+    Checked once per decode step, so a cancelled translation stops within one
+    forward pass.
+    """
+
+    def __init__(self, cancel_token):
+        """
+        Args:
+            cancel_token: CancellationToken shared with the caller
+        """
+        self.cancel_token = cancel_token
+
+    def __call__(self, input_ids, scores=None, **kwargs):
+        import torch
+
+        return torch.full(
+            (input_ids.shape[0],),
+            self.cancel_token.cancelled,
+            dtype=torch.bool,
+            device=input_ids.device
+        )
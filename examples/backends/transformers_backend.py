@@ -1,12 +1,39 @@
 """Transformers backend for TranslateGemma"""
 import time
 import os
-from typing import Dict, Any
+import threading
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 
 try:
     from .base import TranslationBackend
+    from .batch_scheduler import LengthBucketScheduler
+    from .prefix_cache import PrefixCache, cache_to_layers, layers_to_cache
+    from .speculative import NgramProposer, ReferenceProposer, eos_token_ids, speculative_generate
+    from .better_extraction import extract_translation_from_ids
+    from .stopping import RepetitionStoppingCriteria, CancellationStoppingCriteria
+    from .cancellation import CancellationToken, raise_if_cancelled
+    from .length_budget import LengthBudget
+    from .quantization import preset_load_dtype, quantize_model, model_memory_bytes, process_memory_gb
+    from .kv_cache import build_quantized_cache, cache_nbytes
+    from .compiled_generation import CompiledGenerator
+    from .vocab_restriction import VocabularyRestriction, restricted_generate
 except ImportError:
     from base import TranslationBackend
+    from batch_scheduler import LengthBucketScheduler
+    from prefix_cache import PrefixCache, cache_to_layers, layers_to_cache
+    from speculative import NgramProposer, ReferenceProposer, eos_token_ids, speculative_generate
+    from better_extraction import extract_translation_from_ids
+    from stopping import RepetitionStoppingCriteria, CancellationStoppingCriteria
+    from cancellation import CancellationToken, raise_if_cancelled
+    from length_budget import LengthBudget
+    from quantization import preset_load_dtype, quantize_model, model_memory_bytes, process_memory_gb
+    from kv_cache import build_quantized_cache, cache_nbytes
+    from compiled_generation import CompiledGenerator
+    from vocab_restriction import VocabularyRestriction, restricted_generate
+
+
+# Short probe sentence used to measure decode speed at load time
+PROBE_TEXT = "The model achieves 92.4% accuracy on the benchmark, as shown in Table 2."
 
 
 class TransformersBackend(TranslationBackend):
@@ -16,13 +43,98 @@ class TransformersBackend(TranslationBackend):
         super().__init__()
         self.device_map = None
         self.torch_dtype = None
+        # Length bucketing for translate_batch; replace to tune batch budgets
+        self.scheduler = LengthBucketScheduler()
+        self.last_batch_stats = None
+        # KV cache of the fixed prompt prefix per language pair; None disables
+        self.prefix_cache = PrefixCache()
+        # Prompt-lookup speculative decoding (see load_model)
+        self.prompt_lookup = False
+        self.prompt_lookup_ngram_size = 3
+        self.prompt_lookup_num_tokens = 10
+        # Maximum draft length per step when following a reference translation
+        self.reference_draft_num_tokens = 32
+        self.accepts_reference_draft = True
+        # Small draft model for assisted generation (see load_model)
+        self.draft_model = None
+        self.draft_model_id = None
+        self.assistance_probe = {}
+        # Stop generation as soon as the output starts looping
+        self.stop_on_repetition = True
+        # Weight quantization preset (see load_model)
+        self.quantization = "none"
+        # 8 or 4 to store the KV cache quantized during generation (see load_model)
+        self.kv_cache_bits = None
+        # Static cache + compiled decode step for greedy generation (see load_model)
+        self.compiled_generator = None
+        # LM-head subsets per target language for greedy decoding (see load_model)
+        self.vocab_restriction = None
+        self.restrict_vocab_min_confidence = 0.3
+        self.restrict_vocab_verify_every = 16
+        # max_new_tokens learned from past output/input ratios; None = fixed 2048
+        self.length_budget = LengthBudget(namespace="transformers")
 
     def load_model(self, **kwargs) -> Dict[str, Any]:
-        """Load model using transformers"""
+        """Load model using transformers
+
+        Keyword Args:
+            prompt_lookup: Draft tokens by n-gram lookup in the prompt and verify
+                them in one forward pass (default: PROMPT_LOOKUP env var, "0")
+            prompt_lookup_num_tokens: Maximum draft length per step (default: 10)
+            model_id: Target model id or local path (default: self.model_id)
+            draft_model_id: Small model sharing the target's tokenizer, used for
+                assisted generation (default: DRAFT_MODEL_ID env var, unset)
+            quantization: Weight preset, one of none, bf16, int8 (CPU only) or
+                int4 (default: QUANTIZATION env var, "none"). Applied to the
+                draft model too. int4 is faster than bf16 only where torch's
+                packed int4 CPU kernel runs; elsewhere it saves memory but
+                dequantizes every layer on each call and is slower.
+            probe_speed: Measure decode tokens/sec after loading (default: on
+                when a quantization preset is selected)
+            kv_cache_bits: Store the KV cache in 8 or 4 bits during plain
+                greedy and batched generation (default: KV_CACHE_BITS env var,
+                unset = full precision)
+            compile: Greedy and batched generation with a static KV cache and
+                a torch.compile'd decode step; prompts are padded to length
+                buckets and each cache bucket is compiled on its first use
+                (default: COMPILE env var, "0"). Not combinable with
+                kv_cache_bits.
+            compile_cache_lengths: Cache buckets (from
+                compiled_generation.CACHE_BUCKETS) compiled at load time
+                instead (default: COMPILE_CACHE_LENGTHS env var, comma
+                separated, unset = none)
+            restrict_vocab: Compute logits only over the target script's
+                tokens, digits, punctuation and the source text's tokens during
+                single-text greedy decoding (default: RESTRICT_VOCAB env var, "0").
+                Lossy: the output can differ from plain greedy decoding
+            restrict_vocab_min_confidence: Steps whose top restricted
+                probability is lower use the full vocabulary (default: 0.3)
+            restrict_vocab_verify_every: The first step and every n-th step
+                use the full vocabulary as a check (default: 16, 0 = never)
+        """
         import torch
         from transformers import AutoModelForCausalLM, AutoTokenizer
         import psutil
 
+        self.prompt_lookup = kwargs.get("prompt_lookup", os.getenv("PROMPT_LOOKUP", "0") == "1")
+        self.prompt_lookup_num_tokens = kwargs.get("prompt_lookup_num_tokens", self.prompt_lookup_num_tokens)
+        self.model_id = kwargs.get("model_id", self.model_id)
+        self.draft_model_id = kwargs.get("draft_model_id", os.getenv("DRAFT_MODEL_ID"))
+        self.quantization = kwargs.get("quantization", os.getenv("QUANTIZATION", "none"))
+        probe_speed = kwargs.get("probe_speed", self.quantization != "none")
+        kv_cache_bits = kwargs.get("kv_cache_bits", os.getenv("KV_CACHE_BITS"))
+        self.kv_cache_bits = int(kv_cache_bits) if kv_cache_bits else None
+        compile_model = kwargs.get("compile", os.getenv("COMPILE", "0") == "1")
+        restrict_vocab = kwargs.get("restrict_vocab", os.getenv("RESTRICT_VOCAB", "0") == "1")
+        self.restrict_vocab_min_confidence = kwargs.get(
+            "restrict_vocab_min_confidence", self.restrict_vocab_min_confidence
+        )
+        self.restrict_vocab_verify_every = kwargs.get(
+            "restrict_vocab_verify_every", self.restrict_vocab_verify_every
+        )
+        if compile_model and self.kv_cache_bits:
+            raise ValueError("compile needs a static cache and cannot be combined with kv_cache_bits")
+
         start_time = time.time()
 
         # Get available memory
@@ -46,6 +158,9 @@ class TransformersBackend(TranslationBackend):
             self.device_map = "auto"
             self.torch_dtype = torch.bfloat16
 
+        # Quantized presets start from their own checkpoint dtype
+        self.torch_dtype = preset_load_dtype(self.quantization, self.torch_dtype)
+
         # Prepare load kwargs
         load_kwargs = {
             "torch_dtype": self.torch_dtype,
@@ -66,38 +181,178 @@ class TransformersBackend(TranslationBackend):
             **load_kwargs
         )
 
+        self.model = quantize_model(self.model, self.quantization)
+
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_id)
 
+        # Draft model for assisted generation; same device, dtype and quantization as the target
+        if self.draft_model_id:
+            self.draft_model = AutoModelForCausalLM.from_pretrained(
+                self.draft_model_id,
+                **load_kwargs
+            )
+            self.draft_model = quantize_model(self.draft_model, self.quantization)
+
+        # Left padding for translate_batch: generated tokens must follow the
+        # real prompt tokens in every row
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        if restrict_vocab:
+            self.vocab_restriction = VocabularyRestriction(self.model, self.tokenizer)
+
+        compile_times = {}
+        if compile_model:
+            self.compiled_generator = CompiledGenerator(self.model, self.tokenizer.pad_token_id)
+            compile_cache_lengths = kwargs.get("compile_cache_lengths", [
+                int(length) for length in os.getenv("COMPILE_CACHE_LENGTHS", "").split(",") if length.strip()
+            ])
+            compile_times = self.compiled_generator.warmup(self._probe_input_ids(), compile_cache_lengths)
+
         load_time = time.time() - start_time
 
-        # Get actual device
-        device_info = f"{self.model.device}, dtype: {self.model.dtype}"
+        metadata = {
+            "device": str(self.model.device),
+            "dtype": str(self.model.dtype),
+            "device_map": self.device_map,
+            "available_memory_gb": available_mem_gb,
+            "quantization": self.quantization,
+            "kv_cache_bits": self.kv_cache_bits,
+            "compiled": self.compiled_generator is not None,
+            "model_memory_gb": model_memory_bytes(self.model) / (1024**3),
+            "process_memory_gb": process_memory_gb(),
+            "decoding": self._decoding_mode()
+        }
+
+        if compile_times:
+            metadata["compile_time"] = sum(compile_times.values())
+            metadata["compile_times"] = compile_times
+
+        if probe_speed:
+            metadata["probe_tokens_per_second"] = self._probe_tokens_per_second()
+
+        if probe_speed and self.vocab_restriction is not None:
+            metadata.update(self._probe_restricted_vocab())
+
+        if self.draft_model is not None:
+            self.assistance_probe = self._probe_assistance()
+            metadata["draft_model"] = self.draft_model_id
+            metadata.update(self.assistance_probe)
 
         return {
             "model_loaded": True,
             "load_time": load_time,
-            "metadata": {
-                "device": str(self.model.device),
-                "dtype": str(self.model.dtype),
-                "device_map": self.device_map,
-                "available_memory_gb": available_mem_gb
-            }
+            "metadata": metadata
+        }
+
+    def _decoding_mode(self) -> str:
+        # A draft model takes precedence over prompt lookup
+        if self.draft_model is not None:
+            return "assisted"
+        if self.prompt_lookup:
+            return "prompt_lookup"
+        if self.vocab_restriction is not None:
+            return "restricted_vocab"
+        return "greedy"
+
+    def _probe_input_ids(self):
+        return self.tokenizer(
+            self._build_prompt(PROBE_TEXT, "en", "zh-TW"),
+            return_tensors="pt"
+        ).input_ids.to(self.model.device)
+
+    def _probe_tokens_per_second(self, **generate_kwargs) -> float:
+        """Greedy decode speed on a short probe sentence (32 new tokens)
+
+        Runs through the compiled path when compile is on and no extra
+        generate arguments are given.
+        """
+        import torch
+
+        inputs = self._probe_input_ids()
+
+        start_time = time.time()
+        if self.compiled_generator is not None and not generate_kwargs:
+            padded, attention_mask, padding = self.compiled_generator.pad(inputs)
+            outputs = self.compiled_generator.generate(padded, attention_mask, max_new_tokens=32).sequences
+            outputs = outputs[:, padding:]
+        else:
+            with torch.no_grad():
+                outputs = self.model.generate(inputs, max_new_tokens=32, do_sample=False, **generate_kwargs)
+        duration = time.time() - start_time
+        new_tokens = outputs.shape[1] - inputs.shape[1]
+        return new_tokens / duration if duration > 0 else 0
+
+    def _probe_assistance(self) -> Dict[str, Any]:
+        """Measure decode speed with and without the draft model on a short probe"""
+        speeds = {
+            "unassisted_tokens_per_second": self._probe_tokens_per_second(),
+            "assisted_tokens_per_second": self._probe_tokens_per_second(assistant_model=self.draft_model)
         }
+        if speeds["unassisted_tokens_per_second"] > 0:
+            speeds["assisted_speedup"] = speeds["assisted_tokens_per_second"] / speeds["unassisted_tokens_per_second"]
+        return speeds
+
+    def _probe_restricted_vocab(self) -> Dict[str, Any]:
+        """Decode speed on the probe sentence with and without vocabulary restriction"""
+        input_ids = self._probe_input_ids()[0].tolist()
+
+        start_time = time.time()
+        generated, stats = restricted_generate(
+            self.model,
+            input_ids,
+            self.vocab_restriction,
+            PROBE_TEXT,
+            "zh-TW",
+            max_new_tokens=32,
+            eos_ids=set(),
+            min_confidence=self.restrict_vocab_min_confidence,
+            verify_every=self.restrict_vocab_verify_every
+        )
+        duration = time.time() - start_time
+
+        speeds = {
+            "unrestricted_tokens_per_second": self._probe_tokens_per_second(),
+            "restricted_vocab_tokens_per_second": len(generated) / duration if duration > 0 else 0,
+            "restricted_vocab_size": stats["restricted_vocab_size"],
+            "vocab_size": stats["vocab_size"]
+        }
+        if speeds["unrestricted_tokens_per_second"] > 0:
+            speeds["restricted_vocab_speedup"] = (
+                speeds["restricted_vocab_tokens_per_second"] / speeds["unrestricted_tokens_per_second"]
+            )
+        return speeds
 
     def translate(
         self,
         text: str,
         source_lang: str = "en",
-        target_lang: str = "zh-TW"
+        target_lang: str = "zh-TW",
+        cancel_token: Optional[CancellationToken] = None,
+        streamer=None,
+        reference: Optional[str] = None
     ) -> Dict[str, Any]:
-        """Translate using transformers"""
+        """Translate using transformers
+
+        Args:
+            streamer: Optional transformers streamer that receives the prompt
+                and then the generated tokens (see translate_stream)
+            reference: Optional earlier translation of a similar source (e.g.
+                a near match from a TranslationMemory). It is used as the
+                speculative draft: runs the model agrees with are accepted in
+                one forward pass each, and the output stays the greedy
+                translation of text. Ignored for texts that need chunking.
+        """
         import torch
 
-        # Use simple direct prompt (more reliable than chat template)
-        if target_lang == "zh-TW":
-            prompt = f"Translate the following text from {source_lang} to Traditional Chinese (Taiwan, 繁體中文). Only output the translation, do not include any explanations:\n\n{text}\n\nTranslation:"
-        else:
-            prompt = f"Translate the following text from {source_lang} to {target_lang}. Only output the translation:\n\n{text}\n\nTranslation:"
+        raise_if_cancelled(cancel_token)
+
+        # Long pages are chunked instead of truncated at max_length
+        if self.needs_chunking(text):
+            return self.translate_chunked(text, source_lang, target_lang, cancel_token)
+
+        prompt = self._build_prompt(text, source_lang, target_lang)
 
         # Tokenize
         inputs = self.tokenizer(
@@ -107,47 +362,602 @@ class TransformersBackend(TranslationBackend):
             max_length=2048
         ).input_ids.to(self.model.device)
 
+        source_tokens, max_new_tokens = self._length_budgets([text], source_lang, target_lang)
+
         start_time = time.time()
 
-        # Generate (increased max_new_tokens to avoid truncation)
-        with torch.no_grad():
-            outputs = self.model.generate(
-                inputs,
-                max_new_tokens=2048,  # Increased from 256 to avoid truncation
-                do_sample=False
+        decoding = self._decoding_mode()
+        if reference and reference.strip():
+            # A reference draft takes precedence over every other decoding mode
+            decoding = "reference_draft"
+        if decoding == "restricted_vocab" and not self.vocab_restriction.supports(target_lang):
+            # No script table for this language: decode over the full vocabulary
+            decoding = "greedy"
+        compiled = decoding == "greedy" and self.compiled_generator is not None
+        if compiled:
+            # Left padding to the length bucket; stripped again after generation
+            inputs, attention_mask, padding = self.compiled_generator.pad(inputs)
+        stopping_criteria = self._stopping_criteria(inputs.shape[1], cancel_token)
+        generate_kwargs = {"stopping_criteria": stopping_criteria}
+        if streamer is not None:
+            generate_kwargs["streamer"] = streamer
+        speculative_info = {"decoding": decoding}
+
+        if compiled:
+            # Static shapes: the padded prompt is prefilled in full
+            past_key_values, prefix_info = None, {"prefix_cache": "bypass"}
+        elif decoding == "assisted":
+            # Assisted generation manages both caches itself; no prefix reuse
+            past_key_values, prefix_info = None, {"prefix_cache": "bypass"}
+            generate_kwargs["assistant_model"] = self.draft_model
+            speculative_info.update({
+                "draft_model": self.draft_model_id,
+                "unassisted_tokens_per_second": self.assistance_probe.get("unassisted_tokens_per_second", 0)
+            })
+        else:
+            # Reuse the precomputed KV cache of the instruction prefix, if any
+            past_key_values, prefix_info = self._prefix_past(inputs[0].tolist(), source_lang, target_lang)
+            if decoding in ("greedy", "restricted_vocab") and self.kv_cache_bits:
+                # The prefix is quantized into a fresh cache; the stored entry is not touched
+                past_key_values = build_quantized_cache(
+                    self.model,
+                    self.kv_cache_bits,
+                    cache_to_layers(past_key_values) if past_key_values is not None else None
+                )
+            if past_key_values is not None:
+                generate_kwargs["past_key_values"] = past_key_values
+
+        if decoding == "prompt_lookup":
+            outputs, speculative_info = self._prompt_lookup_generate(
+                inputs[0].tolist(),
+                past_key_values,
+                prefix_info.get("cached_prefix_tokens", 0),
+                stopping_criteria,
+                max_new_tokens[0],
+                streamer
+            )
+        elif decoding == "reference_draft":
+            outputs, speculative_info = self._reference_draft_generate(
+                inputs[0].tolist(),
+                prompt,
+                reference,
+                past_key_values,
+                prefix_info.get("cached_prefix_tokens", 0),
+                stopping_criteria,
+                max_new_tokens[0],
+                streamer
             )
+        elif decoding == "restricted_vocab":
+            outputs, restriction_info = self._restricted_generate(
+                inputs[0].tolist(),
+                text,
+                target_lang,
+                past_key_values,
+                prefix_info.get("cached_prefix_tokens", 0),
+                stopping_criteria,
+                max_new_tokens[0],
+                streamer
+            )
+            speculative_info.update(restriction_info)
+        elif compiled:
+            generated = self.compiled_generator.generate(
+                inputs, attention_mask, max_new_tokens[0], **generate_kwargs
+            )
+            inputs = inputs[:, padding:]
+            outputs = generated.sequences[:, padding:]
+            speculative_info.update(self._kv_cache_info(generated.past_key_values))
+        else:
+            # Budget sized from the source length (see self.length_budget)
+            with torch.no_grad():
+                generated = self.model.generate(
+                    inputs,
+                    max_new_tokens=max_new_tokens[0],
+                    do_sample=False,
+                    return_dict_in_generate=True,
+                    **generate_kwargs
+                )
+            outputs = generated.sequences
+            speculative_info.update(self._kv_cache_info(generated.past_key_values))
 
         end_time = time.time()
         duration = end_time - start_time
 
-        # Decode
-        full_output = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
+        # Generation stopped early because the caller gave up on the result
+        raise_if_cancelled(cancel_token)
 
-        # Debug: Print full output if DEBUG env var is set
-        import os
-        if os.getenv('TRANSLATE_DEBUG'):
-            print(f"\n{'='*80}")
-            print(f"FULL OUTPUT ({len(full_output)} chars):")
-            print(f"{'='*80}")
-            print(full_output[:500])  # First 500 chars
-            print(f"\n... [truncated] ...\n")
-            print(full_output[-500:])  # Last 500 chars
-            print(f"{'='*80}\n")
+        output_ids, repetition_info = self._trim_repetition(outputs[0], inputs.shape[1], stopping_criteria)
+        translation, extraction = self._decode_translation(
+            output_ids, inputs.shape[1], source_lang, target_lang
+        )
 
-        # Extract translation - with simple prompt, output should be cleaner
-        # Remove the prompt if it appears in output
-        if "Translation:" in full_output:
-            translation = full_output.split("Translation:")[-1].strip()
+        # Calculate tokens
+        input_tokens = inputs.shape[1]
+        output_tokens = outputs.shape[1] - input_tokens
+        total_tokens = outputs.shape[1]
+
+        budget_info = self._record_length(
+            source_tokens[0], output_tokens, max_new_tokens[0], source_lang, target_lang, repetition_info
+        )
+
+        return {
+            "translation": translation,
+            "time": duration,
+            "tokens": total_tokens,
+            "metadata": {
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "tokens_per_second": total_tokens / duration if duration > 0 else 0,
+                "output_tokens_per_second": output_tokens / duration if duration > 0 else 0,
+                "extraction": extraction,
+                **repetition_info,
+                **budget_info,
+                **prefix_info,
+                **speculative_info
+            }
+        }
+
+    def _stream_text(
+        self,
+        text: str,
+        source_lang: str,
+        target_lang: str,
+        cancel_token: Optional[CancellationToken] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Run translate() in a worker thread and yield text from a TextIteratorStreamer"""
+        from transformers import TextIteratorStreamer
+
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        outcome = {}
+
+        def worker():
+            try:
+                outcome["result"] = self.translate(text, source_lang, target_lang, cancel_token, streamer=streamer)
+            except BaseException as e:
+                outcome["error"] = e
+                # Unblock the reader if generation never got to end the stream
+                streamer.end()
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        for piece in streamer:
+            if piece:
+                yield {"text": self._convert_script(piece, target_lang)}
+        thread.join()
+
+        if "error" in outcome:
+            raise outcome["error"]
+        yield {"done": True, "result": outcome["result"]}
+
+    def translate_batch(
+        self,
+        texts: List[str],
+        source_lang: str = "en",
+        target_lang: str = "zh-TW",
+        cancel_token: Optional[CancellationToken] = None
+    ) -> List[Dict[str, Any]]:
+        """Translate several texts with batched generate calls
+
+        Prompts are tokenized once, grouped by length with self.scheduler and
+        run one padded batch at a time. Results come back in input order.
+        Texts over max_chunk_tokens are translated with translate_chunked().
+
+        Returns:
+            List of result dicts in input order. "time" is each item's share of
+            its batch wall time; batch time and padding efficiency are in metadata.
+        """
+        if not texts:
+            return []
+
+        long_indices = [i for i, text in enumerate(texts) if self.needs_chunking(text)]
+        if long_indices:
+            results = {i: self.translate_chunked(texts[i], source_lang, target_lang, cancel_token) for i in long_indices}
+            short_indices = [i for i in range(len(texts)) if i not in results]
+            short_results = self.translate_batch([texts[i] for i in short_indices], source_lang, target_lang, cancel_token)
+            results.update(zip(short_indices, short_results))
+            return [results[i] for i in range(len(texts))]
+
+        prompts = [self._build_prompt(text, source_lang, target_lang) for text in texts]
+
+        # Tokenize without padding; each batch is padded on its own
+        prompt_ids = self.tokenizer(
+            prompts,
+            truncation=True,
+            max_length=2048
+        ).input_ids
+
+        source_tokens, max_new_tokens = self._length_budgets(texts, source_lang, target_lang)
+
+        # The budget covers generated tokens too: a batch runs to its largest max_new_tokens
+        batches = self.scheduler.plan([len(ids) for ids in prompt_ids], new_tokens=max_new_tokens)
+
+        batch_results = []
+        for batch_id, batch in enumerate(batches):
+            raise_if_cancelled(cancel_token)
+            results = self._generate_batch(
+                [prompt_ids[i] for i in batch.indices],
+                source_lang,
+                target_lang,
+                cancel_token,
+                [source_tokens[i] for i in batch.indices],
+                [max_new_tokens[i] for i in batch.indices]
+            )
+            for result in results:
+                result["metadata"]["batch_id"] = batch_id
+                result["metadata"]["padding_efficiency"] = batch.padding_efficiency
+            batch_results.append(results)
+
+        self.last_batch_stats = self.scheduler.summary(batches)
+
+        return self.scheduler.restore_order(batches, batch_results)
+
+    def _generate_batch(
+        self,
+        prompt_ids: List[List[int]],
+        source_lang: str,
+        target_lang: str,
+        cancel_token: Optional[CancellationToken] = None,
+        source_tokens: Optional[List[int]] = None,
+        max_new_tokens: Optional[List[int]] = None
+    ) -> List[Dict[str, Any]]:
+        """Run one left-padded generate call over pre-tokenized prompts
+
+        Left padding keeps every row ending at the same position, so generation
+        continues directly after the real prompt tokens. One generate call has
+        one budget, so the batch uses the largest of its rows' budgets.
+        """
+        import torch
+
+        inputs = self.tokenizer.pad(
+            {"input_ids": prompt_ids},
+            padding=True,
+            return_tensors="pt"
+        ).to(self.model.device)
+        input_ids, attention_mask = inputs.input_ids, inputs.attention_mask
+        if self.compiled_generator is not None:
+            input_ids, attention_mask, _ = self.compiled_generator.pad(input_ids, attention_mask)
+
+        stopping_criteria = self._stopping_criteria(input_ids.shape[1], cancel_token)
+        budget = max(max_new_tokens) if max_new_tokens else 2048
+
+        start_time = time.time()
+
+        if self.compiled_generator is not None:
+            generated = self.compiled_generator.generate(
+                input_ids, attention_mask, budget, stopping_criteria=stopping_criteria
+            )
+        else:
+            generate_kwargs = {}
+            if self.kv_cache_bits:
+                generate_kwargs["past_key_values"] = build_quantized_cache(self.model, self.kv_cache_bits)
+
+            with torch.no_grad():
+                generated = self.model.generate(
+                    input_ids=input_ids,
+                    attention_mask=attention_mask,
+                    max_new_tokens=budget,
+                    do_sample=False,
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    stopping_criteria=stopping_criteria,
+                    return_dict_in_generate=True,
+                    **generate_kwargs
+                )
+        outputs = generated.sequences
+        kv_cache_info = self._kv_cache_info(generated.past_key_values)
+
+        end_time = time.time()
+        duration = end_time - start_time
+
+        raise_if_cancelled(cancel_token)
+
+        padded_length = input_ids.shape[1]
+        batch_size = len(prompt_ids)
+        item_time = duration / batch_size
+
+        # Rows that finish early are padded up to the longest generation
+        generated = outputs[:, padded_length:]
+        output_counts = (generated != self.tokenizer.pad_token_id).sum(dim=1).tolist()
+        input_counts = [len(ids) for ids in prompt_ids]
+        batch_tokens = sum(input_counts) + sum(output_counts)
+
+        results = []
+        for i in range(batch_size):
+            # Drop the row's left padding before decoding
+            row, repetition_info = self._trim_repetition(
+                outputs[i, padded_length - input_counts[i]:], input_counts[i], stopping_criteria, i
+            )
+            translation, extraction = self._decode_translation(
+                row, input_counts[i], source_lang, target_lang
+            )
+            total_tokens = input_counts[i] + output_counts[i]
+            budget_info = {}
+            if source_tokens and max_new_tokens:
+                budget_info = self._record_length(
+                    source_tokens[i], output_counts[i], max_new_tokens[i], source_lang, target_lang, repetition_info
+                )
+
+            results.append({
+                "translation": translation,
+                "time": item_time,
+                "tokens": total_tokens,
+                "metadata": {
+                    "input_tokens": input_counts[i],
+                    "output_tokens": output_counts[i],
+                    "tokens_per_second": total_tokens / item_time if item_time > 0 else 0,
+                    "extraction": extraction,
+                    **repetition_info,
+                    **budget_info,
+                    "batch_size": batch_size,
+                    "batch_index": i,
+                    "batch_time": duration,
+                    **kv_cache_info,
+                    "batch_tokens_per_second": batch_tokens / duration if duration > 0 else 0
+                }
+            })
+
+        return results
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer(text, add_special_tokens=False).input_ids)
+
+    def generation_params(self) -> Dict[str, Any]:
+        # Prompt lookup, draft models and compilation leave greedy outputs unchanged
+        return {
+            **super().generation_params(),
+            "dtype": str(self.torch_dtype),
+            "quantization": self.quantization,
+            "kv_cache_bits": self.kv_cache_bits,
+            "restrict_vocab_min_confidence": (
+                self.restrict_vocab_min_confidence if self.vocab_restriction is not None else None
+            ),
+            "restrict_vocab_verify_every": (
+                self.restrict_vocab_verify_every if self.vocab_restriction is not None else None
+            ),
+            "stop_on_repetition": self.stop_on_repetition
+        }
+
+    def _prompt_template(self, source_lang: str, target_lang: str) -> str:
+        """Prompt for a language pair, with a {text} placeholder for the input"""
+        # Use simple direct prompt (more reliable than chat template)
+        if target_lang == "zh-TW":
+            return f"Translate the following text from {source_lang} to Traditional Chinese (Taiwan, 繁體中文). Only output the translation, do not include any explanations:\n\n{{text}}\n\nTranslation:"
+        return f"Translate the following text from {source_lang} to {target_lang}. Only output the translation:\n\n{{text}}\n\nTranslation:"
+
+    def _build_prompt(self, text: str, source_lang: str, target_lang: str) -> str:
+        """Build the translation prompt for one text"""
+        return self._prompt_template(source_lang, target_lang).replace("{text}", text, 1)
+
+    def _prompt_lookup_generate(self, input_ids: List[int], past_key_values, cached_tokens: int,
+                                stopping_criteria=None, max_new_tokens: int = 2048, streamer=None):
+        """Greedy generation with drafts copied from the prompt
+
+        Returns:
+            (output ids tensor of shape [1, prompt + generated], metadata dict)
+        """
+        import torch
+
+        proposer = NgramProposer(
+            input_ids,
+            max_ngram_size=self.prompt_lookup_ngram_size,
+            num_pred_tokens=self.prompt_lookup_num_tokens
+        )
+        generated, stats = speculative_generate(
+            self.model,
+            input_ids,
+            proposer,
+            max_new_tokens=max_new_tokens,
+            eos_ids=eos_token_ids(self.model, self.tokenizer),
+            past_key_values=past_key_values,
+            cached_tokens=cached_tokens,
+            stopping_criteria=stopping_criteria,
+            streamer=streamer
+        )
+
+        outputs = torch.tensor([input_ids + generated], device=self.model.device)
+        return outputs, {"decoding": "prompt_lookup", **stats}
+
+    def _reference_draft_generate(self, input_ids: List[int], prompt: str, reference: str, past_key_values,
+                                  cached_tokens: int, stopping_criteria=None, max_new_tokens: int = 2048,
+                                  streamer=None):
+        """Greedy generation with drafts taken from a reference translation
+
+        Returns:
+            (output ids tensor of shape [1, prompt + generated], metadata dict)
+        """
+        import torch
+
+        # Tokenized after the prompt, so the first tokens split the way generated ones do
+        with_reference = self.tokenizer(prompt + reference.strip()).input_ids
+        reference_ids = with_reference[len(input_ids):] if with_reference[:len(input_ids)] == input_ids \
+            else self.tokenizer(reference.strip(), add_special_tokens=False).input_ids
+
+        proposer = ReferenceProposer(
+            reference_ids,
+            prompt_length=len(input_ids),
+            # Copied numbers and names can still be drafted from the prompt
+            corpus=input_ids,
+            max_ngram_size=self.prompt_lookup_ngram_size,
+            num_pred_tokens=self.reference_draft_num_tokens
+        )
+        generated, stats = speculative_generate(
+            self.model,
+            input_ids,
+            proposer,
+            max_new_tokens=max_new_tokens,
+            eos_ids=eos_token_ids(self.model, self.tokenizer),
+            past_key_values=past_key_values,
+            cached_tokens=cached_tokens,
+            stopping_criteria=stopping_criteria,
+            streamer=streamer
+        )
+
+        outputs = torch.tensor([input_ids + generated], device=self.model.device)
+        return outputs, {"decoding": "reference_draft", "reference_tokens": len(reference_ids), **stats}
+
+    def _restricted_generate(self, input_ids: List[int], text: str, target_lang: str, past_key_values,
+                             cached_tokens: int, stopping_criteria=None, max_new_tokens: int = 2048,
+                             streamer=None):
+        """Greedy generation with logits over the target language's tokens
+
+        Returns:
+            (output ids tensor of shape [1, prompt + generated], metadata dict)
+        """
+        import torch
+
+        generated, stats = restricted_generate(
+            self.model,
+            input_ids,
+            self.vocab_restriction,
+            text,
+            target_lang,
+            max_new_tokens=max_new_tokens,
+            eos_ids=eos_token_ids(self.model, self.tokenizer),
+            past_key_values=past_key_values,
+            cached_tokens=cached_tokens,
+            stopping_criteria=stopping_criteria,
+            min_confidence=self.restrict_vocab_min_confidence,
+            streamer=streamer,
+            verify_every=self.restrict_vocab_verify_every
+        )
+
+        outputs = torch.tensor([input_ids + generated], device=self.model.device)
+        return outputs, stats
+
+    def _kv_cache_info(self, cache) -> Dict[str, Any]:
+        """KV cache precision and peak size of a finished generate call"""
+        # A full-precision cache only grows, so its final size is its peak
+        peak_bytes = getattr(cache, "peak_bytes", None) or cache_nbytes(cache)
+        if hasattr(cache, "nbits"):
+            kv_cache = f"int{cache.nbits}"
         else:
-            translation = self._extract_translation(full_output, source_lang, target_lang)
+            # A static cache is allocated at its full length up front
+            kv_cache = "static" if getattr(cache, "is_compileable", False) else "full"
+        return {
+            "kv_cache": kv_cache,
+            "kv_cache_peak_mb": peak_bytes / (1024**2)
+        }
+
+    def _length_budgets(self, texts: List[str], source_lang: str, target_lang: str) -> Tuple[List[int], List[int]]:
+        """Source token count and max_new_tokens for each text"""
+        source_tokens = [len(ids) for ids in self.tokenizer(texts, add_special_tokens=False).input_ids]
+        if self.length_budget is None:
+            return source_tokens, [2048] * len(texts)
+        return source_tokens, [
+            self.length_budget.budget(n, source_lang, target_lang) for n in source_tokens
+        ]
+
+    def _record_length(self, source_tokens: int, output_tokens: int, max_new_tokens: int,
+                       source_lang: str, target_lang: str, repetition_info: Dict[str, Any]) -> Dict[str, Any]:
+        """Feed a finished generation into the length budget; returns metadata"""
+        # Loops say nothing about legitimate output lengths
+        if self.length_budget is not None and not repetition_info.get("repetition_stopped"):
+            self.length_budget.record(source_tokens, output_tokens, source_lang, target_lang)
+        return {
+            "source_tokens": source_tokens,
+            "max_new_tokens": max_new_tokens,
+            "budget_exhausted": output_tokens >= max_new_tokens
+        }
+
+    def _stopping_criteria(self, prompt_length: int, cancel_token: Optional[CancellationToken] = None):
+        """Stopping criteria for one generate call over prompts of prompt_length tokens"""
+        from transformers import StoppingCriteriaList
+
+        criteria = StoppingCriteriaList()
+        if cancel_token is not None:
+            criteria.append(CancellationStoppingCriteria(cancel_token))
+        if self.stop_on_repetition:
+            criteria.append(RepetitionStoppingCriteria(
+                prompt_length,
+                ignore_token_ids={self.tokenizer.pad_token_id}
+            ))
+        return criteria
+
+    def _trim_repetition(self, output_ids, input_length: int, stopping_criteria, row: int = 0):
+        """Cut repeated copies of a detected loop from one output sequence
+
+        Returns:
+            (output ids as a list, repetition metadata dict)
+        """
+        output_ids = output_ids.tolist() if hasattr(output_ids, "tolist") else list(output_ids)
+        for criteria in stopping_criteria:
+            if isinstance(criteria, RepetitionStoppingCriteria):
+                generated = criteria.trim(output_ids[input_length:], row)
+                return output_ids[:input_length] + generated, criteria.row_info(row)
+        return output_ids, {}
+
+    def _prefix_past(self, input_ids: List[int], source_lang: str, target_lang: str):
+        """Look up the cached KV of the prompt prefix for input_ids
+
+        Returns:
+            (past_key_values or None, metadata dict)
+        """
+        if self.prefix_cache is None:
+            return None, {"prefix_cache": "disabled"}
+
+        template = self._prompt_template(source_lang, target_lang)
+        key = (self.model_id, template, source_lang, target_lang)
+
+        entry = self.prefix_cache.get(key)
+        status = "hit"
+        if entry is None:
+            entry = self._compute_prefix(key, template)
+            status = "miss"
+
+        # Tokenization of the full prompt may differ at the boundary; then prefill everything
+        if entry is None or not entry.matches(input_ids):
+            return None, {"prefix_cache": "bypass"}
+
+        return layers_to_cache(entry.layers), {
+            "prefix_cache": status,
+            "cached_prefix_tokens": len(entry.token_ids)
+        }
+
+    def _compute_prefix(self, key, template: str):
+        """Prefill the template prefix once and store its KV cache"""
+        import torch
+
+        prefix = template.split("{text}", 1)[0]
+        # Drop the last token: it can merge with the start of the user text
+        token_ids = self.tokenizer(prefix).input_ids[:-1]
+        if not token_ids:
+            return None
+
+        with torch.no_grad():
+            outputs = self.model(
+                input_ids=torch.tensor([token_ids], device=self.model.device),
+                past_key_values=layers_to_cache(),
+                use_cache=True
+            )
+
+        return self.prefix_cache.put(key, token_ids, cache_to_layers(outputs.past_key_values))
+
+    def _decode_translation(self, output_ids, input_length: int, source_lang: str, target_lang: str):
+        """Decode one output sequence and extract the post-processed translation
+
+        Only the generated ids (after input_length) are decoded; the prompt
+        heuristics run only if that text is empty or echoes the prompt.
+
+        Returns:
+            (translation, extraction method: "token_slice" or "heuristic")
+        """
+        translation, method = extract_translation_from_ids(
+            self.tokenizer,
+            output_ids,
+            input_length,
+            source_lang,
+            target_lang,
+            fallback=lambda full_output: self._extract_from_full_output(full_output, source_lang, target_lang)
+        )
 
         # Debug: Print extracted translation
         if os.getenv('TRANSLATE_DEBUG'):
-            print(f"EXTRACTED TRANSLATION ({len(translation)} chars):")
+            print(f"EXTRACTED TRANSLATION ({len(translation)} chars, {method}):")
             print(translation[:200])
             print(f"\n{'='*80}\n")
 
-        # Post-processing: Convert Simplified to Traditional Chinese if needed
+        return self._convert_script(translation, target_lang), method
+
+    def _convert_script(self, translation: str, target_lang: str) -> str:
+        """Post-processing: Convert Simplified to Traditional Chinese if needed"""
         if target_lang == "zh-TW":
             try:
                 from opencc import OpenCC
@@ -161,22 +971,24 @@ class TransformersBackend(TranslationBackend):
                 except ImportError:
                     # Neither installed, skip conversion
                     pass
+        return translation
 
-        # Calculate tokens
-        input_tokens = inputs.shape[1]
-        output_tokens = outputs.shape[1] - input_tokens
-        total_tokens = outputs.shape[1]
+    def _extract_from_full_output(self, full_output: str, source_lang: str, target_lang: str) -> str:
+        """Fallback: extract the translation from the decoded prompt + output"""
+        # Debug: Print full output if DEBUG env var is set
+        if os.getenv('TRANSLATE_DEBUG'):
+            print(f"\n{'='*80}")
+            print(f"FULL OUTPUT ({len(full_output)} chars):")
+            print(f"{'='*80}")
+            print(full_output[:500])  # First 500 chars
+            print(f"\n... [truncated] ...\n")
+            print(full_output[-500:])  # Last 500 chars
+            print(f"{'='*80}\n")
 
-        return {
-            "translation": translation,
-            "time": duration,
-            "tokens": total_tokens,
-            "metadata": {
-                "input_tokens": input_tokens,
-                "output_tokens": output_tokens,
-                "tokens_per_second": total_tokens / duration if duration > 0 else 0
-            }
-        }
+        # Remove the prompt if it appears in output
+        if "Translation:" in full_output:
+            return full_output.split("Translation:")[-1].strip()
+        return self._extract_translation(full_output, source_lang, target_lang)
 
     def _extract_translation(self, full_output: str, source_lang: str, target_lang: str) -> str:
         """
@@ -307,7 +1119,13 @@ class TransformersBackend(TranslationBackend):
             "version": transformers.__version__,
             "torch_version": torch.__version__,
             "device": str(self.device_map),
-            "model": self.model_id
+            "model": self.model_id,
+            "draft_model": self.draft_model_id,
+            "quantization": self.quantization,
+            "compiled": self.compiled_generator is not None,
+            "vocab_restriction": self.vocab_restriction.stats() if self.vocab_restriction is not None else None,
+            "prefix_cache": self.prefix_cache.stats() if self.prefix_cache is not None else None,
+            "length_budget": self.length_budget.stats() if self.length_budget is not None else None
         }
 
     def cleanup(self):
@@ -318,6 +1136,17 @@ class TransformersBackend(TranslationBackend):
         if self.tokenizer is not None:
             del self.tokenizer
             self.tokenizer = None
+        if self.draft_model is not None:
+            del self.draft_model
+            self.draft_model = None
+        if self.prefix_cache is not None:
+            self.prefix_cache.clear()
+        if self.compiled_generator is not None:
+            self.compiled_generator.clear()
+            self.compiled_generator = None
+        self.vocab_restriction = None
+        if self.length_budget is not None:
+            self.length_budget.save()
 
         import torch
         if torch.cuda.is_available():
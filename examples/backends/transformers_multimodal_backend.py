@@ -1,13 +1,23 @@
 """Transformers Multimodal backend for TranslateGemma (Image support)"""
 import time
 import os
-from typing import Dict, Any, Union
+from typing import Dict, Any, Optional, Union
 from pathlib import Path
 
 try:
     from .base import TranslationBackend
+    from .better_extraction import extract_translation_from_ids, select_translation
+    from .stopping import RepetitionStoppingCriteria, CancellationStoppingCriteria
+    from .cancellation import CancellationToken, raise_if_cancelled
+    from .length_budget import LengthBudget
+    from .logits_processors import repetition_processors
 except ImportError:
     from base import TranslationBackend
+    from better_extraction import extract_translation_from_ids, select_translation
+    from stopping import RepetitionStoppingCriteria, CancellationStoppingCriteria
+    from cancellation import CancellationToken, raise_if_cancelled
+    from length_budget import LengthBudget
+    from logits_processors import repetition_processors
 
 
 class TransformersMultimodalBackend(TranslationBackend):
@@ -24,6 +34,10 @@ class TransformersMultimodalBackend(TranslationBackend):
         self.device_map = None
         self.torch_dtype = None
         self.processor = None
+        # Text mode max_new_tokens from learned output/input ratios; None = fixed 512
+        self.length_budget = LengthBudget(namespace="transformers_multimodal", max_tokens=512)
+        # Text mode output is capped at 512 tokens, so chunks stay well below it
+        self.max_chunk_tokens = 384
 
     def load_model(self, **kwargs) -> Dict[str, Any]:
         """Load multimodal model using transformers"""
@@ -95,11 +109,17 @@ class TransformersMultimodalBackend(TranslationBackend):
         self,
         text: str,
         source_lang: str = "en",
-        target_lang: str = "zh-TW"
+        target_lang: str = "zh-TW",
+        cancel_token: Optional[CancellationToken] = None
     ) -> Dict[str, Any]:
         """Translate text using transformers (text mode)"""
         import torch
 
+        raise_if_cancelled(cancel_token)
+
+        if self.needs_chunking(text):
+            return self.translate_chunked(text, source_lang, target_lang, cancel_token)
+
         # Build structured message
         messages = [{
             "role": "user",
@@ -117,31 +137,42 @@ class TransformersMultimodalBackend(TranslationBackend):
             return_tensors="pt"
         ).to(self.model.device)
 
+        stopping_criteria = self._stopping_criteria(inputs.shape[1], cancel_token)
+
+        source_tokens = self.count_tokens(text)
+        max_new_tokens = 512
+        if self.length_budget is not None:
+            max_new_tokens = self.length_budget.budget(source_tokens, source_lang, target_lang)
+
         start_time = time.time()
 
         # Generate
         with torch.no_grad():
             outputs = self.model.generate(
                 inputs,
-                max_new_tokens=512,
+                max_new_tokens=max_new_tokens,
                 do_sample=True,
                 temperature=0.3,        # Lower for consistent language
-                repetition_penalty=1.5,
-                no_repeat_ngram_size=3,
+                logits_processor=self._logits_processors(),
                 top_p=0.85,
-                top_k=40
+                top_k=40,
+                stopping_criteria=stopping_criteria
             )
 
         end_time = time.time()
         duration = end_time - start_time
 
-        # Decode
-        full_output = self.processor.decode(outputs[0], skip_special_tokens=True)
+        raise_if_cancelled(cancel_token)
 
-        # Extract translation (after last newline or colon)
-        translation = full_output.split('\n')[-1].strip()
-        if ':' in translation:
-            translation = translation.split(':', 1)[1].strip()
+        # Decode generated tokens only; last-line heuristic as fallback
+        translation, extraction = extract_translation_from_ids(
+            self.processor,
+            self._trim_repetition(outputs[0], inputs.shape[1], stopping_criteria),
+            inputs.shape[1],
+            source_lang,
+            target_lang,
+            fallback=self._last_line_translation
+        )
 
         # Post-processing: Convert Simplified to Traditional Chinese if needed
         if target_lang == "zh-TW":
@@ -157,6 +188,10 @@ class TransformersMultimodalBackend(TranslationBackend):
         output_tokens = outputs.shape[1] - input_tokens
         total_tokens = outputs.shape[1]
 
+        repetition_info = stopping_criteria[0].row_info()
+        if self.length_budget is not None and not repetition_info["repetition_stopped"]:
+            self.length_budget.record(source_tokens, output_tokens, source_lang, target_lang)
+
         return {
             "translation": translation,
             "time": duration,
@@ -165,7 +200,12 @@ class TransformersMultimodalBackend(TranslationBackend):
                 "input_tokens": input_tokens,
                 "output_tokens": output_tokens,
                 "tokens_per_second": total_tokens / duration if duration > 0 else 0,
-                "mode": "text"
+                "mode": "text",
+                "extraction": extraction,
+                **repetition_info,
+                "source_tokens": source_tokens,
+                "max_new_tokens": max_new_tokens,
+                "budget_exhausted": output_tokens >= max_new_tokens
             }
         }
 
@@ -174,7 +214,8 @@ class TransformersMultimodalBackend(TranslationBackend):
         image_path: Union[str, Path],
         source_lang: str = "en",
         target_lang: str = "zh-TW",
-        stream: bool = True
+        stream: bool = True,
+        cancel_token: Optional[CancellationToken] = None
     ) -> Dict[str, Any]:
         """Translate text from image using multimodal capabilities
 
@@ -184,8 +225,10 @@ class TransformersMultimodalBackend(TranslationBackend):
             target_lang: Target language code
             stream: Enable streaming generation with early stopping (default: True)
                    - Provides real-time progress feedback
-                   - Detects and stops repetition automatically
+                   - Repetition loops are stopped in both modes
                    - Better user experience but same total time
+            cancel_token: Optional token; cancelling it stops generation and
+                raises TranslationCancelled
 
         Returns:
             Dictionary with translation and metadata
@@ -253,8 +296,11 @@ class TransformersMultimodalBackend(TranslationBackend):
         inputs = {k: v.to(self.model.device) if isinstance(v, torch.Tensor) else v
                  for k, v in inputs.items()}
 
+        raise_if_cancelled(cancel_token)
+        stopping_criteria = self._stopping_criteria(inputs["input_ids"].shape[1], cancel_token)
+
         if stream:
-            # Use streaming generation with early stopping
+            # Use streaming generation; the stopping criteria end repetition loops
             from transformers import TextIteratorStreamer
             from threading import Thread
             import sys
@@ -270,46 +316,42 @@ class TransformersMultimodalBackend(TranslationBackend):
                 "max_new_tokens": 2048,
                 "do_sample": True,
                 "temperature": 0.3,        # Lower temperature for more consistent language (was 0.7)
-                "repetition_penalty": 1.5,
-                "no_repeat_ngram_size": 3,
+                "logits_processor": self._logits_processors(),
                 "top_p": 0.85,             # Slightly lower for more focused output (was 0.9)
                 "top_k": 40,               # Reduce randomness (was 50)
-                "streamer": streamer
+                "streamer": streamer,
+                "stopping_criteria": stopping_criteria
             }
 
             # Start generation in background thread
             thread = Thread(target=self.model.generate, kwargs=generation_kwargs)
             thread.start()
 
-            # Collect output with early stopping detection
             full_output = ""
-            last_chunk = ""
-            repetition_count = 0
-            max_repetition = 3  # Stop if same text repeats 3 times
-
             print("Translation (streaming):", end=" ", flush=True)
 
             for new_text in streamer:
                 full_output += new_text
                 print(new_text, end="", flush=True)
 
-                # Early stopping: detect repetition
-                if new_text.strip() and new_text.strip() == last_chunk.strip():
-                    repetition_count += 1
-                    if repetition_count >= max_repetition:
-                        print("\n⚠️  Repetition detected, stopping early...", flush=True)
-                        break
-                else:
-                    repetition_count = 0
-                    last_chunk = new_text
-
             print()  # New line after streaming
             thread.join()
+            raise_if_cancelled(cancel_token)
+
+            repetition = stopping_criteria[0]
+            if repetition.row_info()["repetition_stopped"]:
+                print("⚠️  Repetition detected, stopped early", flush=True)
+                # Keep a single copy of the repeated span
+                full_output = self.processor.tokenizer.decode(
+                    repetition.trim(repetition.detectors[0].tokens),
+                    skip_special_tokens=True
+                )
 
-            # Extract translation
-            translation = full_output.split('\n')[-1].strip()
-            if ':' in translation:
-                translation = translation.split(':', 1)[1].strip()
+            # Streamer skips the prompt, so full_output is generated text only
+            translation, extraction = select_translation(
+                full_output,
+                lambda: self._last_line_translation(full_output)
+            )
 
             # Post-processing: Convert Simplified to Traditional Chinese if needed
             if target_lang == "zh-TW":
@@ -331,19 +373,22 @@ class TransformersMultimodalBackend(TranslationBackend):
                     max_new_tokens=2048,
                     do_sample=True,
                     temperature=0.3,        # Lower for consistent language
-                    repetition_penalty=1.5,
-                    no_repeat_ngram_size=3,
+                    logits_processor=self._logits_processors(),
                     top_p=0.85,
-                    top_k=40
+                    top_k=40,
+                    stopping_criteria=stopping_criteria
                 )
-
-            # Decode
-            full_output = self.processor.decode(outputs[0], skip_special_tokens=True)
-
-            # Extract translation
-            translation = full_output.split('\n')[-1].strip()
-            if ':' in translation:
-                translation = translation.split(':', 1)[1].strip()
+            raise_if_cancelled(cancel_token)
+
+            # Decode generated tokens only; last-line heuristic as fallback
+            translation, extraction = extract_translation_from_ids(
+                self.processor,
+                self._trim_repetition(outputs[0], inputs["input_ids"].shape[1], stopping_criteria),
+                inputs["input_ids"].shape[1],
+                source_lang,
+                target_lang,
+                fallback=self._last_line_translation
+            )
 
             # Post-processing: Convert Simplified to Traditional Chinese if needed
             if target_lang == "zh-TW":
@@ -380,12 +425,49 @@ class TransformersMultimodalBackend(TranslationBackend):
                 "output_tokens": output_tokens,
                 "tokens_per_second": total_tokens / duration if duration > 0 else 0,
                 "mode": "image",
+                "extraction": extraction,
+                **stopping_criteria[0].row_info(),
                 "image_size": image.size,
                 "original_size": original_size,
                 "resized": original_size != image.size
             }
         }
 
+    def count_tokens(self, text: str) -> int:
+        return len(self.processor.tokenizer(text, add_special_tokens=False).input_ids)
+
+    def _logits_processors(self):
+        """repetition_penalty=1.5 and no_repeat_ngram_size=3, with incremental state
+
+        A new list is needed for every generate call.
+        """
+        return repetition_processors(repetition_penalty=1.5, no_repeat_ngram_size=3)
+
+    def _stopping_criteria(self, prompt_length: int, cancel_token: Optional[CancellationToken] = None):
+        """Stopping criteria for one generate call; the repetition check comes first"""
+        from transformers import StoppingCriteriaList
+
+        criteria = StoppingCriteriaList([RepetitionStoppingCriteria(
+            prompt_length,
+            ignore_token_ids={self.processor.tokenizer.pad_token_id}
+        )])
+        if cancel_token is not None:
+            criteria.append(CancellationStoppingCriteria(cancel_token))
+        return criteria
+
+    def _trim_repetition(self, output_ids, input_length: int, stopping_criteria) -> list:
+        """Cut repeated copies of a detected loop from the output ids"""
+        output_ids = output_ids.tolist()
+        generated = stopping_criteria[0].trim(output_ids[input_length:])
+        return output_ids[:input_length] + generated
+
+    def _last_line_translation(self, full_output: str) -> str:
+        """Fallback extraction: last line, without a leading "label:" part"""
+        translation = full_output.split('\n')[-1].strip()
+        if ':' in translation:
+            translation = translation.split(':', 1)[1].strip()
+        return translation
+
     def get_backend_info(self) -> Dict[str, str]:
         """Get transformers multimodal backend info"""
         import transformers
@@ -408,6 +490,8 @@ class TransformersMultimodalBackend(TranslationBackend):
         if self.processor is not None:
             del self.processor
             self.processor = None
+        if self.length_budget is not None:
+            self.length_budget.save()
 
         import torch
         if torch.cuda.is_available():
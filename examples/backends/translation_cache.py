@@ -0,0 +1,405 @@
+"""In-process translation cache around any TranslationBackend
+
+Greedy decoding is deterministic: the same text, language pair, model and
+generation settings always give the same translation. CachedBackend keeps
+recent results in a TranslationCache (an LRU bounded by entries and bytes)
+and only sends texts it has not seen to the wrapped backend. Long texts are
+split into chunks first, so repeated paragraphs, running headers and
+captions hit the cache even inside pages that differ.
+"""
+import copy
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    from .base import TranslationBackend
+    from .cancellation import CancellationToken, raise_if_cancelled
+except ImportError:
+    from base import TranslationBackend
+    from cancellation import CancellationToken, raise_if_cancelled
+
+_SPACES = re.compile(r"[ \t\f\v\u00a0]+")
+
+
+def normalize_text(text: str) -> str:
+    """Cache form of a source text: NFC, \\n line ends, single spaces, stripped
+
+    Line breaks are kept, since they can change the translation.
+    """
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+    return "\n".join(_SPACES.sub(" ", line).strip() for line in text.split("\n")).strip()
+
+
+def cache_key(text: str, source_lang: str, target_lang: str, params: Dict[str, Any]) -> str:
+    """Hex digest of the normalized text, language pair and generation params"""
+    payload = json.dumps(
+        [normalize_text(text), source_lang, target_lang, params],
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _result_bytes(key: str, result: Dict[str, Any]) -> int:
+    """Approximate memory held by a cached result"""
+    return len(key) + len(json.dumps(result, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+class TranslationCache:
+    """Thread-safe LRU of translate() results, bounded by entries and bytes"""
+
+    def __init__(self, max_entries: int = 4096, max_bytes: int = 32 * 1024 * 1024):
+        """
+        Args:
+            max_entries: Results kept at most
+            max_bytes: Approximate memory cap (text, translation and metadata);
+                least recently used results are evicted first
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Copy of the cached result, or None"""
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(result)
+
+    def put(self, key: str, result: Dict[str, Any]) -> bool:
+        """Store a copy of result; returns False if it alone exceeds max_bytes"""
+        nbytes = _result_bytes(key, result)
+        if nbytes > self.max_bytes:
+            return False
+        result = copy.deepcopy(result)
+
+        with self._lock:
+            if key in self._entries:
+                del self._entries[key]
+                self.total_bytes -= self._sizes.pop(key)
+
+            while self._entries and (
+                len(self._entries) >= self.max_entries or self.total_bytes + nbytes > self.max_bytes
+            ):
+                evicted, _ = self._entries.popitem(last=False)
+                self.total_bytes -= self._sizes.pop(evicted)
+                self.evictions += 1
+
+            self._entries[key] = result
+            self._sizes[key] = nbytes
+            self.total_bytes += nbytes
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0,
+            "evictions": self.evictions
+        }
+
+
+def _truncated(metadata: Dict[str, Any]) -> bool:
+    """True if a result, or any of its chunks, was cut off by the length budget or a repetition loop"""
+    return any(
+        meta.get("budget_exhausted") or meta.get("repetition_stopped")
+        for meta in [metadata, *metadata.get("chunk_metadata", [])]
+    )
+
+
+class CachedBackend(TranslationBackend):
+    """TranslationBackend that serves repeated translations from a cache
+
+    Example:
+        backend = CachedBackend(get_backend("ollama"))
+        backend.load_model()
+        backend.translate("Figure 3", "en", "ja")  # translated
+        backend.translate("Figure 3", "en", "ja")  # from the cache
+
+    Cache hits return the stored result with time set to the lookup time,
+    tokens set to 0 (nothing was generated) and metadata translation_cache
+    "hit" ("store" when found in the persistent store, "memory" for a
+    translation memory match); the original time and tokens are in
+    cached_time and cached_tokens.
+    Results with an error, or cut off by the length budget or a repetition
+    loop (budget_exhausted / repetition_stopped, in any chunk), are not
+    cached. Attributes not defined here (model, tokenizer, translate_image,
+    ...) are the wrapped backend's.
+    """
+
+    def __init__(self, backend: TranslationBackend, cache: Optional[TranslationCache] = None,
+                 store=None, memory=None, max_batch_size: Optional[int] = None):
+        """
+        Args:
+            backend: Backend to translate cache misses with
+            cache: Cache to use, e.g. one shared by several wrappers
+                (default: a new TranslationCache())
+            store: Optional persistent TranslationStore, consulted on cache
+                misses and updated with every new translation
+            memory: Optional TranslationMemory, consulted last for exact,
+                adaptable or near-identical segments and updated with every
+                new translation. Other near matches are passed to backends
+                that accept a reference draft (accepts_reference_draft).
+            max_batch_size: Misses per backend translate_batch() call, each
+                call's results stored before the next starts, so a failure
+                or Ctrl-C loses at most one call's work. Default None: all
+                misses in one call to backends that override translate_batch()
+                and schedule their own batches (e.g. TransformersBackend's
+                length buckets); other backends translate the misses one by
+                one and each result is stored as it completes.
+        """
+        # TranslationBackend.__init__ is not called: model state lives in the wrapped backend
+        self.backend = backend
+        self.cache = cache if cache is not None else TranslationCache()
+        self.store = store
+        self.memory = memory
+        self.max_batch_size = max_batch_size
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the wrapper
+        if name == "backend":
+            raise AttributeError(name)
+        return getattr(self.backend, name)
+
+    @property
+    def max_chunk_tokens(self) -> Optional[int]:
+        return self.backend.max_chunk_tokens
+
+    @max_chunk_tokens.setter
+    def max_chunk_tokens(self, value: Optional[int]):
+        self.backend.max_chunk_tokens = value
+
+    def load_model(self, **kwargs) -> Dict[str, Any]:
+        return self.backend.load_model(**kwargs)
+
+    def count_tokens(self, text: str) -> int:
+        return self.backend.count_tokens(text)
+
+    def generation_params(self) -> Dict[str, Any]:
+        return self.backend.generation_params()
+
+    def key(self, text: str, source_lang: str, target_lang: str) -> str:
+        return cache_key(text, source_lang, target_lang, self.generation_params())
+
+    def translate(
+        self,
+        text: str,
+        source_lang: str = "en",
+        target_lang: str = "zh-TW",
+        cancel_token: Optional[CancellationToken] = None
+    ) -> Dict[str, Any]:
+        raise_if_cancelled(cancel_token)
+        if self.needs_chunking(text):
+            # Chunks go through translate_batch(), one cache entry each
+            return self.translate_chunked(text, source_lang, target_lang, cancel_token)
+        return self.translate_batch([text], source_lang, target_lang, cancel_token)[0]
+
+    def translate_batch(
+        self,
+        texts: List[str],
+        source_lang: str = "en",
+        target_lang: str = "zh-TW",
+        cancel_token: Optional[CancellationToken] = None
+    ) -> List[Dict[str, Any]]:
+        """Translate several texts; only uncached ones reach the backend
+
+        Uncached texts go to the backend together, or in batches of
+        max_batch_size if set, each stored before the next starts (see
+        __init__).
+        Texts repeated within the batch are translated once. Texts with a near
+        translation memory match are translated one at a time with that match
+        as reference draft.
+        """
+        raise_if_cancelled(cancel_token)
+        start_time = time.time()
+        keys = [self.key(text, source_lang, target_lang) for text in texts]
+
+        found: Dict[str, Dict[str, Any]] = {}
+        missing: "OrderedDict[str, str]" = OrderedDict()
+        references: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key in found or key in missing:
+                continue
+            result, reference = self._lookup(key, text, source_lang, target_lang, start_time)
+            if result is not None:
+                found[key] = result
+            elif reference is not None:
+                references[key] = reference
+                missing[key] = text
+            else:
+                missing[key] = text
+
+        fresh: Dict[str, Dict[str, Any]] = {}
+        # Texts with a reference draft go one by one; the rest in batches
+        batch = [key for key in missing if key not in references]
+        batch_size = self.max_batch_size
+        if batch_size is None:
+            # The default translate_batch() is a translate() loop: store as each text completes
+            batches = type(self.backend).translate_batch is not TranslationBackend.translate_batch
+            batch_size = max(len(batch), 1) if batches else 1
+        for start in range(0, len(batch), batch_size):
+            sub_batch = batch[start:start + batch_size]
+            if len(sub_batch) == 1:
+                results = [self.backend.translate(missing[sub_batch[0]], source_lang, target_lang, cancel_token)]
+            else:
+                results = self.backend.translate_batch(
+                    [missing[key] for key in sub_batch], source_lang, target_lang, cancel_token
+                )
+            for key, result in zip(sub_batch, results):
+                self._store(key, result, missing[key], source_lang, target_lang)
+                fresh[key] = result
+        for key, reference in references.items():
+            result = self.backend.translate(
+                missing[key], source_lang, target_lang, cancel_token, reference=reference
+            )
+            self._store(key, result, missing[key], source_lang, target_lang)
+            fresh[key] = result
+
+        results = []
+        for key in keys:
+            if key in fresh:
+                result = fresh.pop(key)
+            elif key in found:
+                result = copy.deepcopy(found[key])
+            else:
+                # A repeat of a text translated earlier in this batch
+                result = self._hit(self._copy_fresh(results, keys, key), start_time)
+            results.append(result)
+        return results
+
+    async def atranslate(
+        self,
+        text: str,
+        source_lang: str = "en",
+        target_lang: str = "zh-TW",
+        cancel_token: Optional[CancellationToken] = None
+    ) -> Dict[str, Any]:
+        start_time = time.time()
+        key = self.key(text, source_lang, target_lang)
+        # Reference drafts need the synchronous transformers path; see translate_batch()
+        result, _ = self._lookup(key, text, source_lang, target_lang, start_time)
+        if result is not None:
+            return result
+        result = await self.backend.atranslate(text, source_lang, target_lang, cancel_token)
+        self._store(key, result, text, source_lang, target_lang)
+        return result
+
+    def _stream_text(
+        self,
+        text: str,
+        source_lang: str,
+        target_lang: str,
+        cancel_token: Optional[CancellationToken] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """A hit is streamed as one piece; a miss streams from the backend"""
+        start_time = time.time()
+        key = self.key(text, source_lang, target_lang)
+        result, _ = self._lookup(key, text, source_lang, target_lang, start_time)
+        if result is not None:
+            yield {"text": result["translation"]}
+            yield {"done": True, "result": result}
+            return
+
+        for event in self.backend.translate_stream(text, source_lang, target_lang, cancel_token):
+            if event.get("done"):
+                self._store(key, event["result"], text, source_lang, target_lang)
+            yield event
+
+    def _lookup(self, key: str, text: str, source_lang: str, target_lang: str,
+                start_time: float) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Find a stored translation of text
+
+        Returns:
+            (hit result from the cache, else the store, else a reusable memory
+            match, or None; reference draft from a near memory match, if the
+            backend accepts one)
+        """
+        result = self.cache.get(key)
+        if result is not None:
+            return self._hit(result, start_time), None
+        if self.store is not None:
+            result = self.store.get(key)
+            if result is not None:
+                self.cache.put(key, result)
+                return self._hit(result, start_time, source="store"), None
+        if self.memory is not None:
+            match = self.memory.lookup(text, source_lang, target_lang)
+            if match is not None and match.reusable:
+                result = {"translation": match.translation, "time": 0.0, "tokens": 0, "metadata": {
+                    "memory_match": match.kind,
+                    "memory_similarity": match.similarity
+                }}
+                return self._hit(result, start_time, source="memory"), None
+            if match is not None and self.backend.accepts_reference_draft:
+                return None, match.entry.translation
+        return None, None
+
+    def _store(self, key: str, result: Dict[str, Any], text: str, source_lang: str, target_lang: str):
+        metadata = result.setdefault("metadata", {})
+        metadata["translation_cache"] = "miss"
+        if "error" not in metadata and not _truncated(metadata):
+            self.cache.put(key, result)
+            if self.store is not None:
+                self.store.put(key, result)
+            if self.memory is not None:
+                self.memory.add(text, result["translation"], source_lang, target_lang)
+
+    @staticmethod
+    def _hit(result: Dict[str, Any], start_time: float, source: str = "hit") -> Dict[str, Any]:
+        metadata = result["metadata"]
+        metadata.update({
+            "translation_cache": source,
+            "cached_time": result["time"],
+            "cached_tokens": result["tokens"],
+            "tokens_per_second": 0
+        })
+        result["time"] = time.time() - start_time
+        result["tokens"] = 0
+        return result
+
+    @staticmethod
+    def _copy_fresh(results: List[Dict[str, Any]], keys: List[str], key: str) -> Dict[str, Any]:
+        """Copy of the first result for key among results so far"""
+        result = copy.deepcopy(results[keys.index(key)])
+        result["metadata"].pop("translation_cache", None)
+        return result
+
+    def get_backend_info(self) -> Dict[str, Any]:
+        info = {**self.backend.get_backend_info(), "translation_cache": self.cache.stats()}
+        if self.store is not None:
+            info["translation_store"] = self.store.stats()
+        if self.memory is not None:
+            info["translation_memory"] = self.memory.stats()
+        return info
+
+    def cleanup(self):
+        self.backend.cleanup()
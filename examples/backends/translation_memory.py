@@ -0,0 +1,327 @@
+"""Fuzzy translation memory for near-duplicate segments
+
+Revised papers (arXiv v1 -> v2) and boilerplate-heavy documents repeat
+segments that differ from an earlier one by a word or a number, so exact
+caching (TranslationCache) misses them. TranslationMemory stores source /
+translation pairs per language pair and finds the most similar stored
+source of a new segment:
+
+- candidates come from MinHash signatures of character n-grams, bucketed by
+  LSH bands, so a lookup only compares against segments sharing a band
+  instead of the whole memory
+- candidates are scored with difflib's similarity ratio on normalized text
+
+A match is reused without calling the model when it is exact, or when every
+changed word (a number, a name, a formula) appears verbatim in the stored
+translation and can be substituted ("adapted"). With reuse_similarity set,
+matches at least that similar whose differences are only punctuation or
+spacing are reused too ("fuzzy"); a changed word, number or unit always
+needs a fresh translation. Pairs can be imported from and exported to TMX
+1.4 files.
+"""
+import difflib
+import random
+import re
+import threading
+import zlib
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+try:
+    from .translation_cache import normalize_text
+except ImportError:
+    from translation_cache import normalize_text
+
+# Mersenne prime for the MinHash permutations; (a * crc32 + b) fits in 64 bits
+_PRIME = (1 << 31) - 1
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+_WORD = re.compile(r"\w")
+_XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+
+
+@dataclass
+class MemoryEntry:
+    """One stored segment pair"""
+    source: str
+    translation: str
+    source_lang: str
+    target_lang: str
+    # "model" for translations made here, "tmx" for imported ones
+    origin: str = "model"
+
+
+@dataclass
+class MemoryMatch:
+    """Best stored segment for a lookup"""
+    entry: MemoryEntry
+    similarity: float
+    # "exact", "adapted", "fuzzy" (reusable as is) or "near" (draft only)
+    kind: str
+    # Translation to use: adapted when kind is "adapted"; None for "near"
+    translation: Optional[str]
+
+    @property
+    def reusable(self) -> bool:
+        return self.translation is not None
+
+
+def char_ngrams(text: str, n: int = 3) -> Set[str]:
+    """Character n-grams of lowercased text (the text itself if shorter)"""
+    text = text.lower()
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def _words_changed(old_source: str, new_source: str) -> bool:
+    """True if the sources differ in any word or number, not just punctuation"""
+    old_words = [token for token in _TOKEN.findall(old_source) if _WORD.match(token)]
+    new_words = [token for token in _TOKEN.findall(new_source) if _WORD.match(token)]
+    return old_words != new_words
+
+
+def adapt_translation(old_source: str, new_source: str, translation: str) -> Optional[str]:
+    """Carry word substitutions between two sources over to a translation
+
+    Works when the sources differ only by replaced words that appear exactly
+    once, verbatim, in the translation (numbers, names, formulas, citations).
+
+    Returns:
+        Adapted translation, or None if a change cannot be carried over
+    """
+    old_tokens = _TOKEN.findall(old_source)
+    new_tokens = _TOKEN.findall(new_source)
+    replacements = []
+    matcher = difflib.SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        if tag != "replace" or i2 - i1 != j2 - j1:
+            return None
+        for old, new in zip(old_tokens[i1:i2], new_tokens[j1:j2]):
+            if old == new:
+                continue
+            # Whole-token occurrences; \b does not separate digits from CJK
+            pattern = re.compile(r"(?<![0-9A-Za-z_])" + re.escape(old) + r"(?![0-9A-Za-z_])")
+            found = [m.span() for m in pattern.finditer(translation)]
+            if len(found) != 1:
+                return None
+            replacements.append((found[0], new))
+
+    spans = sorted(replacements)
+    if any(a[0][1] > b[0][0] for a, b in zip(spans, spans[1:])):
+        return None
+    for (start, end), new in reversed(spans):
+        translation = translation[:start] + new + translation[end:]
+    return translation
+
+
+class TranslationMemory:
+    """Segment pairs with MinHash-LSH similarity lookup
+
+    Example:
+        memory = TranslationMemory()
+        memory.import_tmx("previous-version.tmx")
+        match = memory.lookup(segment, "en", "zh-TW")
+        if match is not None and match.reusable:
+            translation = match.translation
+    """
+
+    def __init__(
+        self,
+        min_similarity: float = 0.8,
+        reuse_similarity: Optional[float] = None,
+        ngram_size: int = 3,
+        num_perm: int = 64,
+        bands: int = 16,
+        seed: int = 1
+    ):
+        """
+        Args:
+            min_similarity: Lowest similarity (0-1) returned by lookup()
+            reuse_similarity: Matches this similar that differ only in
+                punctuation or spacing are reused as they are; None (default)
+                to only reuse exact and adapted matches
+            ngram_size: Character n-gram length for MinHash
+            num_perm: MinHash signature length
+            bands: LSH bands (num_perm must divide evenly); more bands find
+                less similar candidates at the cost of more comparisons
+            seed: Seed of the MinHash permutations
+        """
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.min_similarity = min_similarity
+        self.reuse_similarity = reuse_similarity
+        self.ngram_size = ngram_size
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+
+        self.entries: List[MemoryEntry] = []
+        # (source_lang, target_lang, normalized source) -> entry index
+        self._exact: Dict[Tuple[str, str, str], int] = {}
+        # (source_lang, target_lang, band, band hash) -> entry indices
+        self._buckets: Dict[Tuple[str, str, int, int], List[int]] = {}
+        self._normalized: List[str] = []
+        self.counts = {"lookups": 0, "exact": 0, "adapted": 0, "fuzzy": 0, "near": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _signature(self, text: str) -> List[int]:
+        hashes = [zlib.crc32(gram.encode("utf-8")) for gram in char_ngrams(text, self.ngram_size)]
+        # Per permutation, the minimum over the n-grams
+        return [min((a * h + b) % _PRIME for h in hashes) for a, b in self._perms]
+
+    def _band_keys(self, text: str, source_lang: str, target_lang: str) -> List[Tuple[str, str, int, int]]:
+        signature = self._signature(text)
+        return [
+            (source_lang, target_lang, band, hash(tuple(signature[band * self.rows:(band + 1) * self.rows])))
+            for band in range(self.bands)
+        ]
+
+    def add(self, source: str, translation: str, source_lang: str, target_lang: str, origin: str = "model"):
+        """Store a segment pair; a pair with the same normalized source is replaced"""
+        normalized = normalize_text(source)
+        if not normalized or not translation.strip():
+            return
+        entry = MemoryEntry(source, translation, source_lang, target_lang, origin)
+        with self._lock:
+            index = self._exact.get((source_lang, target_lang, normalized))
+            if index is not None:
+                self.entries[index] = entry
+                return
+            index = len(self.entries)
+            self.entries.append(entry)
+            self._normalized.append(normalized)
+            self._exact[(source_lang, target_lang, normalized)] = index
+            for key in self._band_keys(normalized, source_lang, target_lang):
+                self._buckets.setdefault(key, []).append(index)
+
+    def lookup(self, source: str, source_lang: str, target_lang: str) -> Optional[MemoryMatch]:
+        """Most similar stored segment with similarity >= min_similarity, or None"""
+        normalized = normalize_text(source)
+        with self._lock:
+            self.counts["lookups"] += 1
+            index = self._exact.get((source_lang, target_lang, normalized))
+            if index is not None:
+                self.counts["exact"] += 1
+                entry = self.entries[index]
+                return MemoryMatch(entry, 1.0, "exact", entry.translation)
+
+            candidates = set()
+            for key in self._band_keys(normalized, source_lang, target_lang):
+                candidates.update(self._buckets.get(key, ()))
+
+            best, best_similarity = None, self.min_similarity
+            for index in candidates:
+                matcher = difflib.SequenceMatcher(None, self._normalized[index], normalized, autojunk=False)
+                if matcher.quick_ratio() < best_similarity:
+                    continue
+                similarity = matcher.ratio()
+                if similarity >= best_similarity:
+                    best, best_similarity = index, similarity
+
+            if best is None:
+                self.counts["misses"] += 1
+                return None
+            entry = self.entries[best]
+
+        adapted = adapt_translation(entry.source, source, entry.translation)
+        if adapted is not None:
+            kind, translation = "adapted", adapted
+        elif (
+            self.reuse_similarity is not None
+            and best_similarity >= self.reuse_similarity
+            and not _words_changed(entry.source, source)
+        ):
+            kind, translation = "fuzzy", entry.translation
+        else:
+            kind, translation = "near", None
+        with self._lock:
+            self.counts[kind] += 1
+        return MemoryMatch(entry, best_similarity, kind, translation)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.entries),
+            **self.counts,
+            # Lookups answered without the model
+            "saved_calls": self.counts["exact"] + self.counts["adapted"] + self.counts["fuzzy"]
+        }
+
+    def import_tmx(self, path: str, source_lang: Optional[str] = None) -> int:
+        """Add the segment pairs of a TMX file
+
+        Every translation unit contributes one pair per target language.
+
+        Args:
+            path: TMX file
+            source_lang: Source language (default: the header's srclang)
+
+        Returns:
+            Number of pairs added
+        """
+        root = ET.parse(path).getroot()
+        header = root.find("header")
+        if source_lang is None:
+            source_lang = header.get("srclang") if header is not None else None
+        if not source_lang or source_lang == "*all*":
+            raise ValueError(f"{path}: no source language (pass source_lang)")
+
+        added = 0
+        for unit in root.iter("tu"):
+            segments = {}
+            for variant in unit.findall("tuv"):
+                lang = variant.get(_XML_LANG) or variant.get("lang")
+                seg = variant.find("seg")
+                if lang and seg is not None:
+                    # Inline markup (bpt, ph, ...) is dropped, its text kept
+                    segments[lang] = "".join(seg.itertext())
+            source_code = _language_code(segments, source_lang)
+            if source_code is None:
+                continue
+            for lang, translation in segments.items():
+                if lang != source_code:
+                    self.add(segments[source_code], translation, source_lang, lang, origin="tmx")
+                    added += 1
+        return added
+
+    def export_tmx(self, path: str, source_lang: Optional[str] = None):
+        """Write the stored pairs (optionally of one source language) as TMX 1.4"""
+        entries = [e for e in self.entries if source_lang is None or e.source_lang == source_lang]
+        source_langs = {e.source_lang for e in entries}
+        root = ET.Element("tmx", version="1.4")
+        ET.SubElement(root, "header", {
+            "creationtool": "trans-gemma",
+            "creationtoolversion": "0.1.0",
+            "segtype": "paragraph",
+            "o-tmf": "trans-gemma",
+            "adminlang": "en",
+            "srclang": source_langs.pop() if len(source_langs) == 1 else "*all*",
+            "datatype": "plaintext"
+        })
+        body = ET.SubElement(root, "body")
+        for entry in entries:
+            unit = ET.SubElement(body, "tu", {"srclang": entry.source_lang})
+            for lang, text in ((entry.source_lang, entry.source), (entry.target_lang, entry.translation)):
+                variant = ET.SubElement(unit, "tuv", {_XML_LANG: lang})
+                ET.SubElement(variant, "seg").text = text
+        ET.indent(root)
+        ET.ElementTree(root).write(path, encoding="utf-8", xml_declaration=True)
+
+
+def _language_code(segments: Dict[str, str], lang: str) -> Optional[str]:
+    """Code of the segment for lang, matching case-insensitively and falling back to the base language"""
+    lang = lang.lower()
+    for code in segments:
+        if code.lower() == lang:
+            return code
+    base = lang.split("-")[0]
+    for code in segments:
+        if code.lower().split("-")[0] == base:
+            return code
+    return None
@@ -0,0 +1,200 @@
+"""Persistent translation store shared across runs and processes
+
+TranslationCache forgets everything when the process exits. TranslationStore
+keeps translate() results in a single SQLite file, keyed by the same content
+digest (see translation_cache.cache_key), so re-running a script on the same
+document only translates what changed. The database runs in WAL mode: any
+number of processes can read while one writes, and a crash loses at most
+the result being written.
+
+Old entries are dropped by compact(), by age (time since last use) and by
+total size; the limits given to the constructor are applied when the store
+is opened.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+DEFAULT_STORE_PATH = Path.home() / ".cache" / "trans-gemma" / "translations.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS translations (
+    key TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS translations_accessed ON translations (accessed);
+"""
+
+
+class TranslationStore:
+    """SQLite store of translate() results, used like a TranslationCache
+
+    Hit and miss counters cover this instance only, i.e. the current run.
+
+    Example:
+        store = TranslationStore(max_age=30 * 86400)
+        backend = CachedBackend(get_backend("ollama"), store=store)
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_age: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        timeout: float = 30.0
+    ):
+        """
+        Args:
+            path: Database file (default: TRANSLATION_STORE_PATH env or
+                ~/.cache/trans-gemma/translations.sqlite3); "" keeps the
+                store in memory for this process only
+            max_age: Seconds since last use after which entries are dropped
+            max_entries: Entries kept at most
+            max_bytes: Approximate size cap of the stored results
+            timeout: Seconds to wait for another process's write lock
+        """
+        if path is None:
+            path = os.getenv("TRANSLATION_STORE_PATH", str(DEFAULT_STORE_PATH))
+        self.path = Path(path) if path else None
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        try:
+            self._conn = self._connect(timeout)
+        except (OSError, sqlite3.Error):
+            # Read-only home or similar: keep results in memory for this run only
+            self.path = None
+            self._conn = self._connect(timeout)
+        self.compact()
+
+    def _connect(self, timeout: float) -> sqlite3.Connection:
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        # One connection shared by all threads, serialized by _lock
+        conn = sqlite3.connect(
+            str(self.path) if self.path is not None else ":memory:",
+            timeout=timeout,
+            check_same_thread=False,
+            isolation_level=None
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL keeps the database consistent without a sync per commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Stored result for key, or None if absent or older than max_age"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, accessed FROM translations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.max_age is not None and now - row[1] > self.max_age):
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE translations SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, result: Dict[str, Any]) -> bool:
+        """Store result (JSON-serializable values; others are stored as strings)"""
+        data = json.dumps(result, ensure_ascii=False, default=str)
+        nbytes = len(key) + len(data.encode("utf-8"))
+        if self.max_bytes is not None and nbytes > self.max_bytes:
+            return False
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translations (key, result, bytes, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, data, nbytes, now, now)
+            )
+        return True
+
+    def compact(
+        self,
+        max_age: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None
+    ) -> int:
+        """Drop expired entries, then least recently used ones over the limits
+
+        Args default to the limits given to the constructor.
+
+        Returns:
+            Number of entries removed
+        """
+        max_age = self.max_age if max_age is None else max_age
+        max_entries = self.max_entries if max_entries is None else max_entries
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+
+        removed = 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if max_age is not None:
+                    removed += self._conn.execute(
+                        "DELETE FROM translations WHERE accessed < ?", (time.time() - max_age,)
+                    ).rowcount
+                if max_entries is not None:
+                    removed += self._conn.execute(
+                        "DELETE FROM translations WHERE key IN ("
+                        "SELECT key FROM translations ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                        (max_entries,)
+                    ).rowcount
+                if max_bytes is not None:
+                    # Keep the most recently used entries whose running total fits
+                    removed += self._conn.execute(
+                        "DELETE FROM translations WHERE key IN ("
+                        "SELECT key FROM (SELECT key, SUM(bytes) OVER (ORDER BY accessed DESC, key) AS total "
+                        "FROM translations) WHERE total > ?)",
+                        (max_bytes,)
+                    ).rowcount
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self.evictions += removed
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM translations")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM translations"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "path": str(self.path) if self.path is not None else None,
+            "entries": entries,
+            "bytes": total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0,
+            "evictions": self.evictions
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
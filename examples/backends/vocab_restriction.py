@@ -0,0 +1,288 @@
+"""Output-vocabulary restriction for greedy decoding
+
+Gemma's vocabulary has about 262k tokens. On CPU the final projection (the
+LM head, hidden_size x vocab_size) is a sizable share of every decode step,
+yet a translation into one language only ever uses a small part of the
+vocabulary. VocabularyRestriction keeps, per target language, the LM-head
+rows of tokens the output can plausibly contain:
+
+- tokens written in the target language's script
+- digits, punctuation, symbols, whitespace, byte-fallback and special tokens
+- tokens of the source text (names, numbers, formulas are copied verbatim)
+
+restricted_generate() then computes logits over that subset only. When the
+restricted distribution is unsure (top probability below min_confidence),
+the step falls back to the full LM head; an out-of-set token picked there is
+added to the language's set for later calls.
+
+The mode is lossy: a confident restricted step is not compared against the
+full vocabulary, so the output can differ from plain greedy decoding. The
+first step and every verify_every-th step run the full LM head as a check
+and take its token; mismatches are counted in the stats.
+"""
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+try:
+    from .prefix_cache import layers_to_cache
+except ImportError:
+    from prefix_cache import layers_to_cache
+
+_LATIN = ((0x41, 0x5A), (0x61, 0x7A), (0xC0, 0x24F), (0x1E00, 0x1EFF))
+_CJK = ((0x3400, 0x4DBF), (0x4E00, 0x9FFF), (0xF900, 0xFAFF), (0x3000, 0x303F), (0xFF00, 0xFFEF))
+_CYRILLIC = ((0x400, 0x52F),)
+_ARABIC = ((0x600, 0x6FF), (0x750, 0x77F), (0xFB50, 0xFDFF), (0xFE70, 0xFEFF))
+
+# Letter ranges per target language (base code, before any "-region")
+SCRIPT_RANGES: Dict[str, Tuple[Tuple[int, int], ...]] = {
+    **{code: _LATIN for code in (
+        "en", "fr", "de", "es", "it", "pt", "nl", "pl", "cs", "tr", "da", "fi", "no", "sv",
+        "ro", "hu", "vi", "id", "fil", "ms"
+    )},
+    "zh": _CJK + ((0x3100, 0x312F),),
+    "ja": _CJK + ((0x3040, 0x30FF), (0x31F0, 0x31FF)),
+    "ko": _CJK + ((0xAC00, 0xD7AF), (0x1100, 0x11FF), (0x3130, 0x318F)),
+    "ru": _CYRILLIC,
+    "uk": _CYRILLIC,
+    "bg": _CYRILLIC,
+    "el": ((0x370, 0x3FF), (0x1F00, 0x1FFF)),
+    "ar": _ARABIC,
+    "fa": _ARABIC,
+    "he": ((0x590, 0x5FF), (0xFB1D, 0xFB4F)),
+    "hi": ((0x900, 0x97F),),
+    "bn": ((0x980, 0x9FF),),
+    "th": ((0xE00, 0xE7F),),
+}
+
+_BYTE_TOKEN = re.compile(r"^<0x[0-9A-Fa-f]{2}>$")
+
+
+def script_ranges(lang_code: str) -> Optional[Tuple[Tuple[int, int], ...]]:
+    """Letter ranges for a language code such as "zh-TW" (None if unknown)"""
+    return SCRIPT_RANGES.get(lang_code, SCRIPT_RANGES.get(lang_code.split("-")[0]))
+
+
+def _token_allowed(piece: str, ranges: Tuple[Tuple[int, int], ...]) -> bool:
+    """True if every letter of a vocabulary piece lies in ranges"""
+    if _BYTE_TOKEN.match(piece):
+        return True
+    for char in piece.replace("▁", " "):
+        category = unicodedata.category(char)
+        # Digits, punctuation, symbols and whitespace are shared by all languages
+        if category[0] in "NPSZ" or char.isspace():
+            continue
+        code = ord(char)
+        if not any(low <= code <= high for low, high in ranges):
+            return False
+    return True
+
+
+class VocabularyRestriction:
+    """Per-target-language LM-head subsets for one model and tokenizer
+
+    The LM-head rows of a language are copied once and kept in a small LRU,
+    about vocab_fraction * 2.6 GB in float32 for the 4B model.
+    """
+
+    def __init__(self, model, tokenizer, max_languages: int = 2):
+        """
+        Args:
+            model: Causal LM whose output embeddings are restricted
+            tokenizer: The model's tokenizer
+            max_languages: Target languages whose LM-head subset stays in memory
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_languages = max_languages
+        self.head = model.get_output_embeddings()
+        self.vocab_size = self.head.weight.shape[0]
+        # Tokens any output may need: specials (EOS, end of turn) and the pad token
+        self.always_allowed = {i for i in tokenizer.all_special_ids if i < self.vocab_size}
+        # Out-of-set tokens picked by fallback steps, per target language
+        self.learned: Dict[str, Set[int]] = {}
+        self._subsets: "OrderedDict[str, Tuple[Any, Any]]" = OrderedDict()
+        self._pieces: Optional[List[Optional[str]]] = None
+        self._lock = threading.Lock()
+
+    def supports(self, target_lang: str) -> bool:
+        return script_ranges(target_lang) is not None
+
+    def subset(self, target_lang: str):
+        """(token ids, LM-head rows) of a target language's script set"""
+        import torch
+
+        with self._lock:
+            if target_lang in self._subsets:
+                self._subsets.move_to_end(target_lang)
+                return self._subsets[target_lang]
+
+            if self._pieces is None:
+                self._pieces = self.tokenizer.convert_ids_to_tokens(list(range(self.vocab_size)))
+            ranges = script_ranges(target_lang)
+            allowed = sorted(self.always_allowed | {
+                i for i, piece in enumerate(self._pieces)
+                if piece is not None and _token_allowed(piece, ranges)
+            })
+            ids = torch.tensor(allowed, device=self.head.weight.device)
+            entry = (ids, self.head.weight.detach().index_select(0, ids))
+
+            self._subsets[target_lang] = entry
+            while len(self._subsets) > self.max_languages:
+                self._subsets.popitem(last=False)
+            return entry
+
+    def extra_ids(self, source_text: str, target_lang: str) -> List[int]:
+        """Source-text and learned tokens outside the script set"""
+        words = source_text.split()
+        # Copied words can be tokenized with or without their leading space
+        variants = words + [" " + word for word in words]
+        ids = {i for ids in self.tokenizer(variants, add_special_tokens=False).input_ids for i in ids} if words else set()
+        ids |= self.learned.get(target_lang, set())
+
+        subset_ids = set(self.subset(target_lang)[0].tolist())
+        return sorted(i for i in ids if i < self.vocab_size and i not in subset_ids)
+
+    def learn(self, target_lang: str, token_id: int):
+        self.learned.setdefault(target_lang, set()).add(token_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "vocab_size": self.vocab_size,
+            "languages": {lang: len(entry[0]) for lang, entry in self._subsets.items()},
+            "learned_tokens": {lang: len(ids) for lang, ids in self.learned.items()}
+        }
+
+
+def _softcap(logits, cap: Optional[float]):
+    import torch
+
+    return torch.tanh(logits / cap) * cap if cap else logits
+
+
+def restricted_generate(
+    model,
+    input_ids: List[int],
+    restriction: VocabularyRestriction,
+    source_text: str,
+    target_lang: str,
+    max_new_tokens: int,
+    eos_ids: Set[int],
+    past_key_values=None,
+    cached_tokens: int = 0,
+    stopping_criteria=None,
+    min_confidence: float = 0.3,
+    streamer=None,
+    verify_every: int = 16
+) -> Tuple[List[int], Dict[str, Any]]:
+    """Greedy decoding with logits over the target language's token subset
+
+    Approximate: between full-head checks, a token outside the subset that
+    plain greedy decoding would pick is missed whenever the restricted top
+    probability reaches min_confidence.
+
+    Args:
+        model: Causal LM (its base model must return last_hidden_state)
+        input_ids: Prompt token ids
+        restriction: Token subsets of the model
+        source_text: Text being translated; its tokens are always allowed
+        target_lang: Target language code selecting the subset
+        max_new_tokens: Generation budget
+        eos_ids: Token ids that end generation
+        past_key_values: Optional cache already holding the first cached_tokens
+            prompt tokens (e.g. from the prefix cache)
+        cached_tokens: Number of prompt tokens in past_key_values
+        stopping_criteria: Optional StoppingCriteriaList, checked after every
+            step against prompt + generated ids
+        min_confidence: Steps whose top restricted probability is lower use
+            the full LM head
+        streamer: Optional transformers streamer; gets the prompt, then each
+            generated token
+        verify_every: The first step and every verify_every-th step use the
+            full LM head regardless of confidence (0: only low-confidence steps)
+
+    Returns:
+        (generated token ids, stats dict)
+    """
+    import torch
+
+    device = model.device
+    cache = past_key_values if past_key_values is not None else layers_to_cache()
+    if past_key_values is None:
+        cached_tokens = 0
+    softcap = getattr(model.config.get_text_config(decoder=True), "final_logit_softcapping", None)
+
+    subset_ids, subset_weight = restriction.subset(target_lang)
+    extra = restriction.extra_ids(source_text, target_lang)
+    if extra:
+        extra_ids = torch.tensor(extra, device=subset_ids.device)
+        subset_ids = torch.cat([subset_ids, extra_ids])
+        subset_weight = torch.cat([subset_weight, restriction.head.weight.detach().index_select(0, extra_ids)])
+    allowed = set(subset_ids.tolist())
+
+    fallback_steps = 0
+    verify_steps = 0
+    verify_mismatches = 0
+    out_of_set_tokens = 0
+
+    def next_token(hidden, step: int) -> int:
+        nonlocal fallback_steps, verify_steps, verify_mismatches, out_of_set_tokens
+        logits = _softcap(hidden @ subset_weight.T, softcap)
+        top = int(logits.argmax())
+        verify = step == 0 or (verify_every > 0 and step % verify_every == 0)
+        confident = bool(torch.softmax(logits.float(), dim=-1)[top] >= min_confidence)
+        if confident and not verify:
+            return int(subset_ids[top])
+
+        token = int(_softcap(restriction.head(hidden), softcap).argmax())
+        if confident:
+            verify_steps += 1
+            verify_mismatches += token != int(subset_ids[top])
+        else:
+            fallback_steps += 1
+        if token not in allowed:
+            out_of_set_tokens += 1
+            restriction.learn(target_lang, token)
+        return token
+
+    def should_stop() -> bool:
+        if not stopping_criteria:
+            return False
+        return bool(torch.as_tensor(stopping_criteria(torch.tensor([context], device=device), None)).any())
+
+    generated: List[int] = []
+    context = list(input_ids)
+    if streamer is not None:
+        streamer.put(torch.tensor(input_ids))
+    with torch.no_grad():
+        # The base model stops before the LM head
+        step_ids = input_ids[cached_tokens:]
+        while len(generated) < max_new_tokens:
+            outputs = model.base_model(
+                input_ids=torch.tensor([step_ids], device=device),
+                past_key_values=cache,
+                use_cache=True
+            )
+            cache = outputs.past_key_values
+            token = next_token(outputs.last_hidden_state[0, -1], len(generated))
+            generated.append(token)
+            context.append(token)
+            if streamer is not None:
+                streamer.put(torch.tensor([token]))
+            if token in eos_ids or should_stop():
+                break
+            step_ids = [token]
+    if streamer is not None:
+        streamer.end()
+
+    stats = {
+        "restricted_vocab_size": len(subset_ids),
+        "vocab_size": restriction.vocab_size,
+        "fallback_steps": fallback_steps,
+        "verify_steps": verify_steps,
+        "verify_mismatches": verify_mismatches,
+        "out_of_set_tokens": out_of_set_tokens
+    }
+    return generated, stats
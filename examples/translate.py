@@ -19,6 +19,9 @@ Usage:
     # Translate specific pages from PDF
     python translate.py --mode pdf --file doc.pdf --start-page 1 --end-page 3
 
+    # Reuse translations of a previous version through a translation memory
+    python translate.py --mode pdf --file paper-v2.pdf --tmx paper.tmx --tmx-out paper-v2.tmx
+
     # Specify backend
     python translate.py --backend mlx --text "How are you?"
 
@@ -26,19 +29,38 @@ Environment Variables:
     BACKEND: Default backend (transformers, ollama, mlx)
     FORCE_DEVICE: Device for transformers (cpu, mps, auto)
     NO_MEM_LIMIT: Disable memory limit for transformers (0, 1)
+    PROMPT_LOOKUP: Prompt-lookup speculative decoding for transformers (0, 1)
+    DRAFT_MODEL_ID: Draft model for assisted generation with transformers
+    QUANTIZATION: Weight preset for transformers (none, bf16, int8, int4; int4 is fast on CPU only)
+    KV_CACHE_BITS: KV cache precision for transformers (8, 4; unset = full)
+    COMPILE: Static KV cache and compiled decode step for transformers (0, 1)
+    COMPILE_CACHE_LENGTHS: Cache buckets compiled at load time, e.g. 512,1024 (unset = on first use)
+    RESTRICT_VOCAB: Logits over the target language's tokens only, transformers; lossy (0, 1)
+    OLLAMA_MAX_CONNECTIONS: HTTP connections kept open to the Ollama server (default: 8)
+    OLLAMA_TIMEOUT: Seconds to wait for each read from the Ollama server (default: 180)
+    OLLAMA_KEEP_ALIVE: How long Ollama keeps the model loaded after a request (default: 30m)
+    TRANSLATION_CACHE: Reuse translations of repeated text in pdf and interactive modes (0, 1; default: 1)
+    TRANSLATION_STORE_PATH: SQLite file keeping pdf-mode translations across runs
+                            (default: ~/.cache/trans-gemma/translations.sqlite3; "" = this run only)
+    LENGTH_BUDGET_PATH: File for learned output/input length ratios
+                        (default: ~/.cache/trans-gemma/length_budget.json)
 """
 
 import argparse
 import os
+import queue
 import sys
-import time
+import threading
 from typing import Optional
 from pathlib import Path
 
 # Add backends to path
 sys.path.insert(0, os.path.dirname(__file__))
 
-from backends import get_backend, HAS_MLX
+from backends import (
+    get_backend, HAS_MLX, CachedBackend, CancellationToken, TranslationCancelled,
+    TranslationMemory, TranslationStore, plan_dedup, translate_pages, merge_segment_results
+)
 
 # Check if PyMuPDF is available
 try:
@@ -167,6 +189,49 @@ def extract_text_from_pdf(pdf_path: str, start_page: Optional[int] = None, end_p
     return pages_text
 
 
+def extract_segments_from_pdf(pdf_path: str, start_page: Optional[int] = None,
+                              end_page: Optional[int] = None) -> list[tuple[int, list[str]]]:
+    """
+    Extract text from PDF file as segments: the text blocks of each page
+
+    Running headers, footers, stamps and equation labels come out as blocks
+    of their own, so identical ones can be translated once per document.
+
+    Args:
+        pdf_path: Path to PDF file
+        start_page: Starting page number (1-indexed, inclusive)
+        end_page: Ending page number (1-indexed, inclusive)
+
+    Returns:
+        List of (page_number, segments) tuples, segments in reading order
+    """
+    if not HAS_PDF:
+        raise ImportError("PyMuPDF not installed. Run: uv pip install pymupdf")
+
+    pdf_path = Path(pdf_path)
+    if not pdf_path.exists():
+        raise FileNotFoundError(f"PDF file not found: {pdf_path}")
+
+    doc = fitz.open(pdf_path)
+    total_pages = len(doc)
+    start_page = start_page or 1
+    end_page = end_page or total_pages
+    if start_page < 1 or start_page > total_pages:
+        raise ValueError(f"Invalid start page: {start_page} (PDF has {total_pages} pages)")
+    if end_page < start_page or end_page > total_pages:
+        raise ValueError(f"Invalid end page: {end_page} (must be >= {start_page} and <= {total_pages})")
+
+    pages_segments = []
+    for page_num in range(start_page - 1, end_page):
+        # (x0, y0, x1, y1, text, block_no, block_type); type 0 is text, 1 is an image
+        blocks = doc[page_num].get_text("blocks", sort=True)
+        segments = [block[4].strip() for block in blocks if block[6] == 0 and block[4].strip()]
+        pages_segments.append((page_num + 1, segments))
+
+    doc.close()
+    return pages_segments
+
+
 def pdf_pages_to_images(pdf_path: str, start_page: Optional[int] = None, end_page: Optional[int] = None, dpi: int = 150):
     """
     Convert PDF pages to images
@@ -224,7 +289,8 @@ def pdf_pages_to_images(pdf_path: str, start_page: Optional[int] = None, end_pag
 
 def pdf_mode(backend_name: str, pdf_path: str, source: str, target: str,
              start_page: Optional[int] = None, end_page: Optional[int] = None,
-             pdf_as_image: bool = False, dpi: int = 96):
+             pdf_as_image: bool = False, dpi: int = 96, tmx_path: Optional[str] = None,
+             tmx_out_path: Optional[str] = None):
     """PDF translation mode
 
     Args:
@@ -235,6 +301,10 @@ def pdf_mode(backend_name: str, pdf_path: str, source: str, target: str,
         start_page: Starting page number
         end_page: Ending page number
         pdf_as_image: If True, use image mode (multimodal TranslateGemma)
+        tmx_path: Translation memory file; segments similar to its entries
+            reuse their translations. It is only read.
+        tmx_out_path: File to export the translation memory to after the run
+            (tmx_path's pairs plus this run's translations)
     """
     print(f"{Colors.BOLD}TranslateGemma - PDF Translation{Colors.NC}")
 
@@ -256,6 +326,17 @@ def pdf_mode(backend_name: str, pdf_path: str, source: str, target: str,
             print_info("Using multimodal backend for image translation")
         else:
             backend = get_backend(backend_name)
+            # Running headers and repeated captions are translated once, and
+            # pages translated by an earlier run are read back from the store
+            memory = None
+            if tmx_path or tmx_out_path:
+                memory = TranslationMemory()
+                if tmx_path and os.path.exists(tmx_path):
+                    print_info(f"Translation memory: {memory.import_tmx(tmx_path, source)} pairs from {tmx_path}")
+            if os.getenv("TRANSLATION_CACHE", "1") == "1":
+                backend = CachedBackend(backend, store=TranslationStore(), memory=memory)
+            elif memory is not None:
+                backend = CachedBackend(backend, memory=memory)
     except ValueError as e:
         print_error(str(e))
         return 1
@@ -271,7 +352,7 @@ def pdf_mode(backend_name: str, pdf_path: str, source: str, target: str,
             print_success(f"Converted {len(pages_data)} page(s) to images")
         else:
             print("Extracting text from PDF...")
-            pages_data = extract_text_from_pdf(pdf_path, start_page, end_page)
+            pages_data = extract_segments_from_pdf(pdf_path, start_page, end_page)
             print_success(f"Extracted text from {len(pages_data)} page(s)")
         print()
     except Exception as e:
@@ -304,6 +385,20 @@ def pdf_mode(backend_name: str, pdf_path: str, source: str, target: str,
     total_time = 0
     total_tokens = 0
     translated_pages = 0
+    heuristic_extractions = 0
+    total_chunks = 0
+    dedup_stats = None
+
+    if not pdf_as_image:
+        # Segments repeated across pages (headers, footers, stamps) are translated
+        # once; pages come back in order as soon as their segments are done
+        pages_segments = [page_segments for _, page_segments in pages_data]
+        plan = plan_dedup([segment for page_segments in pages_segments for segment in page_segments])
+        dedup_stats = plan.stats()
+        print(f"{Colors.CYAN}Translating {dedup_stats['segments']} segments "
+              f"({dedup_stats['unique_segments']} unique)...{Colors.NC}")
+        print()
+        translated = translate_pages(backend, pages_segments, source, target, plan=plan)
 
     for page_num, page_content in pages_data:
         print(f"{Colors.BOLD}Page {page_num}:{Colors.NC}")
@@ -317,14 +412,15 @@ def pdf_mode(backend_name: str, pdf_path: str, source: str, target: str,
                 print_error("Backend doesn't support image translation")
                 return 1
         else:
-            # Text mode
+            # Text mode: page_content is the page's segments
+            page_results = next(translated)
             # Skip empty pages
-            if not page_content.strip():
+            if not page_content:
                 print(f"{Colors.YELLOW}Empty, skipped{Colors.NC}")
                 continue
 
-            print(f"{Colors.CYAN}Translating {len(page_content)} characters...{Colors.NC}")
-            result = backend.translate(page_content, source, target)
+            # Segments over the backend's token budget were split into chunks
+            result = merge_segment_results(page_results)
 
         if "error" in result.get("metadata", {}):
             print_error(f"Translation failed for page {page_num}", result["metadata"]["error"])
@@ -336,7 +432,12 @@ def pdf_mode(backend_name: str, pdf_path: str, source: str, target: str,
         print(f"{Colors.GREEN}{wrapped_translation}{Colors.NC}")
         print()
         mode_info = result['metadata'].get('mode', 'text')
-        print(f"Time: {result['time']:.2f}s, Tokens: {result['tokens']}, Speed: {result['metadata'].get('tokens_per_second', 0):.1f} tok/s, Mode: {mode_info}")
+        chunks = result['metadata'].get('chunks', 1)
+        if pdf_as_image:
+            print(f"Time: {result['time']:.2f}s, Tokens: {result['tokens']}, Speed: {result['metadata'].get('tokens_per_second', 0):.1f} tok/s, Mode: {mode_info}, Chunks: {chunks}")
+        else:
+            segment_info = f"Segments: {result['metadata']['segments']} ({result['metadata']['duplicate_segments']} repeated)"
+            print(f"Time: {result['time']:.2f}s, Tokens: {result['tokens']}, Speed: {result['metadata'].get('tokens_per_second', 0):.1f} tok/s, Mode: {mode_info}, {segment_info}")
         print()
         print("─" * 80)
         print()
@@ -344,15 +445,39 @@ def pdf_mode(backend_name: str, pdf_path: str, source: str, target: str,
         total_time += result['time']
         total_tokens += result['tokens']
         translated_pages += 1
+        total_chunks += chunks
+        if result['metadata'].get('extraction') == 'heuristic':
+            heuristic_extractions += 1
 
     # Print summary
     print(f"{Colors.BOLD}Summary:{Colors.NC}")
     print(f"  Mode: {'Image (Multimodal)' if pdf_as_image else 'Text'}")
     print(f"  Pages translated: {translated_pages}")
+    if dedup_stats is not None:
+        print(f"  Segments: {dedup_stats['segments']} ({dedup_stats['unique_segments']} unique, "
+              f"{dedup_stats['dedup_ratio']:.0%} deduplicated)")
+    elif total_chunks > translated_pages:
+        print(f"  Chunks: {total_chunks} (pages over the token budget are split)")
     print(f"  Total time: {total_time:.2f}s")
     print(f"  Total tokens: {total_tokens}")
     if total_time > 0:
         print(f"  Average speed: {total_tokens / total_time:.1f} tok/s")
+    if heuristic_extractions:
+        print(f"  Heuristic extractions: {heuristic_extractions}/{translated_pages}")
+    if isinstance(backend, CachedBackend):
+        cache_stats = backend.cache.stats()
+        print(f"  Translation cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    if isinstance(backend, CachedBackend) and backend.store is not None:
+        store_stats = backend.store.stats()
+        print(f"  Translation store: {store_stats['hits']} hits, {store_stats['misses']} misses "
+              f"({store_stats['hit_rate']:.0%} hit rate, {store_stats['entries']} entries)")
+    if isinstance(backend, CachedBackend) and backend.memory is not None:
+        memory_stats = backend.memory.stats()
+        print(f"  Translation memory: {memory_stats['saved_calls']} model calls saved "
+              f"({memory_stats['exact']} exact, {memory_stats['adapted']} adapted, {memory_stats['fuzzy']} fuzzy)")
+        if tmx_out_path:
+            backend.memory.export_tmx(tmx_out_path)
+            print(f"  Translation memory saved: {tmx_out_path} ({memory_stats['entries']} pairs)")
 
     # Cleanup
     backend.cleanup()
@@ -397,20 +522,25 @@ def one_shot_mode(backend_name: str, text: str, source: str, target: str):
     print(f"Target: {target}")
     print()
 
-    result = backend.translate(text, source, target)
+    # Stream the translation as it is generated
+    print(f"{Colors.BOLD}Translation:{Colors.NC}")
+    try:
+        result = translate_cancellable(backend, text, source, target, on_text=print_stream("  "))
+    except (KeyboardInterrupt, TranslationCancelled):
+        print(Colors.NC)
+        print_warning("Translation cancelled")
+        backend.cleanup()
+        return 1
+    print(Colors.NC)
 
     if "error" in result.get("metadata", {}):
         print_error("Translation failed", result["metadata"]["error"])
         return 1
 
-    # Print results with word wrap
-    import textwrap
-    wrapped_translation = textwrap.fill(result['translation'], width=100, break_long_words=False, break_on_hyphens=False)
-    wrapped_translation = '\n  '.join(wrapped_translation.split('\n'))  # Indent each line
-    print(f"{Colors.BOLD}Translation:{Colors.NC}")
-    print(f"  {Colors.GREEN}{wrapped_translation}{Colors.NC}")
     print()
     print(f"Time: {result['time']:.2f}s")
+    if result['metadata'].get('time_to_first_token') is not None:
+        print(f"First token: {result['metadata']['time_to_first_token']:.2f}s")
     print(f"Tokens: {result['tokens']}")
     print(f"Speed: {result['metadata'].get('tokens_per_second', 0):.1f} tokens/s")
 
@@ -420,6 +550,69 @@ def one_shot_mode(backend_name: str, text: str, source: str, target: str):
     return 0
 
 
+def translate_cancellable(backend, text: str, source: str, target: str, on_text=None):
+    """Run backend.translate_stream in a worker thread so Ctrl-C can cancel it
+
+    Streamed text pieces are passed to on_text as they arrive. On
+    KeyboardInterrupt the translation's cancellation token is cancelled and
+    the worker is joined before the interrupt propagates, so the model is free
+    again when the next prompt is entered.
+
+    Returns:
+        The final translate() result dict
+    """
+    cancel_token = CancellationToken()
+    events = queue.Queue()
+
+    def worker():
+        try:
+            for event in backend.translate_stream(text, source, target, cancel_token=cancel_token):
+                events.put(("event", event))
+        except BaseException as e:
+            events.put(("error", e))
+        finally:
+            events.put(("end", None))
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    result = None
+    try:
+        while True:
+            try:
+                # Short waits keep the main thread responsive to Ctrl-C
+                kind, value = events.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if kind == "end":
+                break
+            if kind == "error":
+                raise value
+            if value.get("done"):
+                result = value["result"]
+            elif on_text is not None:
+                on_text(value["text"])
+    except KeyboardInterrupt:
+        cancel_token.cancel()
+        thread.join()
+        raise
+
+    return result
+
+
+def print_stream(prefix: str = "", indent: str = "  "):
+    """on_text callback for translate_cancellable that prints pieces as they arrive"""
+    started = False
+
+    def on_text(piece: str):
+        nonlocal started
+        if not started:
+            print(f"{Colors.GREEN}{prefix}", end="")
+            started = True
+        print(piece.replace("\n", "\n" + indent), end="", flush=True)
+
+    return on_text
+
+
 def interactive_mode(backend_name: str):
     """Interactive REPL mode"""
     print(f"{Colors.BOLD}TranslateGemma - Interactive Mode{Colors.NC}")
@@ -432,6 +625,8 @@ def interactive_mode(backend_name: str):
     except ValueError as e:
         print_error(str(e))
         return 1
+    if os.getenv("TRANSLATION_CACHE", "1") == "1":
+        backend = CachedBackend(backend)
 
     # Load model
     print(f"Loading {backend_name} backend...")
@@ -507,6 +702,8 @@ def interactive_mode(backend_name: str):
                 elif cmd == 'info':
                     print()
                     print(f"{Colors.CYAN}Backend Information:{Colors.NC}")
+                    # Refreshed for the translation cache counters
+                    info = backend.get_backend_info()
                     for key, value in info.items():
                         print(f"  {key}: {value}")
                     print()
@@ -516,31 +713,28 @@ def interactive_mode(backend_name: str):
 
                 continue
 
-            # Translate
-            start_time = time.time()
-            result = backend.translate(user_input, source_lang, target_lang)
-            end_time = time.time()
+            # Translate, printing the translation as it streams in
+            try:
+                result = translate_cancellable(backend, user_input, source_lang, target_lang,
+                                               on_text=print_stream("→ "))
+            finally:
+                print(Colors.NC)
 
             if "error" in result.get("metadata", {}):
                 print_error("Translation failed", result["metadata"]["error"])
                 continue
 
-            # Print translation with word wrap
-            import textwrap
-            wrapped_translation = textwrap.fill(result['translation'], width=96, break_long_words=False, break_on_hyphens=False)
-            # Add arrow prefix to first line, indent rest
-            lines = wrapped_translation.split('\n')
-            lines[0] = f"→ {lines[0]}"
-            for i in range(1, len(lines)):
-                lines[i] = f"  {lines[i]}"
-            print(f"{Colors.GREEN}{chr(10).join(lines)}{Colors.NC}")
-            print(f"  ({result['time']:.2f}s, {result['metadata'].get('tokens_per_second', 0):.1f} tok/s)")
+            first_token = result['metadata'].get('time_to_first_token')
+            first_token_info = f", first token {first_token:.2f}s" if first_token is not None else ""
+            if result['metadata'].get('translation_cache') == 'hit':
+                first_token_info += ", cached"
+            print(f"  ({result['time']:.2f}s, {result['metadata'].get('tokens_per_second', 0):.1f} tok/s{first_token_info})")
             print()
 
             total_translations += 1
             total_time += result['time']
 
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, TranslationCancelled):
             print()
             print()
             print_info("Interrupted. Type :quit to exit.")
@@ -616,6 +810,18 @@ def main():
         help="DPI for PDF to image conversion (default: 96, lower = faster, higher = better quality). TranslateGemma expects 896x896."
     )
 
+    parser.add_argument(
+        "--tmx",
+        help="Translation memory (TMX) for pdf mode: near-duplicate segments reuse its "
+             "translations (read only)"
+    )
+
+    parser.add_argument(
+        "--tmx-out",
+        help="Save the translation memory (--tmx pairs plus new translations) to this TMX "
+             "file after a pdf mode run"
+    )
+
     parser.add_argument(
         "--source",
         default="en",
@@ -657,7 +863,7 @@ def main():
             pdf_file = download_arxiv_pdf(args.arxiv)
 
         return pdf_mode(args.backend, pdf_file, args.source, args.target,
-                       args.start_page, args.end_page, args.pdf_as_image, args.dpi)
+                       args.start_page, args.end_page, args.pdf_as_image, args.dpi, args.tmx, args.tmx_out)
     else:
         return interactive_mode(args.backend)
 
@@ -26,7 +26,7 @@ from dataclasses import dataclass
 # Add backends to path
 sys.path.insert(0, os.path.dirname(__file__))
 
-from backends import get_backend, HAS_MLX
+from backends import get_backend, HAS_MLX, CachedBackend, TranslationStore
 
 
 @dataclass
@@ -59,7 +59,7 @@ class TranslateGemma:
         print(f"Time: {result.time:.2f}s, Speed: {result.tokens_per_second:.1f} tok/s")
     """
 
-    def __init__(self, backend: Optional[str] = None):
+    def __init__(self, backend: Optional[str] = None, cache: bool = True, store_path: Optional[str] = None):
         """
         Initialize TranslateGemma translator
 
@@ -68,12 +68,19 @@ class TranslateGemma:
                 - Colab/Linux CUDA: transformers
                 - M1/M2/M3 Mac: ollama (if installed) or mlx
                 - Other: transformers
+            cache: Reuse earlier translations of the same text, from this
+                session or (through the translation store) earlier ones
+            store_path: SQLite file of the translation store (default:
+                TRANSLATION_STORE_PATH env or ~/.cache/trans-gemma/translations.sqlite3;
+                "" = this session only)
         """
         if backend is None:
             backend = self._auto_detect_backend()
 
         self.backend_name = backend
         self.backend = get_backend(backend)
+        if cache:
+            self.backend = CachedBackend(self.backend, store=TranslationStore(store_path))
         self._loaded = False
 
     def _auto_detect_backend(self) -> str:
@@ -175,6 +182,10 @@ class TranslateGemma:
         """
         Translate multiple texts
 
+        Uses the backend's batched path when it has one: batched generation
+        for transformers, concurrent requests for ollama (up to max_parallel
+        in flight, with retries).
+
         Args:
             texts: List of texts to translate
             source: Source language code
@@ -189,10 +200,28 @@ class TranslateGemma:
             for result in results:
                 print(result.translation)
         """
-        return [self.translate(text, source, target) for text in texts]
+        self._ensure_loaded()
+
+        results = self.backend.translate_batch(texts, source, target)
+
+        translations = []
+        for result in results:
+            if "error" in result.get("metadata", {}):
+                raise RuntimeError(f"Translation failed: {result['metadata']['error']}")
+
+            translations.append(TranslationResult(
+                translation=result["translation"],
+                time=result["time"],
+                tokens=result["tokens"],
+                tokens_per_second=result["metadata"].get("tokens_per_second", 0),
+                backend=self.backend_name,
+                metadata=result["metadata"]
+            ))
+
+        return translations
 
     def get_info(self) -> Dict[str, str]:
-        """Get backend information"""
+        """Get backend information (with translation cache and store hit rates when caching)"""
         return self.backend.get_backend_info()
 
     def cleanup(self):
@@ -0,0 +1,69 @@
+"""Shared fixtures: fake backends that record what reaches the model"""
+from typing import Any, Dict, List, Optional
+
+import pytest
+
+from backends.base import TranslationBackend
+
+
+class FakeBackend(TranslationBackend):
+    """Backend that "translates" by wrapping the text in angle brackets
+
+    Counts one token per word and uses the default translate_batch(), a
+    translate() loop.
+
+    Attributes:
+        calls: Every text passed to translate(), in call order
+        metadata: Extra result metadata per source text,
+            e.g. {"cut off": {"budget_exhausted": True}}
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.calls: List[str] = []
+        self.metadata: Dict[str, Dict[str, Any]] = {}
+
+    def load_model(self, **kwargs) -> Dict[str, Any]:
+        return {"model_loaded": True, "load_time": 0.0, "metadata": {}}
+
+    def get_backend_info(self) -> Dict[str, Any]:
+        return {"backend": "fake"}
+
+    def count_tokens(self, text: str) -> int:
+        return len(text.split())
+
+    def translate(self, text: str, source_lang: str = "en", target_lang: str = "zh-TW",
+                  cancel_token=None, reference: Optional[str] = None) -> Dict[str, Any]:
+        self.calls.append(text)
+        return {
+            "translation": f"<{text}>",
+            "time": 0.5,
+            "tokens": 4,
+            "metadata": {"tokens_per_second": 8.0, **self.metadata.get(text, {})}
+        }
+
+
+class BatchingFakeBackend(FakeBackend):
+    """FakeBackend that overrides translate_batch(), like TransformersBackend
+
+    Attributes:
+        batches: Texts of every translate_batch() call
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.batches: List[List[str]] = []
+
+    def translate_batch(self, texts, source_lang="en", target_lang="zh-TW", cancel_token=None):
+        self.batches.append(list(texts))
+        return [self.translate(text, source_lang, target_lang, cancel_token) for text in texts]
+
+
+@pytest.fixture
+def fake_backend():
+    return FakeBackend()
+
+
+@pytest.fixture
+def batching_backend():
+    return BatchingFakeBackend()
@@ -0,0 +1,108 @@
+"""Tests for LengthBucketScheduler"""
+import pytest
+
+from backends.batch_scheduler import LengthBucketScheduler
+
+
+def test_bucket_for():
+    scheduler = LengthBucketScheduler(bucket_boundaries=(64, 128))
+    assert scheduler.bucket_for(1) == 64
+    assert scheduler.bucket_for(64) == 64
+    assert scheduler.bucket_for(65) == 128
+    assert scheduler.bucket_for(129) == -1
+
+
+def test_invalid_limits():
+    with pytest.raises(ValueError):
+        LengthBucketScheduler(max_batch_tokens=0)
+    with pytest.raises(ValueError):
+        LengthBucketScheduler(max_batch_size=0)
+
+
+def test_plan_groups_by_bucket_longest_first():
+    scheduler = LengthBucketScheduler(max_batch_tokens=100_000, bucket_boundaries=(64, 128, 256))
+    lengths = [40, 200, 10, 100, 60, 250]
+    batches = scheduler.plan(lengths)
+
+    assert [batch.bucket for batch in batches] == [256, 128, 64]
+    # Longest bucket first, longest row first inside each batch
+    assert batches[0].indices == [5, 1]
+    assert batches[1].indices == [3]
+    assert batches[2].indices == [4, 0, 2]
+    for batch in batches:
+        assert batch.lengths == sorted(batch.lengths, reverse=True)
+        assert all(scheduler.bucket_for(length) == batch.bucket for length in batch.lengths)
+    assert sorted(i for batch in batches for i in batch.indices) == list(range(len(lengths)))
+
+
+def test_plan_respects_token_budget():
+    scheduler = LengthBucketScheduler(max_batch_tokens=300, bucket_boundaries=(64,))
+    batches = scheduler.plan([50] * 10, new_tokens=[10] * 10)
+
+    # 5 rows * (50 + 10) = 300 fits, a sixth row does not
+    assert [batch.size for batch in batches] == [5, 5]
+    for batch in batches:
+        assert batch.reserved_tokens <= 300
+
+
+def test_plan_budget_uses_longest_generation_budget():
+    scheduler = LengthBucketScheduler(max_batch_tokens=400, bucket_boundaries=(64,))
+    batches = scheduler.plan([50, 50, 50], new_tokens=[10, 150, 10])
+
+    # The 150-token row sets the generation budget of the whole batch
+    assert all(batch.reserved_tokens <= 400 for batch in batches)
+    assert sum(batch.size for batch in batches) == 3
+    assert [batch.size for batch in batches] == [2, 1]
+
+
+def test_new_tokens_per_row_default():
+    scheduler = LengthBucketScheduler(
+        max_batch_tokens=200, bucket_boundaries=(64,), new_tokens_per_row=50
+    )
+    batches = scheduler.plan([50, 50, 50])
+    assert [batch.size for batch in batches] == [2, 1]
+    assert batches[0].max_new_tokens == 50
+
+
+def test_oversized_row_gets_own_batch():
+    scheduler = LengthBucketScheduler(max_batch_tokens=100, bucket_boundaries=(64,))
+    batches = scheduler.plan([500, 20, 20])
+
+    assert batches[0].indices == [0]
+    assert batches[0].bucket == -1
+    assert batches[0].reserved_tokens > 100
+    assert batches[1].indices == [1, 2]
+
+
+def test_max_batch_size():
+    scheduler = LengthBucketScheduler(max_batch_tokens=100_000, max_batch_size=3)
+    batches = scheduler.plan([10] * 7)
+    assert [batch.size for batch in batches] == [3, 3, 1]
+
+
+def test_restore_order():
+    scheduler = LengthBucketScheduler(max_batch_tokens=150, bucket_boundaries=(64, 128))
+    lengths = [30, 120, 5, 70, 64, 1]
+    batches = scheduler.plan(lengths)
+    assert len(batches) > 1
+
+    # Each "model call" returns one result per row, in batch row order
+    batch_results = [[f"row {index}" for index in batch.indices] for batch in batches]
+    assert LengthBucketScheduler.restore_order(batches, batch_results) == [
+        f"row {index}" for index in range(len(lengths))
+    ]
+
+
+def test_padding_stats():
+    scheduler = LengthBucketScheduler(max_batch_tokens=100_000, bucket_boundaries=(64,))
+    batches = scheduler.plan([60, 30])
+    assert batches[0].padded_tokens == 120
+    assert batches[0].real_tokens == 90
+    assert batches[0].padding_efficiency == pytest.approx(0.75)
+
+    summary = LengthBucketScheduler.summary(batches)
+    assert summary["batches"] == 1
+    assert summary["items"] == 2
+    assert summary["padding_efficiency"] == pytest.approx(0.75)
+    assert summary["per_batch"][0]["batch_size"] == 2
+    assert LengthBucketScheduler.summary([])["padding_efficiency"] == 1.0
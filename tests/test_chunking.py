@@ -0,0 +1,92 @@
+"""Tests for split_text() and join_translations()"""
+from backends.chunking import TextChunk, chunk_separator, join_translations, split_text
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+def test_short_text_is_one_chunk():
+    chunks = split_text("  One short paragraph.  ", 100, count_words)
+    assert chunks == [TextChunk("One short paragraph.", "", 3)]
+
+
+def test_empty_text():
+    assert split_text("", 10, count_words) == []
+    assert split_text(" \n\n ", 10, count_words) == []
+
+
+def test_paragraphs_are_packed_greedily():
+    text = "one two three\n\nfour five\n\nsix seven eight nine"
+    chunks = split_text(text, 5, count_words)
+
+    assert [chunk.text for chunk in chunks] == [
+        "one two three\n\nfour five", "six seven eight nine"
+    ]
+    assert chunks[0].separator == "\n\n"
+    assert chunks[-1].separator == ""
+    assert all(chunk.tokens <= 5 for chunk in chunks)
+
+
+def test_long_paragraph_splits_on_sentences():
+    text = "First sentence is here. Second sentence is here. Third one."
+    chunks = split_text(text, 4, count_words)
+
+    assert [chunk.text for chunk in chunks] == [
+        "First sentence is here.", "Second sentence is here.", "Third one."
+    ]
+    assert [chunk.separator for chunk in chunks] == [" ", " ", ""]
+
+
+def test_cjk_sentences_split_without_spaces():
+    text = "今日は晴れです。明日は雨です。"
+    chunks = split_text(text, 8, len)
+    assert [chunk.text for chunk in chunks] == ["今日は晴れです。", "明日は雨です。"]
+
+
+def test_long_sentence_splits_on_words():
+    chunks = split_text("a b c d e f g", 3, count_words)
+    assert [chunk.text for chunk in chunks] == ["a b c", "d e f", "g"]
+
+
+def test_long_word_splits_on_characters():
+    chunks = split_text("x" * 40, 8, len)
+    assert [chunk.text for chunk in chunks] == ["x" * 8] * 5
+    assert "".join(chunk.text for chunk in chunks) == "x" * 40
+
+
+def test_chunk_separator():
+    assert chunk_separator(TextChunk("a", "\n \n", 1), "fr") == "\n\n"
+    assert chunk_separator(TextChunk("a", "\n", 1), "fr") == "\n"
+    assert chunk_separator(TextChunk("a", " ", 1), "fr") == " "
+    assert chunk_separator(TextChunk("a", " ", 1), "zh-TW") == ""
+    assert chunk_separator(TextChunk("a", " ", 1), "ja") == ""
+    assert chunk_separator(TextChunk("a", "", 1), "fr") == ""
+
+
+def test_join_translations_keeps_breaks():
+    text = "First paragraph.\n\nSecond line\nthird line. Last sentence."
+    chunks = split_text(text, 2, count_words)
+    translations = [f" [{chunk.text}] " for chunk in chunks]
+
+    joined = join_translations(translations, chunks, "fr")
+    assert joined == "[First paragraph.]\n\n[Second line]\n[third line.] [Last sentence.]"
+    joined = join_translations(translations, chunks, "zh-TW")
+    assert joined == "[First paragraph.]\n\n[Second line]\n[third line.][Last sentence.]"
+
+
+def test_translate_chunked_merges_results(fake_backend):
+    fake_backend.max_chunk_tokens = 3
+    fake_backend.metadata["Two three four."] = {"repetition_stopped": True}
+    text = "One.\n\nTwo three four."
+
+    assert fake_backend.needs_chunking(text)
+    result = fake_backend.translate_chunked(text, "en", "fr")
+
+    assert fake_backend.calls == ["One.", "Two three four."]
+    assert result["translation"] == "<One.>\n\n<Two three four.>"
+    assert result["time"] == 1.0
+    assert result["tokens"] == 8
+    assert result["metadata"]["chunks"] == 2
+    assert result["metadata"]["chunk_tokens"] == [1, 3]
+    assert result["metadata"]["chunk_metadata"][1]["repetition_stopped"] is True
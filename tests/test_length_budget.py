@@ -0,0 +1,113 @@
+"""Tests for LengthBudget"""
+import json
+import math
+import statistics
+
+import pytest
+
+from backends.length_budget import LengthBudget, estimate_tokens
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 1
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("今日は") == 3
+    assert estimate_tokens("今日は abcd") == 5
+
+
+def test_default_ratio_until_min_samples():
+    budget = LengthBudget(path="", default_ratio=3.0, slack=10, min_samples=3, min_tokens=1)
+    assert budget.budget(100, "en", "ja") == 310
+
+    budget.record(100, 100, "en", "ja")
+    budget.record(100, 100, "en", "ja")
+    assert budget.ratio_bound("en", "ja") == 3.0
+    budget.record(100, 100, "en", "ja")
+    # Three identical ratios: mean 1.0, std 0.0
+    assert budget.ratio_bound("en", "ja") == pytest.approx(1.0)
+    assert budget.budget(100, "en", "ja") == 110
+
+
+def test_ratio_bound_is_mean_plus_z_std():
+    ratios = [1.0, 1.5, 2.0, 1.2, 0.8]
+    budget = LengthBudget(path="", z=2.0, slack=0, min_samples=5, min_tokens=1, max_tokens=10_000)
+    for ratio in ratios:
+        budget.record(100, int(ratio * 100), "en", "fr")
+
+    bound = statistics.mean(ratios) + 2.0 * statistics.stdev(ratios)
+    assert budget.ratio_bound("en", "fr") == pytest.approx(bound)
+    assert budget.budget(50, "en", "fr") == math.ceil(50 * bound)
+
+    stats = budget.stats()["en->fr"]
+    assert stats["count"] == 5
+    assert stats["mean_ratio"] == pytest.approx(statistics.mean(ratios))
+    assert stats["std_ratio"] == pytest.approx(statistics.stdev(ratios))
+    assert stats["max_ratio"] == pytest.approx(2.0)
+
+
+def test_language_pairs_are_separate():
+    budget = LengthBudget(path="", min_samples=1, z=0.0, slack=0, min_tokens=1)
+    budget.record(10, 20, "en", "de")
+    assert budget.ratio_bound("en", "de") == pytest.approx(2.0)
+    assert budget.ratio_bound("de", "en") == budget.default_ratio
+
+
+def test_budget_is_clamped():
+    budget = LengthBudget(path="", default_ratio=3.0, slack=0, min_tokens=32, max_tokens=100)
+    assert budget.budget(1, "en", "ja") == 32
+    assert budget.budget(1000, "en", "ja") == 100
+
+
+def test_record_ignores_empty_runs():
+    budget = LengthBudget(path="")
+    budget.record(0, 10, "en", "ja")
+    budget.record(10, 0, "en", "ja")
+    assert budget.stats() == {}
+
+
+def test_save_and_load(tmp_path):
+    path = tmp_path / "budget.json"
+    budget = LengthBudget(namespace="ollama", path=str(path), save_every=100)
+    budget.record(10, 25, "en", "ja")
+    assert not path.exists()
+
+    budget.save()
+    reloaded = LengthBudget(namespace="ollama", path=str(path))
+    assert reloaded.stats() == budget.stats()
+    # Other namespaces do not see the records
+    assert LengthBudget(namespace="mlx", path=str(path)).stats() == {}
+
+
+def test_save_every(tmp_path):
+    path = tmp_path / "budget.json"
+    budget = LengthBudget(path=str(path), save_every=2)
+    budget.record(10, 20, "en", "ja")
+    assert not path.exists()
+    budget.record(10, 20, "en", "ja")
+    assert json.loads(path.read_text())["default"]["en->ja"]["count"] == 2
+
+
+def test_save_keeps_other_namespaces(tmp_path):
+    path = tmp_path / "budget.json"
+    first = LengthBudget(namespace="transformers", path=str(path))
+    first.record(10, 20, "en", "ja")
+    first.save()
+    second = LengthBudget(namespace="ollama", path=str(path))
+    second.record(10, 30, "en", "ko")
+    second.save()
+
+    data = json.loads(path.read_text())
+    assert set(data) == {"transformers", "ollama"}
+    assert data["transformers"]["en->ja"]["count"] == 1
+    assert data["ollama"]["en->ko"]["count"] == 1
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_unreadable_file_starts_empty(tmp_path):
+    path = tmp_path / "budget.json"
+    path.write_text("not json")
+    budget = LengthBudget(path=str(path))
+    assert budget.stats() == {}
+    budget.record(10, 20, "en", "ja")
+    budget.save()
+    assert json.loads(path.read_text())["default"]["en->ja"]["count"] == 1
@@ -0,0 +1,66 @@
+"""Tests for segment deduplication across PDF pages"""
+import pytest
+
+from backends.segment_dedup import merge_segment_results, plan_dedup, translate_pages
+
+
+def test_plan_dedup():
+    plan = plan_dedup(["Header", "Body one", " ", "Header ", "Body two", "Header"])
+
+    assert plan.unique == ["Header", "Body one", "Body two"]
+    assert plan.positions == [0, 1, None, 0, 2, 0]
+    assert plan.dedup_ratio == pytest.approx(1 - 3 / 5)
+    stats = plan.stats()
+    assert stats["segments"] == 6
+    assert stats["unique_segments"] == 3
+
+
+def test_translate_pages_translates_each_segment_once(batching_backend):
+    pages = [["Header", "Intro"], ["Header", "", "Methods"], ["Header", "Intro"]]
+    results = list(translate_pages(batching_backend, pages, "en", "fr"))
+
+    assert sorted(batching_backend.calls) == ["Header", "Intro", "Methods"]
+    assert [[r["translation"] for r in page] for page in results] == [
+        ["<Header>", "<Intro>"], ["<Header>", "", "<Methods>"], ["<Header>", "<Intro>"]
+    ]
+    assert [[r["metadata"]["segment_dedup"] for r in page] for page in results] == [
+        ["unique", "unique"], ["duplicate", "empty", "unique"], ["duplicate", "duplicate"]
+    ]
+    assert results[0][0]["metadata"]["occurrences"] == 3
+    assert results[1][0]["tokens"] == 0
+    assert results[1][0]["time"] == 0.0
+
+
+def test_translate_pages_groups_in_page_order(batching_backend):
+    pages = [["a", "b"], ["c", "a"], ["d", "e", "f"], ["g"]]
+    pages_done = []
+    for page in translate_pages(batching_backend, pages, max_group_segments=3):
+        pages_done.append(len(batching_backend.calls))
+
+    # Pages 1-2 share a group; page 3 would overflow it and starts the next one
+    assert batching_backend.batches == [["a", "b", "c"], ["d", "e", "f"], ["g"]]
+    assert pages_done == [3, 3, 6, 7]
+
+
+def result(translation: str, time: float, tokens: int, **metadata):
+    return {"translation": translation, "time": time, "tokens": tokens, "metadata": metadata}
+
+
+def test_merge_segment_results():
+    results = [
+        result(" Titre ", 1.0, 4, segment_dedup="unique"),
+        result("", 0.0, 0, segment_dedup="empty"),
+        result("Titre", 0.0, 0, segment_dedup="duplicate"),
+        result("Corps", 1.0, 6, chunks=2, error="timeout"),
+    ]
+    merged = merge_segment_results(results)
+
+    assert merged["translation"] == "Titre\n\nTitre\n\nCorps"
+    assert merged["time"] == 2.0
+    assert merged["tokens"] == 10
+    assert merged["metadata"]["segments"] == 4
+    assert merged["metadata"]["duplicate_segments"] == 1
+    assert merged["metadata"]["chunks"] == 4
+    assert merged["metadata"]["tokens_per_second"] == pytest.approx(5.0)
+    assert merged["metadata"]["error"] == "timeout"
+    assert merge_segment_results(results, separator="\n")["translation"] == "Titre\nTitre\nCorps"
@@ -0,0 +1,152 @@
+"""Tests for TranslationCache and CachedBackend"""
+from backends.translation_cache import CachedBackend, TranslationCache, cache_key, normalize_text
+from backends.translation_store import TranslationStore
+
+
+def result(translation: str, **metadata):
+    return {"translation": translation, "time": 1.0, "tokens": 3, "metadata": metadata}
+
+
+def test_normalize_text():
+    assert normalize_text("  a \t b\r\nc  d  ") == "a b\nc d"
+    # NFC: a decomposed é matches the composed one
+    assert normalize_text("e\u0301") == "\u00e9"
+
+
+def test_cache_key():
+    params = {"model_id": "m"}
+    key = cache_key("Hello  world", "en", "ja", params)
+    assert key == cache_key(" Hello world ", "en", "ja", params)
+    assert key != cache_key("Hello world", "en", "ko", params)
+    assert key != cache_key("Hello world", "en", "ja", {"model_id": "n"})
+    assert cache_key("a\nb", "en", "ja", params) != cache_key("a b", "en", "ja", params)
+
+
+def test_get_returns_a_copy():
+    cache = TranslationCache()
+    cache.put("k", result("x"))
+    cache.get("k")["metadata"]["changed"] = True
+    assert cache.get("k") == result("x")
+    assert cache.get("missing") is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_lru_by_entries():
+    cache = TranslationCache(max_entries=2)
+    cache.put("a", result("a"))
+    cache.put("b", result("b"))
+    cache.get("a")
+    cache.put("c", result("c"))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.evictions == 1
+
+
+def test_lru_by_bytes():
+    small = TranslationCache()
+    small.put("a", result("a"))
+    entry_bytes = small.total_bytes
+
+    cache = TranslationCache(max_bytes=2 * entry_bytes)
+    cache.put("a", result("a"))
+    cache.put("b", result("b"))
+    cache.put("c", result("c"))
+    assert len(cache) == 2
+    assert cache.get("a") is None
+    assert cache.total_bytes <= cache.max_bytes
+
+    # Replacing a key does not count its old size twice
+    cache.put("c", result("c"))
+    assert cache.total_bytes == 2 * entry_bytes
+
+
+def test_result_over_max_bytes_is_not_cached():
+    cache = TranslationCache(max_bytes=50)
+    assert not cache.put("k", result("x" * 100))
+    assert len(cache) == 0
+
+
+def test_hits_skip_the_backend(fake_backend):
+    backend = CachedBackend(fake_backend)
+    first = backend.translate("Figure 3", "en", "ja")
+    second = backend.translate("Figure  3 ", "en", "ja")
+
+    assert fake_backend.calls == ["Figure 3"]
+    assert first["metadata"]["translation_cache"] == "miss"
+    assert second["translation"] == first["translation"]
+    assert second["tokens"] == 0
+    assert second["metadata"]["translation_cache"] == "hit"
+    assert second["metadata"]["cached_tokens"] == 4
+    backend.translate("Figure 3", "en", "ko")
+    assert len(fake_backend.calls) == 2
+
+
+def test_batch_repeats_are_translated_once(batching_backend):
+    backend = CachedBackend(batching_backend)
+    backend.translate("cached", "en", "ja")
+
+    results = backend.translate_batch(["a", "b", "a", "cached", "c"], "en", "ja")
+    assert [r["translation"] for r in results] == ["<a>", "<b>", "<a>", "<cached>", "<c>"]
+    assert [r["metadata"]["translation_cache"] for r in results] == [
+        "miss", "miss", "hit", "hit", "miss"
+    ]
+    # All misses in one call to a backend that batches
+    assert batching_backend.batches[-1] == ["a", "b", "c"]
+
+
+def test_loop_backend_gets_one_text_at_a_time(fake_backend):
+    backend = CachedBackend(fake_backend)
+    backend.translate_batch(["a", "b", "c"], "en", "ja")
+    assert fake_backend.calls == ["a", "b", "c"]
+    assert len(backend.cache) == 3
+
+
+def test_max_batch_size(batching_backend):
+    backend = CachedBackend(batching_backend, max_batch_size=2)
+    backend.translate_batch(["a", "b", "c", "d", "e"], "en", "ja")
+    assert batching_backend.batches == [["a", "b"], ["c", "d"]]
+    # A one-text remainder goes to translate()
+    assert batching_backend.calls[-1] == "e"
+
+
+def test_errors_and_truncated_results_are_not_cached(fake_backend):
+    store = TranslationStore(path="")
+    backend = CachedBackend(fake_backend, store=store)
+    fake_backend.metadata.update({
+        "error": {"error": "timeout"},
+        "budget": {"budget_exhausted": True},
+        "loop": {"repetition_stopped": True}
+    })
+    backend.translate_batch(["error", "budget", "loop", "fine"], "en", "ja")
+    backend.translate_batch(["error", "budget", "loop", "fine"], "en", "ja")
+
+    assert fake_backend.calls == ["error", "budget", "loop", "fine", "error", "budget", "loop"]
+    assert len(backend.cache) == 1
+    assert len(store) == 1
+
+
+def test_truncated_chunk_is_not_cached(fake_backend):
+    fake_backend.max_chunk_tokens = 2
+    fake_backend.metadata["three four."] = {"budget_exhausted": True}
+    backend = CachedBackend(fake_backend)
+
+    merged = backend.translate("One two.\n\nthree four.", "en", "ja")
+    assert merged["metadata"]["chunks"] == 2
+    # Only the complete chunk is cached
+    assert len(backend.cache) == 1
+    backend.translate("One two.\n\nthree four.", "en", "ja")
+    assert fake_backend.calls == ["One two.", "three four.", "three four."]
+
+
+def test_store_hits_fill_the_cache(fake_backend):
+    store = TranslationStore(path="")
+    CachedBackend(fake_backend, store=store).translate("Hello", "en", "ja")
+
+    backend = CachedBackend(fake_backend, store=store)
+    hit = backend.translate("Hello", "en", "ja")
+    assert hit["metadata"]["translation_cache"] == "store"
+    assert backend.translate("Hello", "en", "ja")["metadata"]["translation_cache"] == "hit"
+    assert fake_backend.calls == ["Hello"]
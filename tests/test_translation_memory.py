@@ -0,0 +1,153 @@
+"""Tests for TranslationMemory, adapt_translation() and TMX import/export"""
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from backends.translation_cache import CachedBackend
+from backends.translation_memory import TranslationMemory, adapt_translation, char_ngrams
+
+SOURCE = "Table 3 shows the results of the second experiment on the validation set."
+TRANSLATION = "表 3 は検証セットにおける第二の実験の結果を示す。"
+
+
+def test_char_ngrams():
+    assert char_ngrams("Abcd") == {"abc", "bcd"}
+    assert char_ngrams("ab") == {"ab"}
+
+
+def test_adapt_translation_replaces_numbers():
+    adapted = adapt_translation(
+        "Table 3 lists 12 runs.", "Table 4 lists 15 runs.", "表 3 は 12 回の実行を示す。"
+    )
+    assert adapted == "表 4 は 15 回の実行を示す。"
+
+
+def test_adapt_translation_matches_next_to_cjk():
+    assert adapt_translation("See Figure 2.", "See Figure 5.", "図2を参照。") == "図5を参照。"
+
+
+def test_adapt_translation_refuses_unsafe_changes():
+    # The changed word is not in the translation
+    assert adapt_translation("the first run", "the second run", "最初の実行") is None
+    # The changed word appears twice
+    assert adapt_translation("Step 1", "Step 2", "ステップ 1（1 回目）") is None
+    # Inserted words cannot be carried over
+    assert adapt_translation("Table 3", "Table 3 and 4", "表 3") is None
+
+
+def test_exact_match():
+    memory = TranslationMemory()
+    memory.add(SOURCE, TRANSLATION, "en", "ja")
+    match = memory.lookup("  " + SOURCE, "en", "ja")
+
+    assert match.kind == "exact"
+    assert match.similarity == 1.0
+    assert match.reusable
+    assert memory.lookup(SOURCE, "en", "ko") is None
+
+
+def test_adapted_match():
+    memory = TranslationMemory()
+    memory.add(SOURCE, TRANSLATION, "en", "ja")
+    match = memory.lookup(SOURCE.replace("Table 3", "Table 7"), "en", "ja")
+
+    assert match.kind == "adapted"
+    assert match.translation == TRANSLATION.replace("表 3", "表 7")
+    assert match.similarity >= memory.min_similarity
+
+
+def test_changed_word_is_only_a_near_match():
+    memory = TranslationMemory(reuse_similarity=0.9)
+    memory.add(SOURCE, TRANSLATION, "en", "ja")
+    match = memory.lookup(SOURCE.replace("second", "third"), "en", "ja")
+
+    assert match.kind == "near"
+    assert not match.reusable
+    assert match.entry.translation == TRANSLATION
+
+
+def test_punctuation_change_is_fuzzy_with_reuse_similarity():
+    changed = SOURCE.replace(" results of", " results, of")
+    memory = TranslationMemory()
+    memory.add(SOURCE, TRANSLATION, "en", "ja")
+    assert memory.lookup(changed, "en", "ja").kind == "near"
+
+    memory = TranslationMemory(reuse_similarity=0.9)
+    memory.add(SOURCE, TRANSLATION, "en", "ja")
+    match = memory.lookup(changed, "en", "ja")
+    assert match.kind == "fuzzy"
+    assert match.translation == TRANSLATION
+
+
+def test_dissimilar_segment_misses():
+    memory = TranslationMemory()
+    memory.add(SOURCE, TRANSLATION, "en", "ja")
+    assert memory.lookup("An entirely unrelated sentence about something else.", "en", "ja") is None
+    assert memory.stats()["misses"] == 1
+
+
+def test_add_replaces_same_source():
+    memory = TranslationMemory()
+    memory.add(SOURCE, "old", "en", "ja")
+    memory.add(SOURCE + " ", TRANSLATION, "en", "ja")
+    memory.add("", "ignored", "en", "ja")
+    assert len(memory) == 1
+    assert memory.lookup(SOURCE, "en", "ja").translation == TRANSLATION
+
+
+def test_num_perm_must_divide_into_bands():
+    with pytest.raises(ValueError):
+        TranslationMemory(num_perm=64, bands=10)
+
+
+def test_tmx_round_trip(tmp_path):
+    memory = TranslationMemory()
+    memory.add(SOURCE, TRANSLATION, "en", "ja")
+    memory.add("Results & discussion <draft>", "結果と考察", "en", "ja")
+    memory.add("Conclusion", "Conclusión", "en", "es")
+    path = tmp_path / "memory.tmx"
+    memory.export_tmx(str(path))
+
+    root = ET.parse(path).getroot()
+    assert root.get("version") == "1.4"
+    assert root.find("header").get("srclang") == "en"
+
+    imported = TranslationMemory()
+    assert imported.import_tmx(str(path)) == 3
+    assert [(e.source, e.translation, e.source_lang, e.target_lang) for e in imported.entries] == [
+        (e.source, e.translation, e.source_lang, e.target_lang) for e in memory.entries
+    ]
+    assert all(entry.origin == "tmx" for entry in imported.entries)
+
+
+def test_import_tmx_languages(tmp_path):
+    path = tmp_path / "in.tmx"
+    path.write_text(
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<tmx version="1.4"><header srclang="*all*"/><body>'
+        '<tu><tuv xml:lang="EN-US"><seg>Hello <ph>x</ph>world</seg></tuv>'
+        '<tuv xml:lang="fr"><seg>Bonjour le monde</seg></tuv>'
+        '<tuv xml:lang="de"><seg>Hallo Welt</seg></tuv></tu>'
+        '</body></tmx>',
+        encoding="utf-8"
+    )
+    with pytest.raises(ValueError):
+        TranslationMemory().import_tmx(str(path))
+
+    memory = TranslationMemory()
+    assert memory.import_tmx(str(path), source_lang="en") == 2
+    assert memory.lookup("Hello xworld", "en", "fr").translation == "Bonjour le monde"
+    assert memory.lookup("Hello xworld", "en", "de").translation == "Hallo Welt"
+
+
+def test_cached_backend_reuses_memory(fake_backend):
+    memory = TranslationMemory()
+    backend = CachedBackend(fake_backend, memory=memory)
+    backend.translate("Figure 3 shows the model architecture in detail.", "en", "ja")
+
+    result = backend.translate("Figure 4 shows the model architecture in detail.", "en", "ja")
+    assert result["translation"] == "<Figure 4 shows the model architecture in detail.>"
+    assert result["metadata"]["translation_cache"] == "memory"
+    assert result["metadata"]["memory_match"] == "adapted"
+    assert len(fake_backend.calls) == 1
+    assert memory.stats()["saved_calls"] == 1
@@ -0,0 +1,101 @@
+"""Tests for TranslationStore"""
+import time
+
+import pytest
+
+from backends.translation_store import TranslationStore
+
+
+def result(translation: str):
+    return {"translation": translation, "time": 1.0, "tokens": 3, "metadata": {}}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Settable time.time() for the store"""
+    now = [1_000_000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+
+def test_put_get_and_persistence(tmp_path):
+    path = tmp_path / "store.sqlite3"
+    store = TranslationStore(path=str(path))
+    assert store.put("k", result("x"))
+    assert store.get("k") == result("x")
+    assert store.get("missing") is None
+    store.close()
+
+    reopened = TranslationStore(path=str(path))
+    assert reopened.get("k") == result("x")
+    assert len(reopened) == 1
+    assert reopened.stats()["hits"] == 1
+
+
+def test_get_honours_max_age(clock):
+    store = TranslationStore(path="", max_age=100)
+    store.put("k", result("x"))
+    clock[0] += 60
+    assert store.get("k") is not None
+    # The hit renewed the entry
+    clock[0] += 60
+    assert store.get("k") is not None
+    clock[0] += 101
+    assert store.get("k") is None
+
+
+def test_compact_by_age(clock):
+    store = TranslationStore(path="")
+    store.put("old", result("x"))
+    clock[0] += 50
+    store.put("new", result("y"))
+    clock[0] += 50
+
+    assert store.compact(max_age=75) == 1
+    assert store.get("old") is None
+    assert store.get("new") is not None
+    assert store.stats()["evictions"] == 1
+
+
+def test_compact_by_entries_keeps_recently_used(clock):
+    store = TranslationStore(path="")
+    for key in "abcd":
+        store.put(key, result(key))
+        clock[0] += 1
+    store.get("a")
+
+    assert store.compact(max_entries=2) == 2
+    assert store.get("a") is not None
+    assert store.get("d") is not None
+    assert len(store) == 2
+
+
+def test_compact_by_bytes_keeps_recently_used(clock):
+    store = TranslationStore(path="")
+    for key in "abcd":
+        store.put(key, result(key))
+        clock[0] += 1
+    entry_bytes = store.stats()["bytes"] // 4
+    store.get("b")
+
+    assert store.compact(max_bytes=2 * entry_bytes + entry_bytes // 2) == 2
+    assert store.get("b") is not None
+    assert store.get("d") is not None
+    assert store.stats()["bytes"] == 2 * entry_bytes
+
+
+def test_constructor_limits_apply_on_open(tmp_path, clock):
+    path = tmp_path / "store.sqlite3"
+    store = TranslationStore(path=str(path))
+    for key in "abc":
+        store.put(key, result(key))
+        clock[0] += 1
+    store.close()
+
+    assert len(TranslationStore(path=str(path), max_entries=1)) == 1
+
+
+def test_put_over_max_bytes():
+    store = TranslationStore(path="", max_bytes=50)
+    assert not store.put("k", result("x" * 100))
+    assert len(store) == 0
@@ -16,6 +16,8 @@ def translate_full_pdf():
 
     # Import backend
     from ollama_backend import OllamaBackend
+    from translation_cache import CachedBackend
+    from translation_store import TranslationStore
     import fitz
 
     # Configuration (same as Colab)
@@ -41,7 +43,9 @@ def translate_full_pdf():
 
     # Load backend
     print("🔄 Loading Ollama backend...")
-    backend = OllamaBackend()
+    # Pages translated by an earlier run (e.g. before a crash) come from the store
+    store = TranslationStore()
+    backend = CachedBackend(OllamaBackend(), store=store)
     backend.load_model()
     print("✅ Model ready!\n")
 
@@ -106,6 +110,9 @@ def translate_full_pdf():
     print(f"Total pages: {len(results)}")
     print(f"Total time: {total_time:.1f}s ({total_time/60:.1f} minutes)")
     print(f"Average: {total_time/len(results):.1f}s per page")
+    store_stats = store.stats()
+    print(f"Translation store: {store_stats['hits']} hits, {store_stats['misses']} misses "
+          f"({store_stats['hit_rate']:.0%} hit rate)")
     print(f"Output: {output_path}")
     print(f"\n🕐 Completed: {datetime.now().strftime('%H:%M:%S')}")
     print("="*80)